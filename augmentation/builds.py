@@ -0,0 +1,147 @@
+"""
+Builds
+
+This module hosts the manifest of resumable dataset builds. A build writes
+fixed size npz shards (see <writers.NpzShardWriter>), each generated from
+its own child of the build seed, so any shard can be regenerated alone and
+bit-identically. The manifest records the build configuration (including
+the seed entropy), and the size and sha256 checksum of every completed
+shard. It is rewritten atomically after each shard, so an interrupted build
+only loses the shards in progress and a rerun regenerates those alone.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+
+MANIFEST_FILENAME = 'manifest.json'
+
+MANIFEST_VERSION = 1
+
+# bytes hashed per read when computing shard checksums
+CHECKSUM_CHUNK_SIZE = 1 << 20
+
+
+def file_sha256(filename):
+    """
+    Returns the hex sha256 digest of the content of <filename>.
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as binary:
+        for chunk in iter(lambda: binary.read(CHECKSUM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class BuildManifest():
+    """
+    Configuration and completed shards of a resumable build, kept as
+    <MANIFEST_FILENAME> in the build output directory. Use <open>.
+
+    Parameters
+    ----------
+    path:
+        The manifest file path.
+    config:
+        Dict of the build configuration, including its 'seed' entropy.
+    shards:
+        Dict mapping completed shard indexes (str) to their 'n_images',
+        'size' and 'sha256'. Default is None (no shard completed).
+    """
+    def __init__(self, path, config, shards=None):
+        self.path = path
+        self.config = config
+        self.shards = {} if shards is None else shards
+
+    @classmethod
+    def open(cls, output_dir, config):
+        """
+        Returns the manifest of the build of <config> in <output_dir>,
+        loaded when the directory holds one, else created. A <config> seed
+        of None means a fresh seed for a new build, and the recorded seed
+        when resuming. Raises when the recorded build differs from <config>,
+        as its shards cannot be completed with other settings.
+        """
+        path = os.path.join(output_dir, MANIFEST_FILENAME)
+        config = dict(config)
+        if not os.path.exists(path):
+            if config['seed'] is None:
+                config['seed'] = np.random.SeedSequence().entropy
+            manifest = cls(path, config)
+            manifest.save()
+            return manifest
+
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('version') != MANIFEST_VERSION:
+            raise Exception(
+                'Error: Unsupported build manifest version {version} in '
+                '{path}.'.format(version=manifest.get('version'), path=path)
+            )
+        if config['seed'] is None:
+            config['seed'] = manifest['config']['seed']
+        # json turns tuples into lists
+        config = json.loads(json.dumps(config))
+        mismatches = sorted(
+            key for key in set(config) | set(manifest['config'])
+            if config.get(key) != manifest['config'].get(key)
+        )
+        if mismatches:
+            raise Exception(
+                'Error: {path} records a different build: {keys} differ. '
+                'Rerun with the recorded settings or use a new output '
+                'directory.'.format(path=path, keys=mismatches)
+            )
+
+        return cls(path, manifest['config'], manifest['shards'])
+
+    def save(self):
+        """
+        Writes the manifest atomically: readers, and a rerun after a crash,
+        see either the previous or the new manifest, never a partial one.
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(
+                {
+                    'version': MANIFEST_VERSION,
+                    'config': self.config,
+                    'shards': self.shards,
+                },
+                manifest_file, indent=1, sort_keys=True
+            )
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def complete(self, shard_ix, record):
+        """
+        Records shard <shard_ix> as completed with its <record> ('n_images',
+        'size' and 'sha256'), and saves the manifest.
+        """
+        self.shards[str(shard_ix)] = record
+        self.save()
+
+    def completed_shards(self, shard_paths, verify=False):
+        """
+        Returns the set of recorded shards whose file, in the <shard_paths>
+        list, still has its recorded size, and also its recorded checksum
+        when <verify> is set. Other recorded shards are forgotten, so they
+        are generated again.
+        """
+        completed = set()
+        for (key, record) in list(self.shards.items()):
+            shard_ix = int(key)
+            path = shard_paths[shard_ix]
+            if (
+                os.path.exists(path)
+                and os.path.getsize(path) == record['size']
+                and (not verify or file_sha256(path) == record['sha256'])
+            ):
+                completed.add(shard_ix)
+            else:
+                del self.shards[key]
+
+        return completed
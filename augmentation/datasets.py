@@ -0,0 +1,103 @@
+"""
+Datasets
+
+This module hosts index-addressable views over sequence generators. Items
+are generated on access from a random stream derived from (seed, index), so
+a dataset of any length is stored nowhere and item <i> is always the same.
+"""
+import numpy as np
+
+
+class SequenceDataset():
+    """
+    Virtual dataset of random number sequence images.
+
+    Item <i> is an (image, labels) pair generated with a RandomState seeded
+    from the child <i> of <seed>'s SeedSequence, independently of numpy's
+    global random state and of any other item. Shuffled or distributed
+    loaders can read any index, in any order, from any process, e.g. worker
+    <k> of <n> reading <range(k, len(dataset), n)>. Datasets pickle with
+    their generator, e.g. to spawned loader workers; over a generator
+    attached to shared data (see <NumberSequenceGenerator.share>), without
+    copying its arrays.
+
+    Parameters
+    ----------
+    generator:
+        A NumberSequenceGenerator providing digit images and spacing method.
+    n_samples:
+        Number of items in the dataset.
+    n_digits:
+        Number of digits per sequence. Digits are drawn uniformly from the
+        labels present in the generator dataset.
+    spacing_range:
+        A (minimum, maximum) pair (tuple), representing the min and max
+        spacing between digits. Unit should be pixel.
+    image_width:
+        specifies the width of the images in pixels.
+    seed:
+        Base seed (int) of the dataset. Default is 0.
+    """
+    def __init__(self, generator, n_samples, n_digits, spacing_range,
+                 image_width, seed=0):
+        if not isinstance(n_samples, int) or n_samples < 0:
+            raise Exception(
+                'Error: Wrong <n_samples> input: expected a non negative '
+                '<int>, got {input}'.format(input=n_samples)
+            )
+        if generator.digit_sampling == 'epoch':
+            raise Exception(
+                "Error: Items could not be generated independently of each "
+                "other with <digit_sampling>: 'epoch'. Use 'random'."
+            )
+        generator._validate_image_width(spacing_range, image_width, n_digits)
+        generator._validate_spacing_range(spacing_range)
+        self.generator = generator
+        self.n_samples = n_samples
+        self.n_digits = n_digits
+        self.spacing_range = spacing_range
+        self.image_width = image_width
+        self.seed = seed
+        self._available_digits = generator._available_digits()
+
+    def __len__(self):
+        return self.n_samples
+
+    def _random_state(self, index):
+        """
+        Returns the RandomState of item <index>.
+        """
+        seed_sequence = np.random.SeedSequence(self.seed, spawn_key=(index,))
+
+        return np.random.RandomState(seed_sequence.generate_state(4))
+
+    def __getitem__(self, index):
+        """
+        Returns item <index> as an (image, labels) pair: a float32 array of
+        [image_height x image_width] and the int array of its <n_digits>
+        digits.
+        """
+        if not isinstance(index, (int, np.integer)):
+            raise TypeError(
+                'Error: Wrong <index> input: expected <int>, got {input}'
+                .format(input=type(index))
+            )
+        if index < 0:
+            index += self.n_samples
+        if not 0 <= index < self.n_samples:
+            raise IndexError(
+                'Error: <index> out of range for a dataset of {n_samples} '
+                'items.'.format(n_samples=self.n_samples)
+            )
+        random_state = self._random_state(int(index))
+        labels = self._available_digits[
+            random_state.randint(
+                0, len(self._available_digits), self.n_digits
+            )
+        ]
+        image = self.generator.generate_numbers_sequence(
+            labels.tolist(), self.spacing_range, self.image_width,
+            random_state
+        )
+
+        return (image, labels)
@@ -0,0 +1,198 @@
+"""
+IDX
+
+This module hosts readers and writers for the idx fileformat, as described and
+used on the MNIST project. Arrays are exposed as memory-mapped views of the
+files, so no pixel is copied or converted when a dataset is opened.
+
+Gzip compressed idx files ('.gz', as MNIST is distributed) are decoded in a
+streaming way. Decoded arrays can be kept in a cache directory as '.npy'
+files, so later reads memory-map the cache instead of decompressing again.
+"""
+import os
+import gzip
+import struct
+import hashlib
+import numpy as np
+
+
+# idx data type byte (third byte of the magic number) to numpy dtype.
+# Multi-byte types are stored big endian.
+IDX_DTYPES = {
+    0x08: np.dtype('>u1'),
+    0x09: np.dtype('>i1'),
+    0x0B: np.dtype('>i2'),
+    0x0C: np.dtype('>i4'),
+    0x0D: np.dtype('>f4'),
+    0x0E: np.dtype('>f8'),
+}
+
+
+def read_idx_header(idx_binary):
+    """
+    Parses the header of an idx file from an open binary file object.
+    Returns a (dtype, shape, header_size) tuple.
+    """
+    magic = idx_binary.read(4)
+    if len(magic) != 4 or magic[0] != 0 or magic[1] != 0:
+        raise Exception(
+            'Error: Not an idx file. Bad magic number: {magic}'
+            .format(magic=magic)
+        )
+    (dtype_code, n_dims) = (magic[2], magic[3])
+    if dtype_code not in IDX_DTYPES:
+        raise Exception(
+            'Error: Unsupported idx data type byte: {code:#04x}'
+            .format(code=dtype_code)
+        )
+    dims_bytes = idx_binary.read(4 * n_dims)
+    if len(dims_bytes) != 4 * n_dims:
+        raise Exception('Error: Truncated idx header.')
+    shape = struct.unpack('>' + 'I' * n_dims, dims_bytes)
+
+    return (IDX_DTYPES[dtype_code], shape, 4 + 4 * n_dims)
+
+
+# bytes decompressed per read when decoding gzip idx files
+GZIP_CHUNK_SIZE = 1 << 20
+
+
+def read_idx(filename, mode='r', cache_dir=None):
+    """
+    Opens an idx file as a numpy array memory-mapped onto the file, read-only
+    unless <mode> is 'r+'. Data is paged in on access, so opening cost does
+    not depend on file size.
+
+    Gzip files ('.gz') are decompressed, read-only. If <cache_dir> is given,
+    the decoded array is stored there as '.npy', keyed by the source path,
+    size and modification time, and memory-mapped on later reads.
+    """
+    if filename.endswith('.gz'):
+        if mode != 'r':
+            raise Exception(
+                'Error: Gzip idx files can only be opened read-only.'
+            )
+        if cache_dir is None:
+            return _decode_gzip_idx(filename)
+        return _read_cached_gzip_idx(filename, cache_dir)
+
+    with open(filename, 'rb') as idx_binary:
+        (dtype, shape, offset) = read_idx_header(idx_binary)
+    n_items = int(np.prod(shape, dtype=np.int64))
+    data_size = n_items * dtype.itemsize
+    if os.path.getsize(filename) < offset + data_size:
+        raise Exception(
+            'Error: Truncated idx file {filename}: header declares shape '
+            '{shape} but the file is too small.'
+            .format(filename=filename, shape=shape)
+        )
+    if n_items == 0:
+        array = np.empty(shape, dtype=dtype)
+        array.flags.writeable = (mode != 'r')
+        return array
+
+    return np.memmap(
+        filename, dtype=dtype, mode=mode, offset=offset, shape=shape
+    ).view(np.ndarray)
+
+
+def create_idx(filename, dtype, shape):
+    """
+    Creates an idx file of <shape> and <dtype>, zero filled, and returns it as
+    a writable numpy array memory-mapped onto the file. The file is sized
+    up front and pages are written back by the OS, so arrays larger than
+    memory can be filled in place.
+    """
+    dtype = np.dtype(dtype).newbyteorder('>')
+    dtype_codes = {
+        value.str: key for (key, value) in IDX_DTYPES.items()
+    }
+    if dtype.str not in dtype_codes:
+        raise Exception(
+            'Error: Unsupported idx data type: {dtype}'.format(dtype=dtype)
+        )
+    header = (
+        bytes([0, 0, dtype_codes[dtype.str], len(shape)])
+        + struct.pack('>' + 'I' * len(shape), *shape)
+    )
+    n_items = int(np.prod(shape, dtype=np.int64))
+    with open(filename, 'wb') as idx_binary:
+        idx_binary.write(header)
+        idx_binary.truncate(len(header) + n_items * dtype.itemsize)
+
+    return read_idx(filename, mode='r+')
+
+
+def _decode_gzip_idx(filename, allocate=None):
+    """
+    Decompresses a gzip idx file chunk by chunk straight into the array
+    returned by <allocate(shape, dtype)> (default: a new in-memory array),
+    without holding the compressed or decompressed file in memory.
+    """
+    if allocate is None:
+        allocate = np.empty
+    with gzip.open(filename, 'rb') as idx_binary:
+        (dtype, shape, offset) = read_idx_header(idx_binary)
+        array = allocate(shape, dtype)
+        data = memoryview(array.reshape(-1).view(np.uint8))
+        n_read = 0
+        while n_read < len(data):
+            n_bytes = idx_binary.readinto(
+                data[n_read:n_read + GZIP_CHUNK_SIZE]
+            )
+            if not n_bytes:
+                raise Exception(
+                    'Error: Truncated idx file {filename}: header declares '
+                    'shape {shape} but the file is too small.'
+                    .format(filename=filename, shape=shape)
+                )
+            n_read += n_bytes
+    array.flags.writeable = False
+
+    return array
+
+
+def idx_cache_path(filename, cache_dir):
+    """
+    Returns the decoded cache file path of idx file <filename>, keyed by its
+    absolute path, size and modification time.
+    """
+    stat = os.stat(filename)
+    key = hashlib.sha1(
+        '{path}:{size}:{mtime}'.format(
+            path=os.path.abspath(filename), size=stat.st_size,
+            mtime=stat.st_mtime_ns
+        ).encode()
+    ).hexdigest()[:16]
+
+    return os.path.join(
+        cache_dir, '{name}-{key}.npy'.format(
+            name=os.path.basename(filename), key=key
+        )
+    )
+
+
+def _read_cached_gzip_idx(filename, cache_dir):
+    """
+    Memory-maps the decoded cache of gzip idx file <filename>, decoding it
+    into the cache first if missing. The cache file is written under a
+    temporary name and renamed, so concurrent readers never see it partial.
+    """
+    cache_path = idx_cache_path(filename, cache_dir)
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = '{path}.{pid}.tmp'.format(path=cache_path, pid=os.getpid())
+
+        def allocate(shape, dtype):
+            return np.lib.format.open_memmap(
+                tmp_path, mode='w+', dtype=dtype, shape=shape
+            )
+
+        try:
+            _decode_gzip_idx(filename, allocate).flush()
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return np.load(cache_path, mmap_mode='r').view(np.ndarray)
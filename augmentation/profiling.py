@@ -0,0 +1,180 @@
+"""
+Profiling
+
+This module hosts the optional instrumentation of sequence generators:
+cumulative wall time and call count per generation stage, and event
+counters. Disabled instrumentation is a shared no-op profiler, so hot paths
+only pay for an empty context manager. Enabled profilers can be updated from
+several threads, e.g. the producers of a generator stream.
+"""
+import time
+import threading
+
+
+class _Stage():
+    """
+    Context manager timing one run of a profiler stage.
+    """
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+
+
+class _NullStage():
+    """
+    Context manager doing nothing, shared by every disabled stage.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class StageProfiler():
+    """
+    Accumulates per stage wall time and call counts, and named counters.
+
+    Parameters
+    ----------
+    callback:
+        A callable called as <callback(stage, seconds)> at the end of every
+        timed stage run. Default is None (no callback).
+    """
+    enabled = True
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """
+        Clears all stage timings and counters.
+        """
+        with self._lock:
+            self._seconds = {}
+            self._calls = {}
+            self._counters = {}
+
+    def stage(self, name):
+        """
+        Returns a context manager timing one run of stage <name>.
+        """
+        return _Stage(self, name)
+
+    def add_time(self, name, seconds):
+        """
+        Records one run of stage <name> lasting <seconds>.
+        """
+        with self._lock:
+            self._seconds[name] = self._seconds.get(name, 0.0) + seconds
+            self._calls[name] = self._calls.get(name, 0) + 1
+        if self.callback is not None:
+            self.callback(name, seconds)
+
+    def count(self, name, n=1):
+        """
+        Adds <n> to counter <name>.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def stats(self):
+        """
+        Returns a dict of 'stages', mapping each stage name to its 'calls'
+        and cumulative 'seconds', and 'counters', mapping each counter name
+        to its value.
+        """
+        with self._lock:
+            return {
+                'stages': {
+                    name: {'calls': self._calls[name], 'seconds': seconds}
+                    for (name, seconds) in self._seconds.items()
+                },
+                'counters': dict(self._counters),
+            }
+
+
+class NullProfiler(StageProfiler):
+    """
+    Disabled profiler: records nothing and always reports empty stats.
+    """
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def add_time(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+
+def merge_stats(stats_list):
+    """
+    Sums the stage timings, call counts and counters of several <stats>
+    dicts, e.g. those of the generators of different worker processes.
+    """
+    merged = {'stages': {}, 'counters': {}}
+    for stats in stats_list:
+        for (name, stage) in stats['stages'].items():
+            total = merged['stages'].setdefault(
+                name, {'calls': 0, 'seconds': 0.0}
+            )
+            total['calls'] += stage['calls']
+            total['seconds'] += stage['seconds']
+        for (name, value) in stats['counters'].items():
+            merged['counters'][name] = merged['counters'].get(name, 0) + value
+
+    return merged
+
+
+def format_stats(stats):
+    """
+    Formats <stats> as a text table: per stage calls, cumulative seconds,
+    share of the total stage time and mean milliseconds per call, followed by
+    the counters.
+    """
+    stages = sorted(
+        stats['stages'].items(), key=lambda item: -item[1]['seconds']
+    )
+    total_seconds = sum(stage['seconds'] for (name, stage) in stages)
+    lines = ['{:<12}{:>10}{:>12}{:>8}{:>12}'.format(
+        'stage', 'calls', 'seconds', '%', 'ms/call'
+    )]
+    for (name, stage) in stages:
+        lines.append('{:<12}{:>10}{:>12.4f}{:>8.1f}{:>12.4f}'.format(
+            name, stage['calls'], stage['seconds'],
+            100 * stage['seconds'] / total_seconds if total_seconds else 0,
+            1000 * stage['seconds'] / stage['calls']
+        ))
+    for (name, value) in sorted(stats['counters'].items()):
+        lines.append('{:<28}{:>26}'.format(name, value))
+
+    return '\n'.join(lines)
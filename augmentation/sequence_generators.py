@@ -4,12 +4,75 @@ Sequence Generators
 This module hosts sequence generators with the purpose of generating images
 representing sequences (eg: numbers, others), for data augmentation purposes.
 """
-import uuid
-import struct
+import os
+import sys
+import math
+import time
+import queue
 import argparse
+import functools
+import logging
+import itertools
+import threading
+import multiprocessing
 import numpy as np
-from numpy.random import dirichlet
-import matplotlib.pyplot as plt
+
+if __package__ in (None, ''):  # executed as a script: make package importable
+    sys.path.insert(
+        0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+from augmentation.idx import read_idx  # noqa: E402
+from augmentation.builds import BuildManifest, file_sha256  # noqa: E402
+from augmentation.shared import SharedGeneratorData  # noqa: E402
+from augmentation.profiling import (  # noqa: E402
+    NullProfiler, StageProfiler, format_stats, merge_stats
+)
+from augmentation.writers import OUTPUT_FORMATS, get_writer  # noqa: E402
+
+
+logger = logging.getLogger(__name__)
+
+# 'auto' spacing cost model, in microseconds, measured with the benchmarks:
+# per dirichlet candidate space, per unranked space value (int64 counts, 7
+# times more past int64) and per composition count table cell, amortized
+# over AUTO_PLAN_SAMPLES samples.
+DIRICHLET_COST_PER_VALUE = 0.05
+UNRANK_COST_PER_VALUE = 0.022
+TABLE_COST_PER_CELL = 0.3
+AUTO_PLAN_SAMPLES = 1000
+
+# ways of drawing source images for digits
+DIGIT_SAMPLINGS = ('random', 'epoch')
+
+# generator arrays saved by <share>, as attribute names without underscore
+SHARED_ARRAYS = (
+    'images', 'labels', 'label_offsets', 'label_ixs', 'atlas',
+    'glyph_extents', 'glyph_offsets', 'glyph_pixels', 'glyph_widths',
+    'label_glyph_widths',
+)
+
+
+def _binomial(n, k):
+    """
+    Returns the exact int binomial coefficient <n> choose <k>, 0 when <k> is
+    outside [0, n] (math.comb only exists from python 3.8).
+    """
+    if not 0 <= k <= n:
+        return 0
+    k = min(k, n - k)
+    result = 1
+    for i in range(1, k + 1):
+        result = result * (n - k + i) // i
+
+    return result
+
+
+def _get_random_state(random_state):
+    """
+    Returns <random_state>, or the numpy.random module (numpy's global random
+    state) when None. Both expose the RandomState sampling methods.
+    """
+    return np.random if random_state is None else random_state
 
 
 class NumberSequenceGenerator():
@@ -21,39 +84,264 @@ class NumberSequenceGenerator():
     input_filespec:
         An dict arrangement of 2 elements: {'images':[path], 'labels':[path]}
         referencing idx fileformat containing digit images and labels.
+        Paths ending in '.gz' are decompressed on load.
     spacing_method:
         A string specifying the type of spacing method selected. Options are:
-        ['equidistant', 'random_selection', 'dirichlet'].
-        Default is 'dirichlet'
+        ['equidistant', 'random_selection', 'dirichlet', 'auto'].
+        'auto' routes each (number of spaces, free space, spacing range)
+        shape to the sampler with the lowest expected cost, estimated from
+        the dirichlet acceptance rate and the number of combinations, and
+        logs its choice. Default is 'dirichlet'
+    dirichlet_max_draws:
+        Maximum number of dirichlet candidates drawn per spacing assignment
+        before the 'dirichlet' method gives up with an error, instead of
+        rejecting indefinitely on a barely feasible <spacing_range>.
+        Default is 10000
+    float32_atlas:
+        If True, keeps a float32 copy of all digit images already scaled to
+        [0, 1], so generation copies pixels without converting them, at 4
+        times the memory of uint8 images. Otherwise pixels are scaled while
+        they are copied. Default is False
+    cache_dir:
+        Directory where gzip idx inputs are cached decoded, so later loads
+        memory-map the cache instead of decompressing. Default is None (no
+        cache)
+    crop_glyphs:
+        If True, crops every digit image to its ink extents once, on load,
+        and keeps the cropped glyphs packed in one buffer. Glyphs are then
+        placed at their own width and <spacing_range> is the ink to ink gap
+        between digits. Combined with <float32_atlas>, the packed glyphs are
+        stored scaled instead of the full images. Default is False
+    profile:
+        If True, records the cumulative time and number of calls of each
+        generation stage ('load', 'select', 'spacing', 'assembly' and the
+        CLI 'write'), and counters of generated images, dirichlet candidates
+        and rejections, and random_selection options. See <stats>.
+        Default is False (no instrumentation)
+    profile_callback:
+        A callable called as <profile_callback(stage, seconds)> after every
+        timed stage run. Enables <profile>. Pickled generators keep it, so it
+        must be picklable (e.g. a module level function) for them to reach
+        other processes. Default is None
+    spacing_plan_cache_size:
+        Maximum number of spacing plans (per shape precomputations such as
+        the 'random_selection' composition count table) kept in an LRU
+        cache, keyed by method, number of spaces, free space and
+        <spacing_range>. None is unbounded and 0 disables the cache.
+        Default is 128
+    shared_data:
+        A SharedGeneratorData handle returned by <share>. The generator then
+        memory-maps the shared arrays instead of loading <input_filespec>,
+        and takes <float32_atlas> and <crop_glyphs> from them. Default is
+        None
+    transform:
+        An augmentation stage or pipeline (see augmentation.transforms)
+        applied to every generated batch after assembly, with the digit
+        spans and the random state of the call. Default is None
+    digit_sampling:
+        How source images are drawn for each digit: 'random' draws them
+        independently, with replacement; 'epoch' walks a shuffled
+        permutation of each digit's images, reshuffled once exhausted, so
+        every image is used once per epoch of its digit. Epoch draws depend
+        on previous ones, so they do not suit SequenceDataset, and cannot be
+        combined with <crop_glyphs>, whose redraws of unfit sequences would
+        use up images that never reach an output. Default is 'random'
     """
-    def __init__(self, input_filespec=None, spacing_method='dirichlet'):
+    def __init__(self, input_filespec=None, spacing_method='dirichlet',
+                 dirichlet_max_draws=10000, float32_atlas=False,
+                 cache_dir=None, crop_glyphs=False, profile=False,
+                 profile_callback=None, spacing_plan_cache_size=128,
+                 shared_data=None, transform=None, digit_sampling='random'):
+        load_start = time.perf_counter()
+        self.profiler = (
+            StageProfiler(profile_callback)
+            if profile or profile_callback is not None else NullProfiler()
+        )
+        self.float32_atlas = float32_atlas
+        self.crop_glyphs = crop_glyphs
+        self._atlas = None
+        self._shared_data = shared_data
+        self.transform = transform
+        if shared_data is None:
+            self._load_arrays(input_filespec, cache_dir)
+        else:
+            self._attach_arrays(shared_data)
+        valid_spacing_methods = [
+            'equidistant', 'random_selection', 'dirichlet', 'auto'
+        ]
+        if spacing_method not in valid_spacing_methods:
+            raise Exception(
+                (
+                    'Error: Invalid <spacing_method>;'
+                    ' must be one of the following: {methods}'
+                ).format(methods=valid_spacing_methods)
+            )
+        self.method = spacing_method
+        if digit_sampling not in DIGIT_SAMPLINGS:
+            raise Exception(
+                'Error: Invalid <digit_sampling>; must be one of the '
+                'following: {samplings}'
+                .format(samplings=list(DIGIT_SAMPLINGS))
+            )
+        if digit_sampling == 'epoch' and self.crop_glyphs:
+            raise Exception(
+                'Error: <digit_sampling> \'epoch\' cannot be combined with '
+                '<crop_glyphs>: glyph redraws would use up epoch images '
+                'without generating them.'
+            )
+        self.digit_sampling = digit_sampling
+        if digit_sampling == 'epoch':
+            # per digit permutations, each shuffled on its first draw
+            self._epoch_order = np.array(self._label_ixs)
+            self._epoch_cursors = np.diff(self._label_offsets)
+            self._epoch_lock = threading.Lock()
+        if (
+                not isinstance(dirichlet_max_draws, int)
+                or isinstance(dirichlet_max_draws, bool)
+                or dirichlet_max_draws < 1
+        ):
+            raise Exception(
+                'Error: Wrong <dirichlet_max_draws> input: expected a '
+                'positive <int>, got {input}'.format(input=dirichlet_max_draws)
+            )
+        self.dirichlet_max_draws = dirichlet_max_draws
+        self._dirichlet_candidates = 0
+        self._dirichlet_accepted = 0
+        # guards the dirichlet counters against concurrent stream producers
+        self._stats_lock = threading.Lock()
+        self._init_spacing_plan(spacing_plan_cache_size)
+        self.profiler.add_time('load', time.perf_counter() - load_start)
+
+    def _init_spacing_plan(self, cache_size):
+        """
+        Wraps <_build_spacing_plan> in a per-instance LRU cache of
+        <cache_size> plans, as <_spacing_plan>.
+        """
+        self._spacing_plan = functools.lru_cache(cache_size)(
+            self._build_spacing_plan
+        )
+
+    def _load_arrays(self, input_filespec, cache_dir=None):
+        """
+        Loads images and labels from idx files and precomputes the label
+        index, and the float32 atlas or cropped glyphs when enabled.
+        """
         if input_filespec is None:
             input_filespec = {
                 'images': 'augmentation/data/train-images.idx3-ubyte',
                 'labels': 'augmentation/data/train-labels.idx1-ubyte'
             }
-        data = self._load_idx_data(input_filespec)
+        data = self._load_idx_data(input_filespec, cache_dir)
         self._images = data[0]
         self._labels = data[1]
         self.n_imgs = data[2]
         self._single_img_height = data[3]
         self._single_img_width = data[4]
-        valid_spacing_methods = [
-            'equidistant', 'random_selection', 'dirichlet'
-        ]
-        if spacing_method not in valid_spacing_methods:
-            raise Exception(
-                (
-                    'Error: Invalid <spacing_method>;'
-                    ' must be one of the following: {methods}'
-                ).format(methods=valid_spacing_methods)
+        (self._label_offsets, self._label_ixs) = self._index_labels(
+            self._labels
+        )
+        if self.float32_atlas and not self.crop_glyphs:
+            self._atlas = np.divide(self._images, 255, dtype=np.float32)
+        if self.crop_glyphs:
+            (self._glyph_extents, self._glyph_offsets, self._glyph_pixels) = (
+                self._crop_glyphs(self._images, self.float32_atlas)
+            )
+            self._glyph_widths = (
+                self._glyph_extents[:, 3] - self._glyph_extents[:, 2]
+            )
+            self._label_glyph_widths = self._index_glyph_widths(
+                self._glyph_widths
             )
-        self.method = spacing_method
 
-    def _load_idx_data(self, filename):
+    def _attach_arrays(self, shared_data):
+        """
+        Sets the loaded and precomputed arrays from <shared_data>, and the
+        options they were computed with, without reading idx files.
+        """
+        self.float32_atlas = shared_data.options['float32_atlas']
+        self.crop_glyphs = shared_data.options['crop_glyphs']
+        for (name, array) in shared_data.load().items():
+            setattr(self, '_' + name, array)
+        (self.n_imgs, self._single_img_height, self._single_img_width) = (
+            self._images.shape
+        )
+
+    def share(self, directory=None):
+        """
+        Saves the loaded and precomputed arrays once as memory-mapped files
+        (on /dev/shm by default) and returns their SharedGeneratorData
+        handle. Generators built with <shared_data=handle>, in any process,
+        attach to them without loading or copying anything. Call <unlink> on
+        the handle once workers are done.
+        """
+        arrays = {
+            name: getattr(self, '_' + name)
+            for name in SHARED_ARRAYS
+            if getattr(self, '_' + name, None) is not None
+        }
+
+        return SharedGeneratorData.create(
+            arrays,
+            {'float32_atlas': self.float32_atlas,
+             'crop_glyphs': self.crop_glyphs},
+            directory
+        )
+
+    def __getstate__(self):
+        """
+        Pickles generators not attached to shared data with their arrays.
+        The spacing plan cache and the locks are rebuilt, empty, on load.
+        """
+        state = self.__dict__.copy()
+        state['_spacing_plan_cache_size'] = (
+            self._spacing_plan.cache_info().maxsize
+        )
+        del state['_spacing_plan']
+        del state['_stats_lock']
+        state.pop('_epoch_lock', None)
+
+        return state
+
+    def __setstate__(self, state):
+        cache_size = state.pop('_spacing_plan_cache_size')
+        self.__dict__.update(state)
+        self._stats_lock = threading.Lock()
+        if self.digit_sampling == 'epoch':
+            self._epoch_lock = threading.Lock()
+        self._init_spacing_plan(cache_size)
+
+    def __reduce_ex__(self, protocol):
+        """
+        Generators attached to shared data pickle as the shared data handle
+        and their options, so worker processes attach instead of receiving
+        copies of the arrays, and start with empty statistics and fresh
+        epochs. Other generators pickle their state.
+        """
+        if self._shared_data is None:
+            return super().__reduce_ex__(protocol)
+
+        return (
+            functools.partial(
+                NumberSequenceGenerator, shared_data=self._shared_data,
+                spacing_method=self.method,
+                dirichlet_max_draws=self.dirichlet_max_draws,
+                profile=self.profiler.enabled,
+                profile_callback=self.profiler.callback,
+                transform=self.transform,
+                digit_sampling=self.digit_sampling,
+                spacing_plan_cache_size=(
+                    self._spacing_plan.cache_info().maxsize
+                )
+            ),
+            ()
+        )
+
+    def _load_idx_data(self, filename, cache_dir=None):
         """
         Loads idx fileformat data to class instance. Idx is described and used
-        on the MNIST project.
+        on the MNIST project. Images and labels are read-only memory-mapped
+        views of the files, kept in their stored dtype (uint8 for MNIST).
+        Gzip files are decoded, or memory-mapped from <cache_dir>.
         """
         try:
             (img_file, lbl_file) = (filename['images'], filename['labels'])
@@ -63,43 +351,126 @@ class NumberSequenceGenerator():
                 ' It must match what specified in docstrings.'
             )
 
-        with open(img_file, 'rb') as images_binary:
-            info_bytes = images_binary.read(16)
-            (n_imgs, n_rows, n_cols) = (
-                struct.unpack('>I', info_bytes[x:(x + 4)])[0]
-                for x
-                in range(4, 13, 4)  # 5 through 12 have the information needed.
+        images = read_idx(img_file, cache_dir=cache_dir)
+        if images.ndim != 3:
+            raise Exception(
+                'Error: Expected a 3 dimensional images idx file, got '
+                '{n_dims} dimensions in {img_file}.'
+                .format(n_dims=images.ndim, img_file=img_file)
             )
-            pixel_bytes = images_binary.read(n_imgs * n_rows * n_cols)
-            images = np.asarray(
-                struct.unpack(
-                    '>' + 'B' * (n_imgs * n_rows * n_cols),
-                    pixel_bytes
-                )
-            ).reshape(n_imgs, n_rows, n_cols)
-        with open(lbl_file, 'rb') as label_binary:
-            info_bytes = label_binary.read(8)
-            n_imgs_lbls = struct.unpack('>I', info_bytes[4:8])[0]
-            if (n_imgs != n_imgs_lbls):
-                raise Exception(
-                    'Error: Number of images does not match the number of '
-                    'labels. \n n_images: {n_imgs} \n n_labels: {n_imgs_lbls}'
-                    '\n Check the input file specifications.'
-                    .format(n_imgs=n_imgs, n_imgs_lbls=n_imgs_lbls)
-                )
-            labels = np.array(
-                struct.unpack(
-                    '>' + 'B' * n_imgs_lbls,
-                    label_binary.read(n_imgs_lbls)
-                )
+        (n_imgs, n_rows, n_cols) = images.shape
+        labels = read_idx(lbl_file, cache_dir=cache_dir)
+        if labels.ndim != 1:
+            raise Exception(
+                'Error: Expected a 1 dimensional labels idx file, got '
+                '{n_dims} dimensions in {lbl_file}.'
+                .format(n_dims=labels.ndim, lbl_file=lbl_file)
+            )
+        n_imgs_lbls = labels.shape[0]
+        if (n_imgs != n_imgs_lbls):
+            raise Exception(
+                'Error: Number of images does not match the number of '
+                'labels. \n n_images: {n_imgs} \n n_labels: {n_imgs_lbls}'
+                '\n Check the input file specifications.'
+                .format(n_imgs=n_imgs, n_imgs_lbls=n_imgs_lbls)
             )
 
         return (images, labels, n_imgs, n_rows, n_cols)
 
-    def _select_image_representations(self, digits):
+    def _index_labels(self, labels):
+        """
+        Builds a label to image index table in CSR layout: image indexes
+        sorted by label, and per label offsets into them. Images of label <x>
+        are <label_ixs[label_offsets[x]:label_offsets[x + 1]]>, in file order.
+        """
+        label_counts = np.bincount(labels, minlength=10)
+        label_offsets = np.zeros(len(label_counts) + 1, dtype=np.int64)
+        np.cumsum(label_counts, out=label_offsets[1:])
+        label_ixs = np.argsort(labels, kind='stable')
+
+        return (label_offsets, label_ixs)
+
+    def _crop_glyphs(self, images, float32=False, chunk_size=4096):
+        """
+        Finds the ink (non zero pixel) extents of every image with array
+        reductions over chunks of <chunk_size> images, and packs the images
+        cropped to them into one flat buffer. Returns the extents as an int
+        array of [n_imgs x 4] (top, bottom, left, right; ends exclusive), the
+        [n_imgs + 1] offsets of each glyph in the buffer, and the buffer,
+        holding glyph <i> row-major in <offsets[i]:offsets[i + 1]>. Blank
+        images keep their full extents. With <float32>, the buffer is scaled
+        to [0, 1] float32 instead of keeping the image dtype.
+        """
+        (n_imgs, height, width) = images.shape
+        (rows, columns) = (np.arange(height), np.arange(width))
+        extents = np.empty((n_imgs, 4), dtype=np.int64)
+        glyphs = [np.empty(0, dtype=images.dtype)]
+        for start in range(0, n_imgs, chunk_size):
+            chunk = images[start:start + chunk_size]
+            ink = (chunk != 0)
+            (ink_rows, ink_columns) = (ink.any(axis=2), ink.any(axis=1))
+            blank = ~ink_rows.any(axis=1)
+            chunk_extents = np.stack([
+                ink_rows.argmax(axis=1),
+                height - ink_rows[:, ::-1].argmax(axis=1),
+                ink_columns.argmax(axis=1),
+                width - ink_columns[:, ::-1].argmax(axis=1)
+            ], axis=1)
+            chunk_extents[blank] = (0, height, 0, width)
+            (top, bottom, left, right) = chunk_extents.T[..., np.newaxis]
+            crop = (
+                ((rows >= top) & (rows < bottom))[:, :, np.newaxis]
+                & ((columns >= left) & (columns < right))[:, np.newaxis, :]
+            )
+            # boolean indexing keeps C order: glyph by glyph, row by row
+            glyphs.append(chunk[crop])
+            extents[start:start + len(chunk)] = chunk_extents
+        offsets = np.zeros(n_imgs + 1, dtype=np.int64)
+        np.cumsum(
+            (extents[:, 1] - extents[:, 0]) * (extents[:, 3] - extents[:, 2]),
+            out=offsets[1:]
+        )
+        pixels = np.concatenate(glyphs)
+        if float32:
+            pixels = np.divide(pixels, 255, dtype=np.float32)
+
+        return (extents, offsets, pixels)
+
+    def _index_glyph_widths(self, glyph_widths):
+        """
+        Returns the (minimum, maximum) cropped glyph width of each digit as
+        an int array of [10 x 2], zeros for digits without images.
+        """
+        label_glyph_widths = np.zeros((10, 2), dtype=np.int64)
+        for digit in self._available_digits():
+            widths = glyph_widths[self._label_ixs[
+                self._label_offsets[digit]:self._label_offsets[digit + 1]
+            ]]
+            label_glyph_widths[digit] = (widths.min(), widths.max())
+
+        return label_glyph_widths
+
+    def _available_digits(self):
+        """
+        Returns the digits in [0-9] with at least one image in the dataset.
+        """
+        return np.flatnonzero(np.diff(self._label_offsets[:11]))
+
+    def _select_image_representations(self, digits, random_state=None):
         """
         Randomnly selects image representations for each digit.
         """
+        self._validate_digits(digits)
+        digit_selection_ixs = self._sample_digit_indexes(digits, random_state)
+        candidate_imgs = self._images[digit_selection_ixs]
+        rescaled_candidate_imgs = (candidate_imgs / 255)
+
+        return rescaled_candidate_imgs
+
+    def _validate_digits(self, digits):
+        """
+        Checks <digits> is a non empty list of digits within the [0-9] range.
+        """
         # if digits is empty list or not list
         if (not digits or not isinstance(digits, list)):
             raise Exception(
@@ -111,16 +482,103 @@ class NumberSequenceGenerator():
                 'sequence must be within the [0-9] range.'
             )
 
-        # TODO: add exception to handle case where digit not in self._labels
-        digit_selection_ixs = [
-            np.random.choice(np.where(self._labels == x)[0], 1)[0]
-            for x
-            in digits
-        ]
-        candidate_imgs = self._images[digit_selection_ixs]
-        rescaled_candidate_imgs = (candidate_imgs / 255)
+    def _validate_digit_sequences(self, digit_sequences):
+        """
+        Checks <digit_sequences> is a non empty list of equal length number
+        sequences within the [0-9] range. Returns an int array of
+        [n_sequences x n_digits].
+        """
+        sequences_exception = (
+            'Error: Wrong digit input. Expected a list of equal length number '
+            'sequences. e.g: [[1,2,3],[4,5,6]]'
+        )
+        try:
+            digit_sequences = np.asarray(digit_sequences)
+        except ValueError:  # ragged sequences
+            raise Exception(sequences_exception)
+        if (
+            digit_sequences.ndim != 2
+            or not digit_sequences.size
+            or digit_sequences.dtype.kind not in 'iu'
+        ):
+            raise Exception(sequences_exception)
+        if ((digit_sequences < 0) | (digit_sequences > 9)).any():
+            raise Exception(
+                'Error: Wrong digit input. All elements in '
+                'sequence must be within the [0-9] range.'
+            )
 
-        return rescaled_candidate_imgs
+        return digit_sequences.astype(np.int64)
+
+    def _sample_digit_indexes(self, digits, random_state=None):
+        """
+        Randomly draws one image index per digit from the label index table.
+        Accepts an array-like of digits of any shape and returns an index
+        array of the same shape.
+        """
+        with self.profiler.stage('select'):
+            random_state = _get_random_state(random_state)
+            digits = np.asarray(digits)
+            label_starts = self._label_offsets[digits]
+            label_counts = self._label_offsets[digits + 1] - label_starts
+            if not label_counts.all():
+                missing_digits = sorted(
+                    set(digits[label_counts == 0].tolist())
+                )
+                raise Exception(
+                    'Error: Wrong digit input. Digits {missing} are not '
+                    'present in the dataset labels.'
+                    .format(missing=missing_digits)
+                )
+            if self.digit_sampling == 'epoch':
+                return self._draw_epoch_indexes(digits, random_state)
+
+            return self._label_ixs[
+                label_starts + random_state.randint(0, label_counts)
+            ]
+
+    def _draw_epoch_indexes(self, digits, random_state):
+        """
+        Draws one image index per digit without replacement from each
+        digit's current permutation, in order, reshuffling a permutation
+        with <random_state> when it is exhausted. Loops over the distinct
+        digits of the batch, not over draws.
+        """
+        flat_digits = digits.ravel()
+        image_ixs = np.empty(flat_digits.shape, dtype=np.int64)
+        # positions of each digit's draws, grouped by digit in draw order
+        digit_positions = np.argsort(flat_digits, kind='stable')
+        digit_bounds = np.zeros(len(self._epoch_cursors) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(flat_digits, minlength=len(self._epoch_cursors)),
+            out=digit_bounds[1:]
+        )
+        with self._epoch_lock:
+            for digit in np.flatnonzero(np.diff(digit_bounds)):
+                positions = digit_positions[
+                    digit_bounds[digit]:digit_bounds[digit + 1]
+                ]
+                order = self._epoch_order[
+                    self._label_offsets[digit]:self._label_offsets[digit + 1]
+                ]
+                cursor = self._epoch_cursors[digit]
+                n_drawn = 0
+                while n_drawn < len(positions):
+                    if cursor == len(order):
+                        random_state.shuffle(order)
+                        cursor = 0
+                        self.profiler.count('epochs')
+                    n_taken = min(
+                        len(positions) - n_drawn, len(order) - cursor
+                    )
+                    image_ixs[positions[n_drawn:n_drawn + n_taken]] = (
+                        order[cursor:cursor + n_taken]
+                    )
+                    cursor += n_taken
+                    n_drawn += n_taken
+                self._epoch_cursors[digit] = cursor
+
+        return image_ixs.reshape(digits.shape)
 
     def _calculate_available_space(self, spacing_range, image_width, n_digits):
         """
@@ -128,20 +586,30 @@ class NumberSequenceGenerator():
         compiled image. Checks if th available space can be filled or is
         enough to place the digit images with constrained spacing in between.
         """
+        digit_space_req = n_digits * self._single_img_width
+        n_spaces = (n_digits - 1)
+        min_space = (digit_space_req + (n_spaces * spacing_range[0]))
+        max_space = (digit_space_req + (n_spaces * spacing_range[1]))
+        self._validate_width_limits(
+            image_width, spacing_range,
+            max(digit_space_req, min_space), max_space
+        )
+        available_space = (image_width - digit_space_req)
+
+        return available_space
+
+    def _validate_width_limits(self, image_width, spacing_range, min_width,
+                               max_width):
+        """
+        Checks <image_width> is an int within [min_width, max_width], the
+        widths reachable with <spacing_range>.
+        """
         if not isinstance(image_width, int):
             raise Exception(
                 'Error: Wrong <image_width> input: expected <int>, got {input}'
                 .format(input=type(image_width))
             )
-        digit_space_req = n_digits * self._single_img_width
-        n_spaces = (n_digits - 1)
-        min_space = (digit_space_req + (n_spaces * spacing_range[0]))
-        max_space = (digit_space_req + (n_spaces * spacing_range[1]))
-        if (
-            (image_width < digit_space_req)
-            or (image_width < min_space)
-            or (image_width > max_space)
-        ):
+        if (image_width < min_width) or (image_width > max_width):
             raise Exception(
                 'Error: Input <image_width>: {image_width} is not enough or'
                 ' cannot be filled by the specified <spacing_range>: '
@@ -150,19 +618,60 @@ class NumberSequenceGenerator():
                 .format(
                     image_width=image_width,
                     spacing_range=spacing_range,
-                    min_width=max(digit_space_req, min_space),
-                    max_width=max_space
+                    min_width=min_width,
+                    max_width=max_width
                 )
             )
-        available_space = (image_width - digit_space_req)
 
-        return available_space
+    def _validate_image_width(self, spacing_range, image_width, n_digits):
+        """
+        Checks sequences of <n_digits> random digits can span <image_width>.
+        With cropped glyphs, the limits follow from the narrowest and widest
+        glyphs of the available digits.
+        """
+        if not self.crop_glyphs:
+            self._calculate_available_space(
+                spacing_range, image_width, n_digits
+            )
+            return
+        glyph_widths = self._label_glyph_widths[self._available_digits()]
+        n_spaces = (n_digits - 1)
+        self._validate_width_limits(
+            image_width, spacing_range,
+            n_digits * glyph_widths[:, 0].min() + n_spaces * spacing_range[0],
+            n_digits * glyph_widths[:, 1].max() + n_spaces * spacing_range[1]
+        )
 
-    def _calculate_digit_spacing(self, n_digits, free_space, spacing_range):
+    def _calculate_digit_spacing(self, n_digits, free_space, spacing_range,
+                                 random_state=None):
         """
         Calculates spacing between digits based on the selected calculation
         method. Returns a list of matrices of [space x image_height].
         """
+        self._validate_spacing_range(spacing_range)
+        if n_digits == 1:  # if only 1 digit in sequence: append all free space
+            selected_spaces = [free_space]
+        else:
+            selected_spaces = self._sample_spacing(
+                n_digits, free_space, spacing_range, 1, random_state
+            )[0].tolist()
+
+        spacing = []
+        for i in range(len(selected_spaces)):
+            spacing.append(
+                np.zeros(
+                    (self._single_img_height * selected_spaces[i]),
+                    dtype='float32'
+                )
+                .reshape(self._single_img_height, selected_spaces[i])
+            )
+
+        return spacing
+
+    def _validate_spacing_range(self, spacing_range):
+        """
+        Checks <spacing_range> is a (minimum, maximum) tuple of integers.
+        """
         spacing_exception = (
             'Error: Wrong <spacing_range> input: expected <tuple> of size 2 '
             'with each element of <int>, got {input}'.format(
@@ -177,61 +686,382 @@ class NumberSequenceGenerator():
         ):
             raise Exception(spacing_exception)
 
-        n_spaces = (n_digits - 1)
-        if n_digits == 1:  # if only 1 digit in sequence: append all free space
-            selected_spaces = [free_space]
-        elif self.method == 'equidistant':
+    def _sample_spacing(self, n_digits, free_space, spacing_range,
+                        n_samples, random_state=None):
+        """
+        Samples <n_samples> spacing assignments between <n_digits> digits
+        that add up to <free_space>, using the selected calculation method.
+        Returns an int array of [n_samples x (n_digits - 1)].
+        """
+        with self.profiler.stage('spacing'):
+            n_spaces = (n_digits - 1)
+            method = self.method
+            if method == 'auto':
+                method = self._spacing_plan(
+                    'auto', n_spaces, free_space, spacing_range[0],
+                    spacing_range[1]
+                )
+                self.profiler.count('auto_' + method, n_samples)
+            spacing_plan = self._spacing_plan(
+                method, n_spaces, free_space, spacing_range[0],
+                spacing_range[1]
+            )
+            if method == 'equidistant':
+                selected_spaces = np.full(
+                    (n_samples, n_spaces), spacing_plan, dtype=np.int64
+                )
+            elif method == 'random_selection':
+                n_options = spacing_plan[-1, -1]
+                self.profiler.count('random_selection_options', int(n_options))
+                selected_spaces = self._unrank_compositions(
+                    spacing_plan,
+                    self._sample_ranks(n_options, n_samples, random_state),
+                    spacing_range[0], spacing_range[1]
+                )
+            elif method == 'dirichlet':
+                selected_spaces = self._sample_dirichlet_spacing(
+                    n_spaces, free_space, spacing_range, n_samples,
+                    random_state
+                )
+
+            return selected_spaces
+
+    def _build_spacing_plan(self, method, n_spaces, free_space, min_value,
+                            max_value):
+        """
+        Precomputes what <method> needs to sample <n_spaces> spaces within
+        <min_value,max_value> that add up to <free_space>: the equidistant
+        space, the composition count table of 'random_selection' (read-only),
+        nothing for 'dirichlet' once the shape is checked feasible, or the
+        method 'auto' picks. Calls go through <_spacing_plan>, its
+        per-instance LRU cache.
+        """
+        if method == 'auto':
+            return self._choose_spacing_method(
+                n_spaces, free_space, min_value, max_value
+            )
+        if method == 'equidistant':
             equidistant_space = free_space / n_spaces
             if (equidistant_space % 1):
                 raise Exception(
                     'Error: There is no integer split for digit spacing with '
                     'the specified <image_width>.'
                 )
-            selected_spaces = [int(equidistant_space) for x in range(n_spaces)]
-        elif self.method == 'random_selection':
-            # TODO: add timeout
-            spacing_options = list(
-                self._permutations_w_constraints(
-                    n_spaces, free_space, spacing_range[0], spacing_range[1]
+            return int(equidistant_space)
+        if method == 'random_selection':
+            composition_counts = self._count_compositions(
+                n_spaces, free_space, min_value, max_value
+            )
+            composition_counts.flags.writeable = False
+            return composition_counts
+        self._validate_spacing_feasibility(
+            n_spaces, free_space, min_value, max_value
+        )
+
+    def _choose_spacing_method(self, n_spaces, free_space, min_value,
+                               max_value):
+        """
+        Picks the sampler with the lowest expected cost per spacing
+        assignment: 'equidistant' when a single combination exists, else
+        'dirichlet', whose cost grows with the inverse of its acceptance
+        rate, or 'random_selection', whose cost grows with the spacing range
+        (plus its count table, amortized). 'dirichlet' is only picked when
+        its expected draws stay well within <dirichlet_max_draws>.
+        """
+        n_options = self._count_bounded_compositions(
+            n_spaces, free_space, min_value, max_value
+        )
+        # flat dirichlet candidates round to any composition of <free_space>
+        acceptance_rate = (
+            n_options / _binomial(free_space + n_spaces - 1, n_spaces - 1)
+        )
+        if n_options == 1:
+            method = 'equidistant'
+        else:
+            dirichlet_cost = (
+                DIRICHLET_COST_PER_VALUE * n_spaces / acceptance_rate
+                if acceptance_rate * self.dirichlet_max_draws >= 10
+                else math.inf
+            )
+            random_selection_cost = (
+                UNRANK_COST_PER_VALUE * n_spaces * (max_value - min_value + 1)
+                * (1 if n_options < 2 ** 63 else 7)
+                + TABLE_COST_PER_CELL * (n_spaces + 1)
+                * (free_space - n_spaces * min_value + 1) / AUTO_PLAN_SAMPLES
+            )
+            method = (
+                'dirichlet' if dirichlet_cost < random_selection_cost
+                else 'random_selection'
+            )
+        logger.info(
+            'auto spacing: %s for %d spaces, free space %d and spacing range '
+            '(%d, %d): %d combinations, estimated dirichlet acceptance %.3g',
+            method, n_spaces, free_space, min_value, max_value, n_options,
+            acceptance_rate
+        )
+
+        return method
+
+    def _count_bounded_compositions(self, n_spaces, free_space, min_value,
+                                    max_value):
+        """
+        Counts the combinations of <n_spaces> spaces within
+        <min_value,max_value> that add up to <free_space> by inclusion
+        exclusion, in <n_spaces> steps instead of a count table.
+        """
+        self._validate_spacing_feasibility(
+            n_spaces, free_space, min_value, max_value
+        )
+        extra_space = free_space - n_spaces * min_value
+        n_values = max_value - min_value + 1
+        # k spaces forced above <max_value>: compositions of what is left
+        return sum(
+            (-1) ** k * _binomial(n_spaces, k) * _binomial(
+                extra_space - k * n_values + n_spaces - 1, n_spaces - 1
+            )
+            for k in range(min(n_spaces, extra_space // n_values) + 1)
+        )
+
+    def spacing_plan_cache_info(self):
+        """
+        Returns the hits, misses, current size and maximum size of the
+        spacing plan cache.
+        """
+        cache_info = self._spacing_plan.cache_info()
+
+        return {
+            'hits': cache_info.hits,
+            'misses': cache_info.misses,
+            'size': cache_info.currsize,
+            'maxsize': cache_info.maxsize,
+        }
+
+    def _sample_dirichlet_spacing(self, n_spaces, free_space, spacing_range,
+                                  n_samples, random_state=None):
+        """
+        Draws blocks of dirichlet spacing candidates as a matrix, rounds them
+        to integer spaces that add up to <free_space> and keeps the first
+        <n_samples> rows that fit <spacing_range>. Block sizes follow the
+        acceptance rate observed within the call, so draws only depend on
+        <random_state>. Raises once <dirichlet_max_draws> per sample have
+        been drawn without enough accepted rows.
+        """
+        random_state = _get_random_state(random_state)
+        alphas = np.ones(n_spaces)
+        budget = self.dirichlet_max_draws * n_samples
+        selected_spaces = np.empty((n_samples, n_spaces), dtype=np.int64)
+        (n_selected, n_accepted, n_drawn) = (0, 0, 0)
+
+        while n_selected < n_samples:
+            if n_drawn >= budget:
+                raise Exception(
+                    'Error: The dirichlet spacing sampler drew {n_drawn} '
+                    'candidates (acceptance rate: {rate}) without filling '
+                    'the <spacing_range>: {spacing_range}. Widen the '
+                    '<spacing_range>, change <image_width> or use another '
+                    '<spacing_method>.'
+                    .format(
+                        n_drawn=n_drawn,
+                        rate=(
+                            '{:.2e}'.format(n_accepted / n_drawn)
+                            if n_drawn else 'n/a'
+                        ),
+                        spacing_range=spacing_range
+                    )
                 )
+            block_size = self._dirichlet_block_size(
+                n_samples - n_selected, budget - n_drawn, n_accepted, n_drawn
+            )
+            dirichlet_candidates = (
+                random_state.dirichlet(alphas, block_size) * free_space
+            )
+            candidates_for_remainder = random_state.randint(
+                0, n_spaces, block_size
+            )
+
+            candidate_spaces = np.floor(dirichlet_candidates)
+            remainders = np.round(
+                (dirichlet_candidates - candidate_spaces).sum(axis=1)
             )
-            selected_spaces = spacing_options[
-                np.random.choice(len(spacing_options), 1)[0]
+            candidate_spaces = candidate_spaces.astype(np.int64)
+            candidate_spaces[
+                np.arange(block_size), candidates_for_remainder
+            ] += remainders.astype(np.int64)
+
+            accepted = candidate_spaces[
+                (
+                    (candidate_spaces >= spacing_range[0])
+                    & (candidate_spaces <= spacing_range[1])
+                ).all(axis=1)
             ]
-        elif self.method == 'dirichlet':
-            alphas = [1 for x in range(n_digits - 1)]
+            n_accepted += len(accepted)
+            n_drawn += block_size
+            with self._stats_lock:
+                self._dirichlet_candidates += block_size
+                self._dirichlet_accepted += len(accepted)
+            self.profiler.count('dirichlet_candidates', block_size)
+            self.profiler.count(
+                'dirichlet_rejected', block_size - len(accepted)
+            )
+            accepted = accepted[:n_samples - n_selected]
+            selected_spaces[n_selected:n_selected + len(accepted)] = accepted
+            n_selected += len(accepted)
 
-            while True:
-                dirichlet_candidates = (
-                    dirichlet(alphas, 1).flatten() * free_space
-                )
-                candidate_for_remainder = np.random.choice(range(n_spaces))
+        return selected_spaces
 
-                selected_spaces = [
-                    int(np.floor(x)) for x in dirichlet_candidates
-                ]
-                remainder = round(sum([x % 1 for x in dirichlet_candidates]))
-                selected_spaces[candidate_for_remainder] += int(remainder)
+    def _dirichlet_block_size(self, n_missing, budget_left, n_accepted,
+                              n_drawn, max_block_size=65536):
+        """
+        Sizes the next block of dirichlet candidates so that, at the
+        acceptance rate observed so far (<n_accepted> of <n_drawn>), it is
+        expected to fill the <n_missing> spacing assignments in one go.
+        """
+        # smoothed estimate: 0.5 before any draw, never exactly 0 or 1
+        acceptance_rate = (n_accepted + 1) / (n_drawn + 2)
+        block_size = int(np.ceil(n_missing / acceptance_rate))
 
-                if all(
-                    [
-                        (x >= spacing_range[0] and x <= spacing_range[1])
-                        for x in selected_spaces
-                    ]
-                ):
-                    break
+        return max(1, min(block_size, budget_left, max_block_size))
 
-        spacing = []
-        for i in range(len(selected_spaces)):
-            spacing.append(
-                np.zeros(
-                    (self._single_img_height * selected_spaces[i]),
-                    dtype='float32'
+    def dirichlet_stats(self):
+        """
+        Returns the number of dirichlet spacing candidates drawn and accepted
+        by this generator so far, and the resulting acceptance rate.
+        """
+        with self._stats_lock:
+            (candidates, accepted) = (
+                self._dirichlet_candidates, self._dirichlet_accepted
+            )
+
+        return {
+            'candidates': candidates,
+            'accepted': accepted,
+            'acceptance_rate': (
+                accepted / candidates if candidates else None
+            )
+        }
+
+    def stats(self):
+        """
+        Returns the instrumentation recorded since construction or the last
+        <reset_stats>, when <profile> is enabled: a dict of 'stages', mapping
+        each stage to its 'calls' and cumulative 'seconds', and 'counters'.
+        Both are empty when <profile> is disabled.
+        """
+        return self.profiler.stats()
+
+    def reset_stats(self):
+        """
+        Clears the recorded instrumentation and dirichlet statistics.
+        """
+        self.profiler.reset()
+        with self._stats_lock:
+            self._dirichlet_candidates = 0
+            self._dirichlet_accepted = 0
+
+    def _validate_spacing_feasibility(self, n_spaces, free_space, min_value,
+                                      max_value):
+        """
+        Checks <n_spaces> spaces within <min_value,max_value> can add up to
+        <free_space>.
+        """
+        if not (n_spaces * min_value <= free_space <= n_spaces * max_value):
+            raise Exception(
+                'Error: There is no spacing combination within the '
+                '<spacing_range>: ({min_value}, {max_value}) that adds up to '
+                '{free_space}.'.format(
+                    min_value=min_value, max_value=max_value,
+                    free_space=free_space
                 )
-                .reshape(self._single_img_height, selected_spaces[i])
             )
 
-        return spacing
+    def _count_compositions(self, n_spaces, free_space, min_value,
+                            max_value):
+        """
+        Counts spacing combinations by dynamic programming. Returns a table
+        of [(n_spaces + 1) x (extra_space + 1)] where cell [k, s] holds the
+        number of ways <k> spaces within <min_value,max_value> add up to
+        <k * min_value + s>, and <extra_space> is the space left once every
+        space holds <min_value>. Cell [-1, -1] is the total number of
+        combinations for <free_space>.
+        """
+        self._validate_spacing_feasibility(
+            n_spaces, free_space, min_value, max_value
+        )
+        extra_space = free_space - n_spaces * min_value
+        value_range = max_value - min_value
+        counts = [[1] + [0] * extra_space]
+        for k in range(n_spaces):
+            # sliding window sum over the previous row: O(1) per cell
+            (previous, row, window) = (counts[-1], [], 0)
+            for s in range(extra_space + 1):
+                window += previous[s]
+                if s > value_range:
+                    window -= previous[s - value_range - 1]
+                row.append(window)
+            counts.append(row)
+        # python ints keep counts exact beyond the int64 range
+        dtype = np.int64 if counts[-1][-1] < 2 ** 63 else object
+
+        return np.array(counts, dtype=dtype)
+
+    def _sample_ranks(self, n_options, n_samples, random_state=None):
+        """
+        Draws <n_samples> uniform integers in [0, n_options).
+        """
+        random_state = _get_random_state(random_state)
+        if n_options < 2 ** 63:
+            return random_state.randint(0, n_options, n_samples)
+        n_words = -(-n_options.bit_length() // 32)
+        mask = (1 << n_options.bit_length()) - 1
+        ranks = []
+        while len(ranks) < n_samples:  # rejection: accepts over half
+            words = random_state.randint(
+                0, 2 ** 32, n_words, dtype=np.uint64
+            )
+            rank = 0
+            for word in words.tolist():
+                rank = (rank << 32) | word
+            rank &= mask
+            if rank < n_options:
+                ranks.append(rank)
+
+        return np.array(ranks, dtype=object)
+
+    def _unrank_compositions(self, composition_counts, ranks, min_value,
+                             max_value):
+        """
+        Maps each rank to the spacing combination at that position in the
+        lexicographic order of all combinations, choosing one space at a time
+        weighted by the number of combinations left for the remaining spaces.
+        Vectorized over ranks. Returns an int array of [n_ranks x n_spaces].
+        """
+        n_spaces = composition_counts.shape[0] - 1
+        ranks = np.array(ranks, dtype=composition_counts.dtype)
+        values = np.arange(max_value - min_value + 1)
+        remaining_space = np.full(
+            len(ranks), composition_counts.shape[1] - 1, dtype=np.int64
+        )
+        selected_spaces = np.empty((len(ranks), n_spaces), dtype=np.int64)
+        for i in range(n_spaces):
+            candidate_space = remaining_space[:, np.newaxis] - values
+            n_completions = np.where(
+                candidate_space >= 0,
+                composition_counts[
+                    n_spaces - i - 1, np.maximum(candidate_space, 0)
+                ],
+                0
+            )
+            cumulative = np.cumsum(n_completions, axis=1)
+            choice = (ranks[:, np.newaxis] >= cumulative).sum(axis=1)
+            ranks = ranks - np.where(
+                choice > 0,
+                cumulative[np.arange(len(ranks)), np.maximum(choice - 1, 0)],
+                0
+            )
+            selected_spaces[:, i] = choice
+            remaining_space -= choice
+
+        return selected_spaces + min_value
 
     def _permutations_w_constraints(self, n_elements,
                                     sum_total, min_value, max_value):
@@ -249,7 +1079,8 @@ class NumberSequenceGenerator():
                 ):
                     yield (value,) + permutation
 
-    def generate_numbers_sequence(self, digits, spacing_range, image_width):
+    def generate_numbers_sequence(self, digits, spacing_range, image_width,
+                                  random_state=None, out=None):
         """
         Generate an image that contains the sequence of given numbers, spaced
         randomly using an uniform distribution.
@@ -264,6 +1095,13 @@ class NumberSequenceGenerator():
             spacing between digits. Unit should be pixel.
         image_width:
             specifies the width of the image in pixels.
+        random_state:
+            A numpy RandomState used for every random draw. Default is None
+            (numpy's global random state).
+        out:
+            A float32 array of [image_height x image_width] the image is
+            written into, so repeated calls allocate no image memory.
+            Default is None (a new array).
 
         Returns
         -------
@@ -272,28 +1110,663 @@ class NumberSequenceGenerator():
         from 0 (black) to 1 (white), the first dimension corresponding to the
         height and the second dimension to the width.
         """
+        self._validate_digits(digits)
+        if self.crop_glyphs:
+            stacked_images = self._prepare_output(
+                out, (self._single_img_height, image_width)
+            )
+            self.generate_numbers_sequence_batch(
+                [digits], spacing_range, image_width, random_state,
+                stacked_images[np.newaxis]
+            )
+            return stacked_images
         n_digits = len(digits)
 
-        image_representations = self._select_image_representations(digits)
+        digit_selection_ixs = self._sample_digit_indexes(digits, random_state)
 
         available_space = self._calculate_available_space(
             spacing_range, image_width, n_digits
         )
+        self._validate_spacing_range(spacing_range)
+        if n_digits == 1:
+            selected_spaces = []
+        else:
+            selected_spaces = self._sample_spacing(
+                n_digits, available_space, spacing_range, 1, random_state
+            )[0].tolist()
 
-        digit_spacing = self._calculate_digit_spacing(
-            n_digits, available_space, spacing_range
+        with self.profiler.stage('assembly'):
+            stacked_images = self._prepare_output(
+                out, (self._single_img_height, image_width)
+            )
+            column = 0
+            digit_offsets = []
+            for (i, digit_ix) in enumerate(digit_selection_ixs):
+                self._copy_digit_image(
+                    digit_ix,
+                    stacked_images[:, column:column + self._single_img_width]
+                )
+                digit_offsets.append(column)
+                column += self._single_img_width
+                if i < len(selected_spaces):
+                    column += selected_spaces[i]
+        self._transform(
+            stacked_images[np.newaxis], np.array([digit_offsets]),
+            self._single_img_width, random_state
         )
+        self.profiler.count('images')
 
-        stacked_images = [image_representations[0]]
-        for i in range(1, n_digits):
-            stacked_images += [digit_spacing[i - 1], image_representations[i]]
+        return stacked_images
 
-        stacked_images = np.hstack(stacked_images)
+    def _prepare_output(self, out, shape):
+        """
+        Returns a zeroed float32 array of <shape>: <out> itself when given,
+        after checking its shape and dtype, or a newly allocated one.
+        """
+        if out is None:
+            return np.zeros(shape, dtype=np.float32)
+        if (
+            not isinstance(out, np.ndarray)
+            or out.shape != shape
+            or out.dtype != np.float32
+        ):
+            raise Exception(
+                'Error: Wrong <out> input: expected a float32 array of shape '
+                '{shape}, got {input}'.format(
+                    shape=shape,
+                    input=(
+                        '{dtype} array of shape {shape}'.format(
+                            dtype=out.dtype, shape=out.shape
+                        )
+                        if isinstance(out, np.ndarray) else type(out)
+                    )
+                )
+            )
+        out.fill(0)
+
+        return out
 
-        return stacked_images.astype('float32')
+    def _copy_digit_image(self, digit_ix, out):
+        """
+        Copies digit image <digit_ix>, scaled to [0, 1], into the float32
+        view <out> without intermediate arrays.
+        """
+        if self._atlas is not None:
+            out[...] = self._atlas[digit_ix]
+        else:
+            np.divide(self._images[digit_ix], 255, out=out, dtype=np.float32)
 
+    def generate_numbers_sequence_batch(self, digit_sequences, spacing_range,
+                                        image_width, random_state=None,
+                                        out=None):
+        """
+        Generate a batch of images, one per number sequence, in a single
+        vectorized pass: all digit images are selected with one gather, all
+        spacings are sampled together and digits are copied into one
+        preallocated output by column offset.
 
-if __name__ == "__main__":
+        Parameters
+        ----------
+        digit_sequences:
+            A list of equal length digit lists, or a 2D array-like of
+            [n_sequences x n_digits] (for example [[3, 5, 0], [1, 1, 2]]).
+        spacing_range:
+            A (minimum, maximum) pair (tuple), representing the min and max
+            spacing between digits. Unit should be pixel.
+        image_width:
+            specifies the width of the images in pixels.
+        random_state:
+            A numpy RandomState used for every random draw. Default is None
+            (numpy's global random state).
+        out:
+            A float32 array of [n_sequences x image_height x image_width] the
+            images are written into. Default is None (a new array).
+
+        Returns
+        -------
+        The images containing the sequences of numbers, as a floating point
+        32bits numpy array of [n_sequences x image_height x image_width] with
+        a scale ranging from 0 (black) to 1 (white).
+        """
+        digit_sequences = self._validate_digit_sequences(digit_sequences)
+        (n_sequences, n_digits) = digit_sequences.shape
+        if self.crop_glyphs:
+            (glyph_ixs, glyph_offsets) = self._sample_glyph_layout(
+                digit_sequences, spacing_range, image_width, random_state
+            )
+            with self.profiler.stage('assembly'):
+                images = self._prepare_output(
+                    out, (n_sequences, self._single_img_height, image_width)
+                )
+                self._assemble_glyph_batch(glyph_ixs, glyph_offsets, images)
+            self._transform(
+                images, glyph_offsets, self._glyph_widths[glyph_ixs],
+                random_state
+            )
+            self.profiler.count('images', n_sequences)
+            return images
+
+        digit_selection_ixs = self._sample_digit_indexes(
+            digit_sequences, random_state
+        )
+
+        available_space = self._calculate_available_space(
+            spacing_range, image_width, n_digits
+        )
+        self._validate_spacing_range(spacing_range)
+        if n_digits == 1:
+            selected_spaces = np.zeros((n_sequences, 0), dtype=np.int64)
+        else:
+            selected_spaces = self._sample_spacing(
+                n_digits, available_space, spacing_range, n_sequences,
+                random_state
+            )
+
+        digit_offsets = np.zeros((n_sequences, n_digits), dtype=np.int64)
+        np.cumsum(
+            selected_spaces + self._single_img_width,
+            axis=1, out=digit_offsets[:, 1:]
+        )
+
+        with self.profiler.stage('assembly'):
+            images = self._assemble_batch(
+                digit_selection_ixs, digit_offsets, self._prepare_output(
+                    out, (n_sequences, self._single_img_height, image_width)
+                )
+            )
+        self._transform(
+            images, digit_offsets, self._single_img_width, random_state
+        )
+        self.profiler.count('images', n_sequences)
+
+        return images
+
+    def generate_padded_sequence_batch(self, digit_sequences, spacing_range,
+                                       image_widths, random_state=None,
+                                       blank=10):
+        """
+        Generate a batch of variable length sequences, each spanning its own
+        width, right padded into one image tensor, e.g. for CTC training.
+        Items are grouped by (n_digits, image_width) and each group is
+        generated in one vectorized pass.
+
+        Parameters
+        ----------
+        digit_sequences:
+            A list of non empty digit lists of any lengths (for example
+            [[3, 5, 0], [1, 2], [7, 7, 7, 7]]).
+        spacing_range:
+            A (minimum, maximum) pair (tuple), representing the min and max
+            spacing between digits. Unit should be pixel.
+        image_widths:
+            The width in pixels of each image, as a list of ints, or one int
+            shared by every image.
+        random_state:
+            A numpy RandomState used for every random draw. Default is None
+            (numpy's global random state).
+        blank:
+            The int label padding label sequences, outside the [0-9] range.
+            Default is 10
+
+        Returns
+        -------
+        A tuple of:
+        - images: floating point 32bits numpy array of [n_sequences x
+          image_height x max(image_widths)], each image followed by zeros
+          (black) from its own width on.
+        - labels: int64 numpy array of [n_sequences x max(n_digits)], each
+          sequence followed by <blank> labels.
+        - image_widths: int64 numpy array of the image widths.
+        - label_lengths: int64 numpy array of the number of digits per
+          sequence.
+        """
+        (labels, label_lengths) = self._pad_digit_sequences(
+            digit_sequences, blank
+        )
+        n_sequences = len(labels)
+        image_widths = np.asarray(image_widths)
+        if image_widths.ndim == 0:
+            image_widths = np.full(n_sequences, image_widths)
+        if (
+            image_widths.shape != (n_sequences,)
+            or image_widths.dtype.kind not in 'iu'
+            or (image_widths < 1).any()
+        ):
+            raise Exception(
+                'Error: Wrong <image_widths> input: expected a positive <int> '
+                'or a list of {n_sequences} positive <int>'
+                .format(n_sequences=n_sequences)
+            )
+        image_widths = image_widths.astype(np.int64)
+
+        images = np.zeros(
+            (n_sequences, self._single_img_height, image_widths.max()),
+            dtype=np.float32
+        )
+        (shapes, shape_ixs) = np.unique(
+            np.stack([label_lengths, image_widths], axis=1), axis=0,
+            return_inverse=True
+        )
+        for (i, (n_digits, image_width)) in enumerate(shapes):
+            rows = np.flatnonzero(shape_ixs.ravel() == i)
+            images[rows, :, :image_width] = (
+                self.generate_numbers_sequence_batch(
+                    labels[rows, :n_digits], spacing_range, int(image_width),
+                    random_state
+                )
+            )
+
+        return (images, labels, image_widths, label_lengths)
+
+    def _pad_digit_sequences(self, digit_sequences, blank):
+        """
+        Checks <digit_sequences> is a non empty list of non empty digit
+        sequences and <blank> an int outside the [0-9] range. Returns the
+        sequences as an int64 array of [n_sequences x max(n_digits)] padded
+        with <blank>, and their lengths.
+        """
+        if (
+            not isinstance(blank, (int, np.integer))
+            or isinstance(blank, bool)
+            or 0 <= blank <= 9
+        ):
+            raise Exception(
+                'Error: Wrong <blank> input: expected an <int> outside the '
+                '[0-9] range, got {input}'.format(input=blank)
+            )
+        sequences_exception = (
+            'Error: Wrong digit input. Expected a list of non empty number '
+            'sequences. e.g: [[1,2,3],[4,5]]'
+        )
+        try:
+            sequences = [np.asarray(digits) for digits in digit_sequences]
+        except TypeError:
+            raise Exception(sequences_exception)
+        if not sequences or any(
+            digits.ndim != 1 or not digits.size
+            or digits.dtype.kind not in 'iu'
+            for digits in sequences
+        ):
+            raise Exception(sequences_exception)
+        label_lengths = np.array([len(digits) for digits in sequences])
+        digits = np.concatenate(sequences)
+        if ((digits < 0) | (digits > 9)).any():
+            raise Exception(
+                'Error: Wrong digit input. All elements in '
+                'sequence must be within the [0-9] range.'
+            )
+        labels = np.full(
+            (len(sequences), label_lengths.max()), blank, dtype=np.int64
+        )
+        labels[
+            np.arange(labels.shape[1]) < label_lengths[:, np.newaxis]
+        ] = digits
+
+        return (labels, label_lengths.astype(np.int64))
+
+    def _transform(self, images, digit_offsets, digit_widths,
+                   random_state=None):
+        """
+        Applies <transform>, if any, in place to the assembled <images>,
+        passing the (start, stop) column spans of their digits.
+        """
+        if self.transform is None:
+            return
+        with self.profiler.stage('transform'):
+            self.transform(
+                images,
+                np.stack(
+                    np.broadcast_arrays(
+                        digit_offsets, digit_offsets + digit_widths
+                    ),
+                    axis=-1
+                ),
+                random_state
+            )
+
+    def _assemble_batch(self, digit_selection_ixs, digit_offsets, images):
+        """
+        Copies the selected digit images, scaled to [0, 1], into the zeroed
+        float32 batch <images> of [n_sequences x image_height x image_width],
+        each digit starting at its column offset. Loops over digit positions,
+        not over sequences.
+        """
+        (n_sequences, n_digits) = digit_selection_ixs.shape
+        sequence_ixs = np.arange(n_sequences)[:, np.newaxis]
+        digit_columns = np.arange(self._single_img_width)
+        for i in range(n_digits):
+            columns = digit_offsets[:, i, np.newaxis] + digit_columns
+            if self._atlas is not None:
+                digit_images = self._atlas[digit_selection_ixs[:, i]]
+            else:
+                digit_images = np.divide(
+                    self._images[digit_selection_ixs[:, i]], 255,
+                    dtype=np.float32
+                )
+            # advanced indexes around a slice: target is [n x width x height]
+            images[sequence_ixs, :, columns] = digit_images.transpose(0, 2, 1)
+
+        return images
+
+    def _sample_glyph_layout(self, digit_sequences, spacing_range,
+                             image_width, random_state=None, max_redraws=100):
+        """
+        Draws one cropped glyph per digit and the ink to ink spaces between
+        them, so that every sequence spans exactly <image_width>. Feasibility
+        is checked from glyph widths only: sequences whose glyphs leave a free
+        space <spacing_range> cannot fill are redrawn, up to <max_redraws>
+        times. Returns the glyph indexes and their column offsets, as int
+        arrays of [n_sequences x n_digits].
+        """
+        (n_sequences, n_digits) = digit_sequences.shape
+        n_spaces = (n_digits - 1)
+        self._validate_spacing_range(spacing_range)
+        glyph_ixs = self._sample_digit_indexes(digit_sequences, random_state)
+        label_glyph_widths = self._label_glyph_widths[digit_sequences]
+        self._validate_width_limits(
+            image_width, spacing_range,
+            label_glyph_widths[..., 0].sum(axis=1).max()
+            + n_spaces * spacing_range[0],
+            label_glyph_widths[..., 1].sum(axis=1).min()
+            + n_spaces * spacing_range[1]
+        )
+        for n_draws in itertools.count(1):
+            free_space = (
+                image_width - self._glyph_widths[glyph_ixs].sum(axis=1)
+            )
+            unfit = (
+                (free_space < n_spaces * spacing_range[0])
+                | (free_space > n_spaces * spacing_range[1])
+            )
+            if self.method == 'equidistant' and n_spaces:
+                unfit |= (free_space % n_spaces != 0)
+            if not unfit.any():
+                break
+            if n_draws > max_redraws:
+                raise Exception(
+                    'Error: Could not draw glyphs for {n_unfit} sequences '
+                    'that fill <image_width>: {image_width} with the '
+                    '<spacing_range>: {spacing_range} in {n_draws} draws. '
+                    'Widen the <spacing_range> or change <image_width>.'
+                    .format(
+                        n_unfit=unfit.sum(), image_width=image_width,
+                        spacing_range=spacing_range, n_draws=n_draws
+                    )
+                )
+            glyph_ixs[unfit] = self._sample_digit_indexes(
+                digit_sequences[unfit], random_state
+            )
+
+        selected_spaces = np.zeros((n_sequences, n_spaces), dtype=np.int64)
+        if n_spaces:
+            for space in np.unique(free_space):
+                rows = (free_space == space)
+                selected_spaces[rows] = self._sample_spacing(
+                    n_digits, int(space), spacing_range, int(rows.sum()),
+                    random_state
+                )
+        glyph_offsets = np.zeros((n_sequences, n_digits), dtype=np.int64)
+        np.cumsum(
+            self._glyph_widths[glyph_ixs[:, :-1]] + selected_spaces,
+            axis=1, out=glyph_offsets[:, 1:]
+        )
+
+        return (glyph_ixs, glyph_offsets)
+
+    def _assemble_glyph_batch(self, glyph_ixs, glyph_offsets, images):
+        """
+        Copies the selected cropped glyphs, scaled to [0, 1], into the zeroed
+        float32 batch <images>, each glyph at its column offset and on its
+        original ink rows. All glyph pixels are scattered at once.
+        """
+        n_digits = glyph_ixs.shape[1]
+        glyph_ixs = glyph_ixs.ravel()
+        (top, bottom, left, right) = self._glyph_extents[glyph_ixs].T
+        widths = (right - left)
+        sizes = (bottom - top) * widths
+        # pixel <p> belongs to glyph <pixel_glyphs[p]>, at <local[p]> in it
+        pixel_glyphs = np.repeat(np.arange(len(glyph_ixs)), sizes)
+        local = (
+            np.arange(sizes.sum())
+            - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        )
+        (glyph_rows, glyph_columns) = np.divmod(local, widths[pixel_glyphs])
+        pixels = self._glyph_pixels[
+            np.repeat(self._glyph_offsets[glyph_ixs], sizes) + local
+        ]
+        if pixels.dtype != np.float32:
+            pixels = np.divide(pixels, 255, dtype=np.float32)
+        images[
+            pixel_glyphs // n_digits,
+            top[pixel_glyphs] + glyph_rows,
+            glyph_offsets.ravel()[pixel_glyphs] + glyph_columns
+        ] = pixels
+
+        return images
+
+    def stream(self, batch_size, n_digits, spacing_range, image_width,
+               n_steps=None, prefetch=2, n_workers=1):
+        """
+        Yield batches of random number sequence images, indefinitely or for
+        <n_steps> batches. Batches are generated ahead of consumption by
+        <n_workers> background threads into a queue holding at most
+        <prefetch> batches, which bounds memory use. The threads start
+        before <stream> returns, so even the first batch is prefetched.
+
+        Parameters
+        ----------
+        batch_size:
+            Number of sequence images per batch.
+        n_digits:
+            Number of digits per sequence. Digits are drawn uniformly from
+            the labels present in the dataset.
+        spacing_range:
+            A (minimum, maximum) pair (tuple), representing the min and max
+            spacing between digits. Unit should be pixel.
+        image_width:
+            specifies the width of the images in pixels.
+        n_steps:
+            Number of batches to yield. Default is None (no limit).
+        prefetch:
+            Maximum number of batches generated ahead. Default is 2.
+        n_workers:
+            Number of background generation threads. Default is 1.
+
+        Returns
+        -------
+        An iterator of (images, labels) pairs: a float32 array of
+        [batch_size x image_height x image_width] and the int array of
+        [batch_size x n_digits] digit sequences it represents.
+        """
+        for (name, value) in (
+            ('batch_size', batch_size), ('n_digits', n_digits),
+            ('prefetch', prefetch), ('n_workers', n_workers)
+        ):
+            if not isinstance(value, int) or value < 1:
+                raise Exception(
+                    'Error: Wrong <{name}> input: expected a positive <int>, '
+                    'got {input}'.format(name=name, input=value)
+                )
+        self._validate_image_width(spacing_range, image_width, n_digits)
+        self._validate_spacing_range(spacing_range)
+
+        batches = self._stream(
+            batch_size, n_digits, spacing_range, image_width,
+            n_steps, prefetch, n_workers
+        )
+        next(batches)  # starts the producers
+
+        return batches
+
+    def _stream(self, batch_size, n_digits, spacing_range, image_width,
+                n_steps, prefetch, n_workers):
+        """
+        Runs the <stream> producer threads and yields from their queue,
+        after a first None yielded once they are started. Producers are
+        stopped and joined when the iterator is exhausted, closed or garbage
+        collected.
+        """
+        available_digits = self._available_digits()
+        batches = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        steps = itertools.count()
+        steps_lock = threading.Lock()
+
+        def produce():
+            while not stop.is_set():
+                with steps_lock:
+                    step = next(steps)
+                if n_steps is not None and step >= n_steps:
+                    return
+                try:
+                    labels = available_digits[
+                        np.random.randint(
+                            0, len(available_digits), (batch_size, n_digits)
+                        )
+                    ]
+                    batch = (
+                        self.generate_numbers_sequence_batch(
+                            labels, spacing_range, image_width
+                        ),
+                        labels
+                    )
+                except Exception as error:
+                    batch = error
+                while not stop.is_set():
+                    try:
+                        batches.put(batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if isinstance(batch, Exception):
+                    return
+
+        producers = [
+            threading.Thread(target=produce, daemon=True)
+            for i in range(n_workers)
+        ]
+        try:
+            for producer in producers:
+                producer.start()
+            yield None
+            for step in (
+                itertools.count() if n_steps is None else range(n_steps)
+            ):
+                batch = batches.get()
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            for producer in producers:
+                producer.join()
+
+
+def _shard_sizes(n_images, n_workers):
+    """
+    Splits <n_images> into <n_workers> contiguous shard sizes.
+    """
+    return [
+        (n_images // n_workers) + (i < (n_images % n_workers))
+        for i in range(n_workers)
+    ]
+
+
+def _shard_ranges(n_images, n_workers, alignment=1):
+    """
+    Splits <n_images> into <n_workers> contiguous (start, stop) ranges whose
+    starts are multiples of <alignment>.
+    """
+    n_blocks = -(-n_images // alignment)
+    bounds = np.cumsum([0] + _shard_sizes(n_blocks, n_workers)) * alignment
+
+    return [
+        (int(min(start, n_images)), int(min(stop, n_images)))
+        for (start, stop) in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def _generate_shard(shard):
+    """
+    Generates one shard of CLI sequence images and hands them to the dataset
+    writer in chunks. Runs in a worker process, seeding numpy's global random
+    state from the shard's own seed sequence so shards are independent and
+    reproducible. Returns the generator <stats>.
+    """
+    (generator_options, digits, spacing_range, image_width,
+     (start, stop), writer, seed_sequence) = shard
+    np.random.seed(seed_sequence.generate_state(4))
+    sg = NumberSequenceGenerator(**generator_options)
+    try:
+        for chunk_start in range(start, stop, writer.chunk_size):
+            n_images = min(writer.chunk_size, stop - chunk_start)
+            images = sg.generate_numbers_sequence_batch(
+                [digits] * n_images, spacing_range, image_width
+            )
+            with sg.profiler.stage('write'):
+                writer.write(
+                    chunk_start, images, np.tile(digits, (n_images, 1))
+                )
+    finally:
+        writer.close()
+
+    return sg.stats()
+
+
+def _build_shard(shard):
+    """
+    Generates one npz shard of a resumable build, as <_generate_shard>
+    does, and returns its index, its manifest record and the generator
+    <stats>.
+    """
+    stats = _generate_shard(shard)
+    ((start, stop), writer) = shard[4:6]
+    shard_ix = start // writer.alignment
+    path = writer.shard_path(shard_ix)
+    record = {
+        'n_images': stop - start,
+        'size': os.path.getsize(path),
+        'sha256': file_sha256(path),
+    }
+
+    return (shard_ix, record, stats)
+
+
+def _run_build(manifest, writer, shards, n_workers, verify=False):
+    """
+    Generates the <shards> of a build that <manifest> does not record as
+    completed, recording each one as soon as it is written. Returns the
+    number of shards reused and the generator <stats> of the shards
+    generated.
+    """
+    completed = manifest.completed_shards(
+        [writer.shard_path(i) for i in range(len(shards))], verify
+    )
+    missing = [
+        shard for (shard_ix, shard) in enumerate(shards)
+        if shard_ix not in completed
+    ]
+    shard_stats = []
+
+    def record(results):
+        for (shard_ix, shard_record, stats) in results:
+            manifest.complete(shard_ix, shard_record)
+            shard_stats.append(stats)
+
+    if n_workers == 1:
+        record(map(_build_shard, missing))
+    else:
+        with multiprocessing.Pool(n_workers) as pool:
+            record(pool.imap_unordered(_build_shard, missing))
+
+    return (len(completed), shard_stats)
+
+
+def main(argv=None):
+    """
+    Command line entry point: generates sequence images into <output_dir>,
+    sharded across <workers> processes.
+    """
     parser = argparse.ArgumentParser()
     parser.add_argument(
         'digits',
@@ -312,7 +1785,7 @@ if __name__ == "__main__":
         '-m', type=str,
         help=(
             'spacing calculation method. Options:'
-            '["equidistant", "random_selection"]'
+            '["equidistant", "random_selection", "dirichlet", "auto"]'
         ),
         required=False, metavar='spacing_method', default='equidistant'
 
@@ -322,22 +1795,198 @@ if __name__ == "__main__":
         help=('number of sequence images to generate. -int'),
         required=False, metavar='n_sequence_images', default=1
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        '-j', '--workers', type=int,
+        help=('number of worker processes. -int'),
+        required=False, metavar='n_workers', default=1
+    )
+    parser.add_argument(
+        '--seed', type=int,
+        help=(
+            'base random seed. Output is identical for a given seed and '
+            'number of workers. -int'
+        ),
+        required=False, metavar='seed', default=None
+    )
+    parser.add_argument(
+        '-f', '--format', type=str,
+        help=(
+            'output format. Options:{formats}. Bulk formats also store the '
+            'digit sequence labels. Default is png, npz with --build'
+            .format(formats=list(OUTPUT_FORMATS))
+        ),
+        required=False, metavar='output_format', default=None,
+        choices=OUTPUT_FORMATS
+    )
+    parser.add_argument(
+        '-o', '--output-dir', type=str, help='output directory',
+        required=False, metavar='output_dir', default='.'
+    )
+    parser.add_argument(
+        '--shard-size', type=int,
+        help=('number of images per npz shard. -int'),
+        required=False, metavar='shard_size', default=10000
+    )
+    parser.add_argument(
+        '--images', type=str, help='images idx file path (.gz accepted)',
+        required=False, metavar='images_path',
+        default='augmentation/data/train-images.idx3-ubyte'
+    )
+    parser.add_argument(
+        '--labels', type=str, help='labels idx file path (.gz accepted)',
+        required=False, metavar='labels_path',
+        default='augmentation/data/train-labels.idx1-ubyte'
+    )
+    parser.add_argument(
+        '--cache-dir', type=str,
+        help='directory caching decoded gzip idx inputs',
+        required=False, metavar='cache_dir', default=None
+    )
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='print a per stage time breakdown at the end'
+    )
+    parser.add_argument(
+        '--digit-sampling', type=str, choices=DIGIT_SAMPLINGS,
+        help=(
+            'how source images are drawn per digit: random (independent '
+            'draws) or epoch (each image once before any is reused). With '
+            '-j or --build, every worker or shard starts its own epochs, so '
+            'images are used evenly within each worker or shard only'
+        ),
+        required=False, metavar='digit_sampling', default='random'
+    )
+    parser.add_argument(
+        '--build', action='store_true',
+        help=(
+            'resumable build: writes npz shards of --shard-size images and a '
+            'manifest of completed shards, each seeded on its own so output '
+            'is identical for a given seed whatever the number of workers. '
+            'Rerunning the command generates missing shards only'
+        )
+    )
+    parser.add_argument(
+        '--verify', action='store_true',
+        help=(
+            'with --build, checks the checksum of every completed shard, not '
+            'only its size, before reusing it'
+        )
+    )
+    args = parser.parse_args(argv)
     digits = [int(item)for item in args.digits.split(',')]
     spacing_method = args.m
     n_sequence_images = args.n
+    if args.workers < 1:
+        parser.error('number of workers must be a positive integer')
+
+    if args.shard_size < 1:
+        parser.error('shard size must be a positive integer')
 
-    sg = NumberSequenceGenerator(spacing_method=spacing_method)
-    for i in range(n_sequence_images):
-        filename = (str(uuid.uuid4()) + '.png')
-        stacked_images = sg.generate_numbers_sequence(
-                digits,
-                (args.min_spacing, args.max_spacing),
-                args.image_width
+    if args.build and args.format not in (None, 'npz'):
+        parser.error('builds are written as npz shards')
+
+    if args.build and n_sequence_images < 1:
+        parser.error('builds need a positive number of sequence images')
+
+    if args.verify and not args.build:
+        parser.error('--verify only applies to --build')
+
+    output_format = args.format
+    if output_format is None:
+        output_format = 'npz' if args.build else 'png'
+    generator_options = {
+        'input_filespec': {'images': args.images, 'labels': args.labels},
+        'spacing_method': spacing_method,
+        'cache_dir': args.cache_dir,
+        'profile': args.profile,
+        'digit_sampling': args.digit_sampling,
+    }
+    # loads (and decodes) the inputs once, before workers start
+    sg = NumberSequenceGenerator(**generator_options)
+    writer = get_writer(
+        output_format, args.output_dir, n_sequence_images,
+        (sg._single_img_height, args.image_width), len(digits),
+        args.shard_size
+    )
+    writer.create()
+    if args.build:
+        manifest = BuildManifest.open(args.output_dir, {
+            'digits': digits,
+            'spacing_range': [args.min_spacing, args.max_spacing],
+            'image_width': args.image_width,
+            'spacing_method': spacing_method,
+            'digit_sampling': args.digit_sampling,
+            'n_images': n_sequence_images,
+            'shard_size': args.shard_size,
+            'images': args.images,
+            'labels': args.labels,
+            'seed': args.seed,
+        })
+        # one seed per npz shard, so shards can be generated alone
+        n_shards = -(-n_sequence_images // args.shard_size)
+        seed_sequences = np.random.SeedSequence(
+            manifest.config['seed']
+        ).spawn(n_shards)
+        shard_ranges = _shard_ranges(
+            n_sequence_images, n_shards, writer.alignment
         )
-        plt.imsave(filename, stacked_images, cmap='Greys')
+    else:
+        seed_sequences = np.random.SeedSequence(args.seed).spawn(args.workers)
+        shard_ranges = _shard_ranges(
+            n_sequence_images, args.workers, writer.alignment
+        )
+    shared_data = None
+    if args.workers > 1:
+        # workers attach to the parent's arrays instead of loading their own
+        shared_data = sg.share()
+        generator_options = {
+            'shared_data': shared_data,
+            'spacing_method': spacing_method,
+            'profile': args.profile,
+            'digit_sampling': args.digit_sampling,
+        }
+    shards = [
+        (
+            generator_options, digits,
+            (args.min_spacing, args.max_spacing), args.image_width,
+            shard_range, writer, seed_sequence
+        )
+        for (shard_range, seed_sequence) in zip(shard_ranges, seed_sequences)
+    ]
+    try:
+        if args.build:
+            (n_reused, shard_stats) = _run_build(
+                manifest, writer, shards, args.workers, args.verify
+            )
+        elif args.workers == 1:
+            shard_stats = list(map(_generate_shard, shards))
+        else:
+            with multiprocessing.Pool(args.workers) as pool:
+                shard_stats = pool.map(_generate_shard, shards, chunksize=1)
+    finally:
+        if shared_data is not None:
+            shared_data.unlink()
 
     print(
-        'Successfully created {n_sequence_images} digit sequence and saved on '
-        'current directory'.format(n_sequence_images=n_sequence_images)
+        'Successfully created {n_sequence_images} digit sequence images and '
+        'saved them as {output_format} on {output_dir}'.format(
+            n_sequence_images=n_sequence_images, output_format=output_format,
+            output_dir=(
+                'current directory' if args.output_dir == '.'
+                else args.output_dir
+            )
+        )
     )
+    if args.build:
+        print(
+            'Reused {n_reused} of {n_shards} completed shards'.format(
+                n_reused=n_reused, n_shards=len(shards)
+            )
+        )
+    if args.profile:
+        # times are summed over worker processes
+        print(format_stats(merge_stats([sg.stats()] + shard_stats)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+"""
+Service
+
+This module hosts a local generation service: one process owns a loaded
+NumberSequenceGenerator and serves sequence images to many clients (e.g.
+training jobs) over a Unix socket or a localhost TCP port, so the dataset is
+loaded once.
+
+Concurrent requests for the same (n_digits, spacing_range, image_width)
+shape are gathered for up to <max_delay> seconds, or until <max_batch_size>
+sequences are pending, and generated in one batched pass. Images are sent
+as raw float32 bytes, not re-encoded.
+
+Messages are framed as a 4 byte big endian length followed by a JSON
+header. Requests are {"digits": [[...], ...], "spacing_range": [min, max],
+"image_width": int}. Responses are {"shape": [...], "dtype": "float32"}
+followed by the image bytes, or {"error": message}.
+
+    python -m augmentation.service --socket /tmp/sequences.sock
+"""
+import os
+import sys
+import json
+import socket
+import struct
+import asyncio
+import argparse
+import concurrent.futures
+import numpy as np
+
+if __package__ in (None, ''):  # executed as a script: make package importable
+    sys.path.insert(
+        0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+from augmentation.sequence_generators import (  # noqa: E402
+    NumberSequenceGenerator
+)
+
+
+HEADER_LENGTH = struct.Struct('>I')
+
+# largest JSON header accepted, in bytes
+MAX_HEADER_SIZE = 1 << 24
+
+
+def _pack_header(header):
+    """
+    Frames <header> as a length prefixed JSON message.
+    """
+    data = json.dumps(header).encode()
+
+    return HEADER_LENGTH.pack(len(data)) + data
+
+
+def _unpack_header_length(data):
+    (length,) = HEADER_LENGTH.unpack(data)
+    if length > MAX_HEADER_SIZE:
+        raise Exception(
+            'Error: Message header of {length} bytes exceeds {max_size}.'
+            .format(length=length, max_size=MAX_HEADER_SIZE)
+        )
+
+    return length
+
+
+class GenerationServer():
+    """
+    Asyncio server generating sequence images in micro-batches.
+
+    Parameters
+    ----------
+    generator:
+        The NumberSequenceGenerator serving every request.
+    address:
+        A Unix socket path (str), or a (host, port) pair (tuple) to listen
+        on TCP. Port 0 picks a free port, see <address> once started.
+    max_batch_size:
+        Number of pending sequences of one shape that triggers generation
+        without waiting. Default is 1024
+    max_delay:
+        Seconds a request waits for others of its shape. Default is 0.002
+    seed:
+        Seed (int) of the server's random state. Default is None (fresh
+        entropy).
+    """
+    def __init__(self, generator, address, max_batch_size=1024,
+                 max_delay=0.002, seed=None):
+        self.generator = generator
+        self.address = address
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.random_state = np.random.RandomState(seed)
+        self._server = None
+        self._pending = {}
+        self._timers = {}
+        self._tasks = set()
+        # generation runs off the event loop, one batch at a time
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.n_requests = 0
+        self.n_batches = 0
+        self.n_sequences = 0
+
+    async def start(self):
+        """
+        Starts listening on <address>.
+        """
+        if isinstance(self.address, str):
+            self._server = await asyncio.start_unix_server(
+                self._handle_connection, self.address
+            )
+        else:
+            self._server = await asyncio.start_server(
+                self._handle_connection, *self.address
+            )
+            self.address = self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        """
+        Starts the server if needed and serves until cancelled.
+        """
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        """
+        Stops listening, waits for open connections and releases the
+        generation thread.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=True)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def stats(self):
+        """
+        Returns the number of requests, generation batches and sequences
+        served so far.
+        """
+        return {
+            'requests': self.n_requests,
+            'batches': self.n_batches,
+            'sequences': self.n_sequences,
+        }
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Serves the requests of one connection, in order, until the client
+        disconnects. A malformed message closes the connection, since the
+        stream cannot be resynchronized.
+        """
+        try:
+            while True:
+                try:
+                    length = _unpack_header_length(
+                        await reader.readexactly(HEADER_LENGTH.size)
+                    )
+                    request = json.loads(await reader.readexactly(length))
+                except asyncio.IncompleteReadError:
+                    return
+                except Exception as error:
+                    writer.write(_pack_header({'error': str(error)}))
+                    await writer.drain()
+                    return
+                try:
+                    images = await self._submit(request)
+                except Exception as error:
+                    writer.write(_pack_header({'error': str(error)}))
+                else:
+                    writer.write(_pack_header({
+                        'shape': list(images.shape), 'dtype': 'float32'
+                    }))
+                    writer.write(memoryview(images).cast('B'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _validate_request(self, request):
+        """
+        Checks a request on its own, so one bad request does not fail the
+        batch it would join. Returns its digit sequences and shape key.
+        """
+        try:
+            (digits, spacing_range, image_width) = (
+                request['digits'], tuple(request['spacing_range']),
+                request['image_width']
+            )
+        except (KeyError, TypeError):
+            raise Exception(
+                'Error: Wrong request: expected "digits", "spacing_range" '
+                'and "image_width".'
+            )
+        generator = self.generator
+        digit_sequences = generator._validate_digit_sequences(digits)
+        n_digits = digit_sequences.shape[1]
+        generator._validate_spacing_range(spacing_range)
+        generator._validate_image_width(spacing_range, image_width, n_digits)
+        missing_digits = sorted(
+            set(digit_sequences.ravel().tolist())
+            - set(generator._available_digits().tolist())
+        )
+        if missing_digits:
+            raise Exception(
+                'Error: Wrong digit input. Digits {missing} are not present '
+                'in the dataset labels.'.format(missing=missing_digits)
+            )
+
+        return (digit_sequences, (n_digits, spacing_range, image_width))
+
+    async def _submit(self, request):
+        """
+        Queues a request with others of its shape and waits for its images.
+        """
+        (digit_sequences, key) = self._validate_request(request)
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((digit_sequences, future))
+        self.n_requests += 1
+        if sum(len(x) for (x, f) in pending) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.get_running_loop().call_later(
+                self.max_delay, self._flush, key
+            )
+
+        return await future
+
+    def _flush(self, key):
+        """
+        Starts generating every pending request of shape <key>.
+        """
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        requests = self._pending.pop(key, [])
+        if requests:
+            task = asyncio.ensure_future(self._generate(key, requests))
+            # the loop only keeps weak references to tasks
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _generate(self, key, requests):
+        """
+        Generates the sequences of <requests> in one batch and hands each
+        request its slice.
+        """
+        (n_digits, spacing_range, image_width) = key
+        digit_sequences = np.concatenate([x for (x, f) in requests])
+        self.n_batches += 1
+        self.n_sequences += len(digit_sequences)
+        try:
+            images = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.generator.generate_numbers_sequence_batch,
+                digit_sequences, spacing_range, image_width, self.random_state
+            )
+        except Exception as error:
+            for (x, future) in requests:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        start = 0
+        for (x, future) in requests:
+            if not future.done():  # the client may have gone
+                future.set_result(images[start:start + len(x)])
+            start += len(x)
+
+
+class GenerationClient():
+    """
+    Blocking client of a GenerationServer, reusing one connection for all
+    requests.
+
+    Parameters
+    ----------
+    address:
+        The server's Unix socket path (str) or (host, port) pair (tuple).
+    timeout:
+        Socket timeout in seconds. Default is None (no timeout).
+    """
+    def __init__(self, address, timeout=None):
+        self.address = address
+        self.timeout = timeout
+        self._socket = None
+
+    def _connect(self):
+        if isinstance(self.address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(self.timeout)
+            self._socket.connect(self.address)
+        else:
+            self._socket = socket.create_connection(
+                tuple(self.address), self.timeout
+            )
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _receive(self, n_bytes):
+        data = bytearray(n_bytes)
+        view = memoryview(data)
+        while view:
+            n_received = self._socket.recv_into(view)
+            if not n_received:
+                raise ConnectionError('Error: Server closed the connection.')
+            view = view[n_received:]
+
+        return data
+
+    def generate(self, digit_sequences, spacing_range, image_width):
+        """
+        Requests one image per digit sequence. Returns a float32 array of
+        [n_sequences x image_height x image_width] over the received bytes.
+        """
+        if self._socket is None:
+            self._connect()
+        try:
+            self._socket.sendall(_pack_header({
+                'digits': [
+                    [int(digit) for digit in digits]
+                    for digits in digit_sequences
+                ],
+                'spacing_range': list(spacing_range),
+                'image_width': image_width,
+            }))
+            header = json.loads(self._receive(
+                _unpack_header_length(self._receive(HEADER_LENGTH.size))
+            ))
+            if 'error' in header:
+                raise Exception(header['error'])
+            shape = tuple(header['shape'])
+            data = self._receive(
+                int(np.prod(shape)) * np.dtype(header['dtype']).itemsize
+            )
+        except (OSError, ValueError):
+            self.close()  # the stream is out of sync: reconnect next time
+            raise
+
+        return np.frombuffer(data, dtype=header['dtype']).reshape(shape)
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv=None):
+    """
+    Command line entry point: serves a generator until interrupted.
+    """
+    parser = argparse.ArgumentParser()
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument(
+        '--socket', type=str, help='unix socket path', metavar='socket_path'
+    )
+    address.add_argument(
+        '--port', type=int, help='localhost TCP port', metavar='port'
+    )
+    parser.add_argument(
+        '-m', type=str, help='spacing calculation method',
+        metavar='spacing_method', default='dirichlet'
+    )
+    parser.add_argument(
+        '--images', type=str, help='images idx file path (.gz accepted)',
+        metavar='images_path',
+        default='augmentation/data/train-images.idx3-ubyte'
+    )
+    parser.add_argument(
+        '--labels', type=str, help='labels idx file path (.gz accepted)',
+        metavar='labels_path',
+        default='augmentation/data/train-labels.idx1-ubyte'
+    )
+    parser.add_argument(
+        '--max-batch-size', type=int, default=1024, metavar='n_sequences',
+        help='pending sequences of one shape generated without waiting. -int'
+    )
+    parser.add_argument(
+        '--max-delay', type=float, default=0.002, metavar='seconds',
+        help='seconds a request waits for others of its shape. -float'
+    )
+    parser.add_argument(
+        '--seed', type=int, default=None, metavar='seed',
+        help='random seed. -int'
+    )
+    args = parser.parse_args(argv)
+    generator = NumberSequenceGenerator(
+        {'images': args.images, 'labels': args.labels}, args.m
+    )
+    server = GenerationServer(
+        generator,
+        args.socket if args.socket else ('127.0.0.1', args.port),
+        args.max_batch_size, args.max_delay, args.seed
+    )
+
+    async def serve():
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Shared
+
+This module hosts shared generator data: the loaded and precomputed arrays
+of a NumberSequenceGenerator saved once as '.npy' files, by default on the
+/dev/shm memory filesystem, and memory-mapped read-only by every process
+that attaches to them. Attaching parses no idx file, decompresses nothing
+and copies no pixel, so worker processes start at once and share one copy
+of the data whatever their number.
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+# memory backed filesystem holding shared data, when the system has one
+SHARED_MEMORY_DIR = '/dev/shm'
+
+
+class SharedGeneratorData():
+    """
+    Handle to generator arrays shared through memory-mapped files. Handles
+    pickle as their directory path (the name processes attach by) and the
+    generator options the arrays were computed with.
+
+    Parameters
+    ----------
+    path:
+        Directory holding one '<name>.npy' file per array.
+    options:
+        Dict of the generator options the arrays depend on.
+    """
+    def __init__(self, path, options):
+        self.path = path
+        self.options = options
+
+    @classmethod
+    def create(cls, arrays, options, directory=None):
+        """
+        Saves the <arrays> dict into a new directory within <directory>
+        (default: SHARED_MEMORY_DIR when present, else the temporary
+        directory) and returns its handle.
+        """
+        if directory is None and os.path.isdir(SHARED_MEMORY_DIR):
+            directory = SHARED_MEMORY_DIR
+        path = tempfile.mkdtemp(prefix='sequence-generator-', dir=directory)
+        for (name, array) in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+
+        return cls(path, options)
+
+    def load(self):
+        """
+        Returns the shared arrays as a dict of read-only memory-mapped
+        arrays.
+        """
+        return {
+            filename[:-len('.npy')]: np.load(
+                os.path.join(self.path, filename), mmap_mode='r'
+            ).view(np.ndarray)
+            for filename in sorted(os.listdir(self.path))
+            if filename.endswith('.npy')
+        }
+
+    def unlink(self):
+        """
+        Removes the shared files. Processes already attached keep their
+        mappings.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.unlink()
@@ -0,0 +1,423 @@
+"""
+Transforms
+
+This module hosts augmentation stages working on whole batches of generated
+sequence images, float32 arrays of [n_images x height x width] in [0, 1]:
+affine jitter (per image or per digit), elastic distortion, stroke
+thickness changes and noise. Stages are chained with <Compose>, and a
+NumberSequenceGenerator built with <transform=...> applies them to every
+image it generates, right after assembly.
+
+Stages modify batches in place and return them. Geometric stages resample
+each batch with one vectorized bilinear gather, starting from coordinate
+grids (and, for elastic distortion, displacement fields) computed once per
+image shape and cached.
+
+Seeded stages draw from their own RandomState. Other stages draw from the
+random state they are called with (the generator's, so SequenceDataset
+items stay reproducible), or from numpy's global random state.
+"""
+import functools
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+
+@functools.lru_cache(maxsize=32)
+def coordinate_grid(height, width):
+    """
+    Returns the read-only float32 (rows, columns) coordinates of every pixel
+    of a [height x width] image, computed once per shape.
+    """
+    grid = np.indices((height, width), dtype=np.float32)
+    grid.flags.writeable = False
+
+    return (grid[0], grid[1])
+
+
+def bilinear_sample(images, rows, columns):
+    """
+    Samples float32 <images> of [n_images x height x width] at the fractional
+    <rows> and <columns> coordinates, arrays broadcastable to their shape,
+    with bilinear interpolation. Coordinates outside the images read 0
+    (black). Returns a new float32 array.
+    """
+    (n_images, height, width) = images.shape
+    rows = np.broadcast_to(rows, images.shape)
+    columns = np.broadcast_to(columns, images.shape)
+    # a zero border turns out of bounds reads into reads of the border
+    padded = np.zeros((n_images, height + 2, width + 2), dtype=np.float32)
+    padded[:, 1:-1, 1:-1] = images
+    rows = np.clip(rows + 1, 0, height + 1, dtype=np.float32)
+    columns = np.clip(columns + 1, 0, width + 1, dtype=np.float32)
+    # float32 floors keep the interpolation weights in float32
+    top = np.minimum(np.floor(rows), height)
+    left = np.minimum(np.floor(columns), width)
+    row_weights = rows - top
+    column_weights = columns - left
+    ixs = top.astype(np.intp)
+    ixs *= width + 2
+    ixs += left.astype(np.intp)
+    ixs += (
+        np.arange(n_images)[:, np.newaxis, np.newaxis]
+        * ((height + 2) * (width + 2))
+    )
+    pixels = padded.ravel()
+    upper = pixels[ixs] + column_weights * (pixels[ixs + 1] - pixels[ixs])
+    ixs += width + 2
+    lower = pixels[ixs] + column_weights * (pixels[ixs + 1] - pixels[ixs])
+
+    return upper + row_weights * (lower - upper)
+
+
+def _validate_range(name, value_range):
+    """
+    Checks <value_range> is a (minimum, maximum) pair of numbers.
+    """
+    try:
+        (minimum, maximum) = value_range
+        valid = (minimum <= maximum)
+    except (TypeError, ValueError):
+        valid = False
+    if not valid:
+        raise Exception(
+            'Error: Wrong <{name}> input: expected a (minimum, maximum) pair, '
+            'got {input}'.format(name=name, input=value_range)
+        )
+
+    return (minimum, maximum)
+
+
+class Transform():
+    """
+    Base class of batch augmentation stages. Subclasses implement <apply>.
+
+    Parameters
+    ----------
+    probability:
+        Probability for each image to go through the stage. Default is 1.0
+    seed:
+        Seed (int) of the stage's own random state. Default is None (the
+        random state the stage is called with).
+    """
+    def __init__(self, probability=1.0, seed=None):
+        if not 0 <= probability <= 1:
+            raise Exception(
+                'Error: Wrong <probability> input: expected a number within '
+                '[0, 1], got {input}'.format(input=probability)
+            )
+        self.probability = probability
+        self.random_state = (
+            None if seed is None else np.random.RandomState(seed)
+        )
+
+    def __call__(self, images, digit_spans=None, random_state=None):
+        """
+        Transforms the float32 <images> of [n_images x height x width] in
+        place and returns them. <digit_spans> holds the (start, stop) columns
+        of each digit, as an int array of [n_images x n_digits x 2].
+        <random_state> is used unless the stage is seeded.
+        """
+        if self.random_state is not None:
+            random_state = self.random_state
+        elif random_state is None:
+            random_state = np.random
+        if self.probability < 1:
+            rows = np.flatnonzero(
+                random_state.random_sample(len(images)) < self.probability
+            )
+            if len(rows):
+                images[rows] = self.apply(
+                    images[rows],
+                    None if digit_spans is None else digit_spans[rows],
+                    random_state
+                )
+            return images
+        transformed = self.apply(images, digit_spans, random_state)
+        if transformed is not images:
+            images[...] = transformed
+
+        return images
+
+    def apply(self, images, digit_spans, random_state):
+        """
+        Returns the transformed <images>, a new array or <images> modified
+        in place.
+        """
+        raise NotImplementedError
+
+
+class Compose():
+    """
+    Applies augmentation stages in order.
+
+    Parameters
+    ----------
+    stages:
+        A list of stages (Transform).
+    seed:
+        Seed (int) of a random state shared by the unseeded stages. Default
+        is None (the random state the pipeline is called with).
+    """
+    def __init__(self, stages, seed=None):
+        self.stages = list(stages)
+        self.random_state = (
+            None if seed is None else np.random.RandomState(seed)
+        )
+
+    def __call__(self, images, digit_spans=None, random_state=None):
+        if self.random_state is not None:
+            random_state = self.random_state
+        for stage in self.stages:
+            images = stage(images, digit_spans, random_state)
+
+        return images
+
+
+class AffineJitter(Transform):
+    """
+    Rotates, scales, shears and translates each image about its center, or
+    each digit about its own center, by amounts drawn uniformly within the
+    given limits.
+
+    Parameters
+    ----------
+    rotation:
+        Maximum absolute rotation, in degrees. Default is 10
+    scale:
+        A (minimum, maximum) pair of scale factors. Default is (0.9, 1.1)
+    shear:
+        Maximum absolute horizontal shear, in degrees. Default is 10
+    translation:
+        Maximum absolute (rows, columns) translation, in pixels. Default is
+        (1, 1)
+    per_digit:
+        Transforms every digit on its own, within its column band (the
+        columns closer to it than to its neighbours). Needs the digit spans
+        generators pass along. Default is False
+    probability, seed:
+        See <Transform>.
+    """
+    def __init__(self, rotation=10, scale=(0.9, 1.1), shear=10,
+                 translation=(1, 1), per_digit=False, probability=1.0,
+                 seed=None):
+        super().__init__(probability, seed)
+        self.rotation = rotation
+        self.scale = _validate_range('scale', scale)
+        self.shear = shear
+        self.translation = translation
+        self.per_digit = per_digit
+
+    def apply(self, images, digit_spans, random_state):
+        (n_images, height, width) = images.shape
+        if not self.per_digit:
+            digit_spans = np.tile([[[0, width]]], (n_images, 1, 1))
+        elif digit_spans is None:
+            raise Exception(
+                'Error: Per digit affine jitter needs <digit_spans>.'
+            )
+        (starts, stops) = (digit_spans[..., 0], digit_spans[..., 1])
+        size = starts.shape
+        angles = np.radians(
+            random_state.uniform(-self.rotation, self.rotation, size)
+        )
+        shears = np.tan(np.radians(
+            random_state.uniform(-self.shear, self.shear, size)
+        ))
+        scales = random_state.uniform(self.scale[0], self.scale[1], size)
+        shifts = [
+            random_state.uniform(-limit, limit, size)
+            for limit in self.translation
+        ]
+        # inverse of scale, then shear, then rotation, mapping output pixels
+        # back to their source: (rows, columns) = inverse @ (dr, dc)
+        (cos, sin) = (np.cos(angles) / scales, np.sin(angles) / scales)
+        inverse = [
+            [cos, sin],
+            [-shears * cos - sin, cos - shears * sin],
+        ]
+
+        # each column belongs to the band of the nearest digit
+        bounds = (stops[:, :-1] + starts[:, 1:]) / 2
+        columns = np.arange(width)
+        bands = (
+            columns[np.newaxis, np.newaxis] >= bounds[..., np.newaxis]
+        ).sum(axis=1)
+        band_starts = np.concatenate(
+            [np.zeros((n_images, 1)), bounds], axis=1
+        )
+        band_stops = np.concatenate(
+            [bounds, np.full((n_images, 1), width)], axis=1
+        )
+        image_ixs = np.arange(n_images)[:, np.newaxis]
+
+        def per_column(values):
+            return values[image_ixs, bands].astype(np.float32)[:, None]
+
+        center_row = (height - 1) / 2
+        center_columns = per_column((starts + stops - 1) / 2)
+        (rows, columns) = coordinate_grid(height, width)
+        row_offsets = rows - center_row - per_column(shifts[0])
+        column_offsets = columns - center_columns - per_column(shifts[1])
+        source_rows = (
+            center_row
+            + per_column(inverse[0][0]) * row_offsets
+            + per_column(inverse[0][1]) * column_offsets
+        )
+        source_columns = (
+            center_columns
+            + per_column(inverse[1][0]) * row_offsets
+            + per_column(inverse[1][1]) * column_offsets
+        )
+        # digits only read ink from their own band
+        outside = (
+            (source_columns < per_column(band_starts) - 0.5)
+            | (source_columns > per_column(band_stops) - 0.5)
+        )
+        source_columns[outside] = -2
+
+        return bilinear_sample(images, source_rows, source_columns)
+
+
+class ElasticDistortion(Transform):
+    """
+    Displaces pixels along smooth random fields (Simard et al., 2003):
+    uniform noise smoothed by a gaussian of <sigma> pixels and scaled by
+    <alpha> pixels.
+
+    Smoothing dominates the cost, so a bank of <n_fields> fields is drawn
+    once per image shape, from <seed> (0 when None) so banks are the same in
+    every process. Each image uses a random field of the bank, with a random
+    sign per axis.
+
+    Parameters
+    ----------
+    alpha:
+        Displacement scale, in pixels. Default is 34
+    sigma:
+        Standard deviation of the smoothing gaussian, in pixels. Default is 4
+    n_fields:
+        Number of fields drawn per image shape. Default is 64
+    probability, seed:
+        See <Transform>.
+    """
+    def __init__(self, alpha=34, sigma=4, n_fields=64, probability=1.0,
+                 seed=None):
+        super().__init__(probability, seed)
+        self.alpha = alpha
+        self.sigma = sigma
+        self.n_fields = n_fields
+        self.field_seed = 0 if seed is None else seed
+        self._field_banks = {}
+
+    def field_bank(self, height, width):
+        """
+        Returns the float32 bank of [n_fields x 2 x height x width] unit
+        displacement fields of images of [height x width], drawing it on
+        first use.
+        """
+        if (height, width) not in self._field_banks:
+            noise = np.random.RandomState(self.field_seed).uniform(
+                -1, 1, (self.n_fields, 2, height, width)
+            )
+            fields = gaussian_filter(
+                noise, (0, 0, self.sigma, self.sigma), mode='constant'
+            ).astype(np.float32)
+            fields.flags.writeable = False
+            self._field_banks[(height, width)] = fields
+
+        return self._field_banks[(height, width)]
+
+    def apply(self, images, digit_spans, random_state):
+        (n_images, height, width) = images.shape
+        fields = self.field_bank(height, width)[
+            random_state.randint(self.n_fields, size=n_images)
+        ]
+        fields *= random_state.choice(
+            np.float32([-self.alpha, self.alpha]), (n_images, 2, 1, 1)
+        )
+        (rows, columns) = coordinate_grid(height, width)
+
+        return bilinear_sample(
+            images, rows + fields[:, 0], columns + fields[:, 1]
+        )
+
+    def __getstate__(self):  # banks are cheaper to redraw than to pickle
+        state = self.__dict__.copy()
+        state['_field_banks'] = {}
+        return state
+
+
+class StrokeThickness(Transform):
+    """
+    Thickens (grey dilation) or thins (grey erosion) strokes by a random
+    number of pixels per image, within [-max_radius, max_radius]. Negative
+    radii thin strokes.
+
+    Parameters
+    ----------
+    max_radius:
+        Maximum absolute radius, in pixels. Default is 1
+    probability, seed:
+        See <Transform>.
+    """
+    def __init__(self, max_radius=1, probability=1.0, seed=None):
+        super().__init__(probability, seed)
+        self.max_radius = max_radius
+
+    def apply(self, images, digit_spans, random_state):
+        radii = random_state.randint(
+            -self.max_radius, self.max_radius + 1, size=len(images)
+        )
+        for radius in np.unique(radii[radii != 0]):
+            rows = (radii == radius)
+            images[rows] = self._morph(
+                images[rows], abs(radius),
+                np.maximum if radius > 0 else np.minimum
+            )
+
+        return images
+
+    def _morph(self, images, radius, operation):
+        """
+        Applies <operation> (np.maximum dilates, np.minimum erodes) <radius>
+        times over each pixel and its 4 neighbours.
+        """
+        (height, width) = images.shape[1:]
+        for i in range(radius):
+            padded = np.pad(images, ((0, 0), (1, 1), (1, 1)), mode='edge')
+            images = padded[:, 1:-1, 1:-1].copy()
+            for (row, column) in ((0, 1), (2, 1), (1, 0), (1, 2)):
+                operation(
+                    images,
+                    padded[:, row:row + height, column:column + width],
+                    out=images
+                )
+
+        return images
+
+
+class GaussianNoise(Transform):
+    """
+    Adds gaussian noise with a standard deviation drawn per image within
+    <std>, then clips pixels to [0, 1].
+
+    Parameters
+    ----------
+    std:
+        A (minimum, maximum) pair of standard deviations. Default is
+        (0, 0.1)
+    probability, seed:
+        See <Transform>.
+    """
+    def __init__(self, std=(0, 0.1), probability=1.0, seed=None):
+        super().__init__(probability, seed)
+        self.std = _validate_range('std', std)
+
+    def apply(self, images, digit_spans, random_state):
+        stds = random_state.uniform(self.std[0], self.std[1], len(images))
+        noise = random_state.standard_normal(images.shape).astype(np.float32)
+        noise *= stds.astype(np.float32)[:, np.newaxis, np.newaxis]
+        images += noise
+        np.clip(images, 0, 1, out=images)
+
+        return images
@@ -0,0 +1,271 @@
+"""
+Writers
+
+This module hosts dataset writers for generated sequence images. Bulk formats
+store every image together with the digit sequence it represents:
+
+- 'npy': one images.npy and one labels.npy array.
+- 'idx': images.idx3-ubyte and labels.idx2-ubyte, as read by the generators.
+- 'npz': fixed size shard-<n>.npz files, each holding images and labels.
+- 'png': one uuid named png image per sequence, without labels.
+
+Png images are encoded here with numpy and zlib, so no plotting library is
+imported to write them.
+
+Writers are created once (<create>) and then filled by range (<write>),
+possibly from several worker processes writing disjoint ranges. The 'npy'
+and 'idx' files are preallocated and memory-mapped, so datasets larger than
+memory are written in place.
+"""
+import os
+import zlib
+import uuid
+import struct
+import numpy as np
+
+from augmentation.idx import create_idx, read_idx
+
+
+OUTPUT_FORMATS = ('png', 'npy', 'idx', 'npz')
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _png_chunk(chunk_type, data):
+    """
+    Packs a png chunk: length, type, data and crc of type and data.
+    """
+    return (
+        struct.pack('>I', len(data)) + chunk_type + data
+        + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xFFFFFFFF)
+    )
+
+
+def encode_png(image, invert=True, compression_level=6):
+    """
+    Encodes a 2D image with values in [0, 1] as an 8 bit grayscale png.
+    With <invert> (default), 1 is drawn black on a white background, as the
+    'Greys' colormap used to do. Returns the png file bytes.
+    """
+    image = np.asarray(image)
+    if image.ndim != 2:
+        raise Exception(
+            'Error: Wrong image input: expected a 2D array, got shape '
+            '{shape}'.format(shape=image.shape)
+        )
+    pixels = np.rint(np.clip(image, 0, 1) * 255).astype(np.uint8)
+    if invert:
+        pixels = 255 - pixels
+    (height, width) = pixels.shape
+    # every scanline starts with its filter type byte: 0 (none)
+    scanlines = np.zeros((height, width + 1), dtype=np.uint8)
+    scanlines[:, 1:] = pixels
+    header = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+
+    return (
+        PNG_SIGNATURE
+        + _png_chunk(b'IHDR', header)
+        + _png_chunk(
+            b'IDAT', zlib.compress(scanlines.tobytes(), compression_level)
+        )
+        + _png_chunk(b'IEND', b'')
+    )
+
+
+def write_png(filename, image, invert=True):
+    """
+    Writes a 2D image with values in [0, 1] as an 8 bit grayscale png file.
+    """
+    with open(filename, 'wb') as png_file:
+        png_file.write(encode_png(image, invert))
+
+
+class DatasetWriter():
+    """
+    Base class for dataset writers.
+
+    Parameters
+    ----------
+    output_dir:
+        Directory where dataset files are written.
+    n_images:
+        Total number of images in the dataset.
+    image_shape:
+        An (image_height, image_width) pair (tuple).
+    n_digits:
+        Number of digits per sequence (label length).
+    """
+    # writes must start at multiples of <alignment> and span at most
+    # <chunk_size> images
+    alignment = 1
+    chunk_size = 1024
+
+    def __init__(self, output_dir, n_images, image_shape, n_digits):
+        self.output_dir = output_dir
+        self.n_images = n_images
+        self.image_shape = tuple(image_shape)
+        self.n_digits = n_digits
+
+    def create(self):
+        """
+        Creates the output directory and any preallocated files. Called once,
+        before any <write>.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def write(self, start, images, labels):
+        """
+        Writes float32 <images> of [n x image_height x image_width] and int
+        <labels> of [n x n_digits] as dataset items <start> to <start + n>.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Flushes and releases any open file.
+        """
+
+
+class PngWriter(DatasetWriter):
+    """
+    Writes one uuid named png image per sequence. Names are drawn from
+    numpy's global random state, so seeded runs are reproducible.
+    """
+    def write(self, start, images, labels):
+        for image in images:
+            # file names come from the seeded stream to keep runs reproducible
+            file_id = uuid.UUID(bytes=np.random.bytes(16), version=4)
+            filename = os.path.join(self.output_dir, str(file_id) + '.png')
+            write_png(filename, image)
+
+
+class NpyWriter(DatasetWriter):
+    """
+    Writes images.npy (float32) and labels.npy (uint8) arrays, preallocated
+    with <np.lib.format.open_memmap>.
+    """
+    def __init__(self, output_dir, n_images, image_shape, n_digits):
+        super().__init__(output_dir, n_images, image_shape, n_digits)
+        self.images_path = os.path.join(output_dir, 'images.npy')
+        self.labels_path = os.path.join(output_dir, 'labels.npy')
+        self._images = None
+        self._labels = None
+
+    def create(self):
+        super().create()
+        np.lib.format.open_memmap(
+            self.images_path, mode='w+', dtype=np.float32,
+            shape=(self.n_images,) + self.image_shape
+        ).flush()
+        np.lib.format.open_memmap(
+            self.labels_path, mode='w+', dtype=np.uint8,
+            shape=(self.n_images, self.n_digits)
+        ).flush()
+
+    def _open(self):
+        return (
+            np.load(self.images_path, mmap_mode='r+'),
+            np.load(self.labels_path, mmap_mode='r+')
+        )
+
+    def write(self, start, images, labels):
+        if self._images is None:
+            (self._images, self._labels) = self._open()
+        self._images[start:start + len(images)] = images
+        self._labels[start:start + len(labels)] = labels
+
+    def close(self):
+        for array in (self._images, self._labels):
+            mapped = array if isinstance(array, np.memmap) else getattr(
+                array, 'base', None
+            )
+            if isinstance(mapped, np.memmap):
+                mapped.flush()
+        self._images = None
+        self._labels = None
+
+    def __getstate__(self):  # open maps stay with the process that made them
+        state = self.__dict__.copy()
+        state.update({'_images': None, '_labels': None})
+        return state
+
+
+class IdxWriter(NpyWriter):
+    """
+    Writes images.idx3-ubyte (uint8 pixels, 0-255) and labels.idx2-ubyte
+    (uint8 digit sequences) idx files, preallocated and memory-mapped.
+    """
+    def __init__(self, output_dir, n_images, image_shape, n_digits):
+        super().__init__(output_dir, n_images, image_shape, n_digits)
+        self.images_path = os.path.join(output_dir, 'images.idx3-ubyte')
+        self.labels_path = os.path.join(output_dir, 'labels.idx2-ubyte')
+
+    def create(self):
+        DatasetWriter.create(self)
+        create_idx(
+            self.images_path, np.uint8, (self.n_images,) + self.image_shape
+        )
+        create_idx(self.labels_path, np.uint8, (self.n_images, self.n_digits))
+
+    def _open(self):
+        return (
+            read_idx(self.images_path, mode='r+'),
+            read_idx(self.labels_path, mode='r+')
+        )
+
+    def write(self, start, images, labels):
+        super().write(start, np.rint(images * 255), labels)
+
+
+class NpzShardWriter(DatasetWriter):
+    """
+    Writes fixed size shard-<n>.npz files holding the <images> and <labels>
+    of <shard_size> consecutive items (the last shard may be smaller).
+    """
+    def __init__(self, output_dir, n_images, image_shape, n_digits,
+                 shard_size=10000):
+        super().__init__(output_dir, n_images, image_shape, n_digits)
+        self.alignment = shard_size
+        self.chunk_size = shard_size
+
+    def shard_path(self, shard_ix):
+        return os.path.join(
+            self.output_dir, 'shard-{shard_ix:05d}.npz'.format(
+                shard_ix=shard_ix
+            )
+        )
+
+    def write(self, start, images, labels):
+        if start % self.alignment or len(images) > self.chunk_size:
+            raise Exception(
+                'Error: npz shard writes must cover one whole shard, got '
+                '{n} images at {start}.'.format(n=len(images), start=start)
+            )
+        path = self.shard_path(start // self.alignment)
+        # shards appear whole: an interrupted write leaves no partial shard
+        with open(path + '.tmp', 'wb') as shard_file:
+            np.savez(
+                shard_file, images=images, labels=labels.astype(np.uint8)
+            )
+        os.replace(path + '.tmp', path)
+
+
+def get_writer(output_format, output_dir, n_images, image_shape, n_digits,
+               shard_size=10000):
+    """
+    Returns the dataset writer for <output_format>, one of OUTPUT_FORMATS.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise Exception(
+            'Error: Invalid <output_format>; must be one of the following: '
+            '{formats}'.format(formats=list(OUTPUT_FORMATS))
+        )
+    if output_format == 'npz':
+        return NpzShardWriter(
+            output_dir, n_images, image_shape, n_digits, shard_size
+        )
+    writer_class = {
+        'png': PngWriter, 'npy': NpyWriter, 'idx': IdxWriter
+    }[output_format]
+
+    return writer_class(output_dir, n_images, image_shape, n_digits)
@@ -0,0 +1,357 @@
+"""
+Benchmarks
+
+This module times the sequence generators on synthetic idx datasets and
+writes the results as JSON, so runs can be compared across versions:
+
+    python -m benchmarks.run_benchmarks -n 60000 -o results.json
+
+Benchmark groups are:
+
+- 'load': generator construction, plain and gzip inputs, with each option
+  that precomputes data on load.
+- 'select': drawing digit image indexes for a batch of sequences.
+- 'spacing': each spacing method, 'auto' included, across sequence lengths
+  and spacing ranges.
+- 'generation': single image calls versus one batch call.
+- 'cli': the command line entry point for each output format.
+
+Every result holds its group, name and parameters, and the min, median and
+mean wall time in seconds of one call over <repeat> timed calls.
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import numpy as np
+
+from augmentation.sequence_generators import NumberSequenceGenerator, main
+from augmentation.writers import OUTPUT_FORMATS
+from benchmarks.synthetic_idx import write_synthetic_idx
+
+
+BENCHMARK_GROUPS = ('load', 'select', 'spacing', 'generation', 'cli')
+
+SPACING_METHODS = ('equidistant', 'random_selection', 'dirichlet', 'auto')
+
+
+def time_call(function, repeat=5, number=1):
+    """
+    Times <repeat> rounds of <number> calls to <function>, after one warm up
+    call. Returns the min, median and mean seconds per call.
+    """
+    function()
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(number):
+            function()
+        timings.append((time.perf_counter() - start) / number)
+
+    return {
+        'repeat': repeat,
+        'number': number,
+        'min': min(timings),
+        'median': float(np.median(timings)),
+        'mean': float(np.mean(timings)),
+    }
+
+
+def _result(group, name, params, timing):
+    return dict({'group': group, 'name': name, 'params': params}, **timing)
+
+
+def _image_width(n_digits, spacing_range, digit_width=28):
+    """
+    Returns an image width every spacing method can fill: digits plus the
+    middle of <spacing_range> for each space.
+    """
+    middle_space = (spacing_range[0] + spacing_range[1]) // 2
+
+    return n_digits * digit_width + (n_digits - 1) * middle_space
+
+
+def benchmark_load(filespecs, config):
+    """
+    Times generator construction for each input and load option.
+    """
+    for (input_name, filespec) in filespecs.items():
+        for (name, options) in (
+            ('default', {}),
+            ('float32_atlas', {'float32_atlas': True}),
+            ('crop_glyphs', {'crop_glyphs': True}),
+        ):
+            yield _result(
+                'load', name, {'input': input_name},
+                time_call(
+                    lambda: NumberSequenceGenerator(filespec, **options),
+                    config['repeat']
+                )
+            )
+
+
+def benchmark_select(filespecs, config):
+    """
+    Times drawing one image index per digit of a batch of sequences.
+    """
+    sg = NumberSequenceGenerator(filespecs['idx'])
+    for n_digits in config['n_digits']:
+        digit_sequences = np.random.RandomState(0).randint(
+            0, 10, (config['n_sequences'], n_digits)
+        )
+        yield _result(
+            'select', 'sample_digit_indexes',
+            {'n_sequences': config['n_sequences'], 'n_digits': n_digits},
+            time_call(
+                lambda: sg._sample_digit_indexes(digit_sequences),
+                config['repeat']
+            )
+        )
+
+
+def benchmark_spacing(filespecs, config):
+    """
+    Times sampling a batch of spacings for each method, sequence length
+    and spacing range.
+    """
+    for method in SPACING_METHODS:
+        sg = NumberSequenceGenerator(filespecs['idx'], method)
+        for n_digits in config['n_digits']:
+            for spacing_range in config['spacing_ranges']:
+                free_space = (
+                    _image_width(n_digits, spacing_range) - n_digits * 28
+                )
+                yield _result(
+                    'spacing', method,
+                    {
+                        'n_sequences': config['n_sequences'],
+                        'n_digits': n_digits,
+                        'spacing_range': list(spacing_range),
+                    },
+                    time_call(
+                        lambda: sg._sample_spacing(
+                            n_digits, free_space, spacing_range,
+                            config['n_sequences']
+                        ),
+                        config['repeat']
+                    )
+                )
+
+
+def benchmark_generation(filespecs, config):
+    """
+    Times generating a batch of 5 digit sequences one image at a time and
+    in one batch call, with and without <out>, for each spacing method.
+    """
+    n_sequences = config['n_sequences']
+    (n_digits, spacing_range) = (5, config['spacing_ranges'][0])
+    image_width = _image_width(n_digits, spacing_range)
+    digit_sequences = np.random.RandomState(0).randint(
+        0, 10, (n_sequences, n_digits)
+    )
+    params = {
+        'n_sequences': n_sequences, 'n_digits': n_digits,
+        'spacing_range': list(spacing_range), 'image_width': image_width,
+    }
+    for method in SPACING_METHODS:
+        sg = NumberSequenceGenerator(filespecs['idx'], method)
+        out = np.empty((28, image_width), dtype=np.float32)
+        batch_out = np.empty(
+            (n_sequences, 28, image_width), dtype=np.float32
+        )
+        for (name, function) in (
+            ('single', lambda: [
+                sg.generate_numbers_sequence(
+                    digits, spacing_range, image_width
+                )
+                for digits in digit_sequences.tolist()
+            ]),
+            ('single_out', lambda: [
+                sg.generate_numbers_sequence(
+                    digits, spacing_range, image_width, out=out
+                )
+                for digits in digit_sequences.tolist()
+            ]),
+            ('batch', lambda: sg.generate_numbers_sequence_batch(
+                digit_sequences, spacing_range, image_width
+            )),
+            ('batch_out', lambda: sg.generate_numbers_sequence_batch(
+                digit_sequences, spacing_range, image_width, out=batch_out
+            )),
+        ):
+            yield _result(
+                'generation', name, dict(params, method=method),
+                time_call(function, config['repeat'])
+            )
+
+
+def benchmark_cli(filespecs, config):
+    """
+    Times the command line entry point writing each output format.
+    """
+    (n_digits, spacing_range) = (5, config['spacing_ranges'][0])
+    output_dir = tempfile.mkdtemp()
+    try:
+        for output_format in OUTPUT_FORMATS:
+            argv = [
+                ','.join(str(x % 10) for x in range(n_digits)),
+                str(spacing_range[0]), str(spacing_range[1]),
+                str(_image_width(n_digits, spacing_range)),
+                '-m', 'dirichlet', '-n', str(config['n_cli_images']),
+                '-f', output_format, '-o', output_dir, '--seed', '0',
+                '--images', filespecs['idx']['images'],
+                '--labels', filespecs['idx']['labels'],
+            ]
+
+            def run_cli():
+                shutil.rmtree(output_dir)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    main(argv)
+
+            yield _result(
+                'cli', output_format,
+                {'n_images': config['n_cli_images'], 'n_digits': n_digits},
+                time_call(run_cli, config['repeat'])
+            )
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+BENCHMARKS = {
+    'load': benchmark_load,
+    'select': benchmark_select,
+    'spacing': benchmark_spacing,
+    'generation': benchmark_generation,
+    'cli': benchmark_cli,
+}
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(n_images=10000, n_sequences=1000, n_cli_images=1000,
+                   n_digits=(2, 5, 10), spacing_ranges=((2, 10), (5, 50)),
+                   repeat=5, groups=BENCHMARK_GROUPS):
+    """
+    Runs the benchmark <groups> on a synthetic dataset of <n_images>,
+    written to a temporary directory. Returns the results as a JSON
+    serializable dict of run metadata and a list of timings.
+    """
+    config = {
+        'n_images': n_images,
+        'n_sequences': n_sequences,
+        'n_cli_images': n_cli_images,
+        'n_digits': list(n_digits),
+        'spacing_ranges': [tuple(x) for x in spacing_ranges],
+        'repeat': repeat,
+        'groups': list(groups),
+    }
+    data_dir = tempfile.mkdtemp()
+    try:
+        filespecs = {
+            'idx': write_synthetic_idx(
+                os.path.join(data_dir, 'idx'), n_images
+            ),
+            'gzip': write_synthetic_idx(
+                os.path.join(data_dir, 'gzip'), n_images, compress=True
+            ),
+        }
+        results = [
+            result
+            for group in groups
+            for result in BENCHMARKS[group](filespecs, config)
+        ]
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        'metadata': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'config': dict(config, spacing_ranges=[
+                list(x) for x in config['spacing_ranges']
+            ]),
+        },
+        'results': results,
+    }
+
+
+def _int_list(value):
+    return [int(x) for x in value.split(',')]
+
+
+def _spacing_ranges(value):
+    return [tuple(_int_list(x)) for x in value.split(';')]
+
+
+def cli(argv=None):
+    """
+    Command line entry point: runs the benchmarks and writes the JSON
+    results to <output> (stdout by default).
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '-n', '--n-images', type=int, default=10000,
+        help='number of synthetic dataset images. -int'
+    )
+    parser.add_argument(
+        '--n-sequences', type=int, default=1000,
+        help='number of sequences per spacing and generation call. -int'
+    )
+    parser.add_argument(
+        '--n-cli-images', type=int, default=1000,
+        help='number of images written per command line run. -int'
+    )
+    parser.add_argument(
+        '--n-digits', type=_int_list, default=[2, 5, 10],
+        help='sequence lengths. eg: 2,5,10'
+    )
+    parser.add_argument(
+        '--spacing-ranges', type=_spacing_ranges, default=[(2, 10), (5, 50)],
+        help='spacing ranges. eg: "2,10;5,50"'
+    )
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help='number of timed calls per benchmark. -int'
+    )
+    parser.add_argument(
+        '-g', '--groups', type=str, nargs='+', default=list(BENCHMARK_GROUPS),
+        choices=BENCHMARK_GROUPS, help='benchmark groups to run'
+    )
+    parser.add_argument(
+        '-o', '--output', type=str, default=None,
+        help='JSON results file. Default is stdout'
+    )
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error('number of repeats must be a positive integer')
+    results = run_benchmarks(
+        args.n_images, args.n_sequences, args.n_cli_images, args.n_digits,
+        args.spacing_ranges, args.repeat, args.groups
+    )
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+
+
+if __name__ == '__main__':
+    cli()
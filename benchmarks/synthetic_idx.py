@@ -0,0 +1,70 @@
+"""
+Synthetic IDX
+
+This module writes synthetic digit datasets in the idx fileformat, so
+benchmarks can run at any dataset size without downloading MNIST. Images are
+MNIST shaped uint8 arrays holding one noisy ink blob of random size on a blank
+margin, so glyph cropping and spacing behave as on real digits.
+"""
+import os
+import gzip
+import shutil
+import numpy as np
+
+from augmentation.idx import create_idx
+
+
+def write_synthetic_idx(output_dir, n_images, image_shape=(28, 28), seed=0,
+                        compress=False, chunk_size=10000):
+    """
+    Writes <n_images> random images of <image_shape> and their random labels
+    as 'images.idx3-ubyte' and 'labels.idx1-ubyte' in <output_dir>, gzip
+    compressed ('.gz') with <compress>. Images are written in chunks of
+    <chunk_size> into memory-mapped files. Returns the input filespec dict
+    expected by NumberSequenceGenerator.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    random_state = np.random.RandomState(seed)
+    (height, width) = image_shape
+    filespec = {
+        'images': os.path.join(output_dir, 'images.idx3-ubyte'),
+        'labels': os.path.join(output_dir, 'labels.idx1-ubyte')
+    }
+    images = create_idx(
+        filespec['images'], np.uint8, (n_images,) + tuple(image_shape)
+    )
+    labels = create_idx(filespec['labels'], np.uint8, (n_images,))
+    (rows, columns) = (np.arange(height), np.arange(width))
+    for start in range(0, n_images, chunk_size):
+        n_chunk = min(chunk_size, n_images - start)
+        # ink boxes of 1/2 to 5/7 of the height, 1/7 to 5/7 of the width
+        box_heights = random_state.randint(
+            height // 2, height * 5 // 7 + 1, (n_chunk, 1)
+        )
+        box_widths = random_state.randint(
+            width // 7, width * 5 // 7 + 1, (n_chunk, 1)
+        )
+        tops = (height - box_heights) // 2
+        lefts = (width - box_widths) // 2
+        ink = (
+            ((rows >= tops) & (rows < tops + box_heights))[:, :, np.newaxis]
+            & ((columns >= lefts) & (columns < lefts + box_widths))[
+                :, np.newaxis, :
+            ]
+        )
+        pixels = random_state.randint(1, 256, ink.shape).astype(np.uint8)
+        images[start:start + n_chunk] = np.where(ink, pixels, 0)
+        labels[start:start + n_chunk] = random_state.randint(0, 10, n_chunk)
+    images.base.flush()
+    labels.base.flush()
+    del images, labels
+
+    if compress:
+        for (key, path) in filespec.items():
+            with open(path, 'rb') as source:
+                with gzip.open(path + '.gz', 'wb') as target:
+                    shutil.copyfileobj(source, target)
+            os.remove(path)
+            filespec[key] = path + '.gz'
+
+    return filespec
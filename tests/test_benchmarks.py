@@ -0,0 +1,70 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from augmentation.sequence_generators import NumberSequenceGenerator
+from benchmarks.run_benchmarks import BENCHMARK_GROUPS, cli
+from benchmarks.synthetic_idx import write_synthetic_idx
+
+
+class TestBenchmarks(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_synthetic_idx(self):
+        for compress in (False, True):
+            filespec = write_synthetic_idx(
+                self.tmp_dir, 50, compress=compress
+            )
+            nsg = NumberSequenceGenerator(filespec, crop_glyphs=True)
+            self.assertEqual(50, nsg.n_imgs)
+            self.assertTrue((nsg._labels < 10).all())
+            # every image holds one ink box on a blank margin
+            self.assertTrue((nsg._glyph_widths < 28).all())
+            self.assertTrue(
+                (nsg._glyph_extents[:, 1] - nsg._glyph_extents[:, 0] < 28)
+                .all()
+            )
+
+    def test_synthetic_idx_seeded(self):
+        images = [
+            NumberSequenceGenerator(write_synthetic_idx(
+                os.path.join(self.tmp_dir, name), 20, seed=3
+            ))._images
+            for name in ('a', 'b')
+        ]
+        np.testing.assert_array_equal(images[0], images[1])
+
+    def test_json_results(self):
+        output = os.path.join(self.tmp_dir, 'results.json')
+        cli([
+            '-n', '100', '--n-sequences', '4', '--n-cli-images', '3',
+            '--n-digits', '2,3', '--spacing-ranges', '2,10', '-r', '1',
+            '-o', output
+        ])
+        with open(output) as results_file:
+            results = json.load(results_file)
+        self.assertEqual(100, results['metadata']['config']['n_images'])
+        self.assertSetEqual(
+            set(BENCHMARK_GROUPS),
+            set(result['group'] for result in results['results'])
+        )
+        for group in ('spacing', 'generation'):
+            self.assertIn('auto', set(
+                result['params']['method'] if group == 'generation'
+                else result['name']
+                for result in results['results'] if result['group'] == group
+            ))
+        for result in results['results']:
+            self.assertLessEqual(result['min'], result['median'])
+            self.assertEqual(1, result['repeat'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from augmentation.builds import (
+    MANIFEST_FILENAME, BuildManifest, file_sha256
+)
+
+
+class TestBuildManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.config = {'digits': [1, 2], 'spacing_range': (1, 4), 'seed': None}
+        self.shard_path = os.path.join(self.tmp_dir, 'shard-00000.npz')
+        with open(self.shard_path, 'wb') as shard_file:
+            shard_file.write(b'shard')
+        self.record = {
+            'n_images': 1, 'size': 5, 'sha256': file_sha256(self.shard_path)
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_file_sha256(self):
+        self.assertEqual(
+            hashlib.sha256(b'shard').hexdigest(), file_sha256(self.shard_path)
+        )
+
+    def test_resume(self):
+        manifest = BuildManifest.open(self.tmp_dir, self.config)
+        # a fresh seed is drawn and recorded for new builds
+        self.assertIsInstance(manifest.config['seed'], int)
+        manifest.complete(0, self.record)
+        resumed = BuildManifest.open(self.tmp_dir, self.config)
+        self.assertEqual(manifest.config['seed'], resumed.config['seed'])
+        self.assertSetEqual(
+            {0}, resumed.completed_shards([self.shard_path], verify=True)
+        )
+        # manifests are written through a temporary file, then renamed
+        self.assertListEqual(
+            [MANIFEST_FILENAME, 'shard-00000.npz'],
+            sorted(os.listdir(self.tmp_dir))
+        )
+
+    def test_completed_shards_changed(self):
+        manifest = BuildManifest.open(self.tmp_dir, self.config)
+        manifest.complete(0, self.record)
+        with open(self.shard_path, 'wb') as shard_file:
+            shard_file.write(b'SHARD')
+        self.assertSetEqual({0}, manifest.completed_shards([self.shard_path]))
+        self.assertSetEqual(
+            set(), manifest.completed_shards([self.shard_path], verify=True)
+        )
+        self.assertDictEqual({}, manifest.shards)
+
+    def test_different_build(self):
+        BuildManifest.open(self.tmp_dir, dict(self.config, seed=1))
+        BuildManifest.open(self.tmp_dir, dict(self.config, seed=1))
+        with self.assertRaisesRegex(Exception, r"\['seed'\] differ"):
+            BuildManifest.open(self.tmp_dir, dict(self.config, seed=2))
+        with self.assertRaisesRegex(Exception, "'digits'"):
+            BuildManifest.open(self.tmp_dir, dict(self.config, digits=[3]))
+
+    def test_unsupported_version(self):
+        with open(os.path.join(self.tmp_dir, MANIFEST_FILENAME), 'w') as f:
+            json.dump({'version': 0, 'config': {}, 'shards': {}}, f)
+        with self.assertRaisesRegex(Exception, "version"):
+            BuildManifest.open(self.tmp_dir, self.config)
+
+
+if __name__ == '__main__':
+    unittest.main()
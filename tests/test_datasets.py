@@ -0,0 +1,109 @@
+import pickle
+import unittest
+import numpy as np
+
+from augmentation.datasets import SequenceDataset
+from augmentation.sequence_generators import NumberSequenceGenerator
+
+
+class TestSequenceDataset(unittest.TestCase):
+    def setUp(self):
+        self.MNIST_filepath = {
+            'images': 'tests/test_data/test-images.idx3-ubyte_A',
+            'labels': 'tests/test_data/test-labels.idx3-ubyte_A'
+        }
+        self.spacing_range = (1, 4)
+        self.image_width = 118
+        self.nsg = NumberSequenceGenerator(self.MNIST_filepath, 'dirichlet')
+        self.dataset = SequenceDataset(
+            self.nsg, 1000, 4, self.spacing_range, self.image_width, seed=7
+        )
+
+    def test_len(self):
+        self.assertEqual(1000, len(self.dataset))
+
+    def test_item_shape(self):
+        (image, labels) = self.dataset[3]
+        self.assertTupleEqual((28, self.image_width), image.shape)
+        self.assertEqual(np.float32, image.dtype)
+        self.assertTupleEqual((4,), labels.shape)
+
+    def test_item_deterministic(self):
+        np.random.seed(0)
+        (expected_image, expected_labels) = self.dataset[42]
+        for i in range(5):  # unrelated draws must not change item 42
+            self.dataset[i]
+            np.random.rand()
+        other_dataset = SequenceDataset(
+            NumberSequenceGenerator(self.MNIST_filepath, 'dirichlet'),
+            1000, 4, self.spacing_range, self.image_width, seed=7
+        )
+        (image, labels) = other_dataset[42]
+        np.testing.assert_array_equal(expected_image, image)
+        np.testing.assert_array_equal(expected_labels, labels)
+
+    def test_pickle(self):
+        # e.g. sent to spawned data loader workers
+        unpickled = pickle.loads(pickle.dumps(self.dataset))
+        np.testing.assert_array_equal(self.dataset[9][0], unpickled[9][0])
+
+    def test_items_differ(self):
+        self.assertFalse(
+            np.array_equal(self.dataset[0][0], self.dataset[1][0])
+        )
+        other_seed = SequenceDataset(
+            self.nsg, 1000, 4, self.spacing_range, self.image_width, seed=8
+        )
+        self.assertFalse(
+            np.array_equal(self.dataset[0][0], other_seed[0][0])
+        )
+
+    def test_random_selection_deterministic(self):
+        dataset = SequenceDataset(
+            NumberSequenceGenerator(self.MNIST_filepath, 'random_selection'),
+            10, 4, self.spacing_range, self.image_width
+        )
+        np.testing.assert_array_equal(dataset[5][0], dataset[5][0])
+
+    def test_cropped_glyphs(self):
+        dataset = SequenceDataset(
+            NumberSequenceGenerator(self.MNIST_filepath, crop_glyphs=True),
+            10, 4, (2, 8), 70
+        )
+        (image, labels) = dataset[2]
+        self.assertTupleEqual((28, 70), image.shape)
+        np.testing.assert_array_equal(image, dataset[2][0])
+
+    def test_epoch_sampling(self):
+        with self.assertRaisesRegex(Exception, "'epoch'"):
+            SequenceDataset(
+                NumberSequenceGenerator(
+                    self.MNIST_filepath, digit_sampling='epoch'
+                ),
+                10, 4, (1, 4), 118
+            )
+
+    def test_negative_index(self):
+        np.testing.assert_array_equal(
+            self.dataset[999][0], self.dataset[-1][0]
+        )
+
+    def test_index_out_of_range(self):
+        with self.assertRaises(IndexError):
+            self.dataset[1000]
+
+    def test_iteration(self):
+        dataset = SequenceDataset(
+            self.nsg, 3, 4, self.spacing_range, self.image_width
+        )
+        self.assertEqual(3, len(list(dataset)))
+
+    def test_wrong_n_samples(self):
+        with self.assertRaisesRegex(Exception, "<n_samples>"):
+            SequenceDataset(
+                self.nsg, -1, 4, self.spacing_range, self.image_width
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from augmentation.idx import idx_cache_path, read_idx
+
+
+class TestReadIdx(unittest.TestCase):
+    def setUp(self):
+        self.images_filepath = 'tests/test_data/test-images.idx3-ubyte_A'
+        self.labels_filepath = 'tests/test_data/test-labels.idx3-ubyte_A'
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_file(self, name, content):
+        filepath = os.path.join(self.tmp_dir, name)
+        with open(filepath, 'wb') as file:
+            file.write(content)
+        return filepath
+
+    def test_images_shape_and_dtype(self):
+        images = read_idx(self.images_filepath)
+        self.assertTupleEqual((100, 28, 28), images.shape)
+        self.assertEqual(np.uint8, images.dtype)
+
+    def test_labels_shape_and_dtype(self):
+        labels = read_idx(self.labels_filepath)
+        self.assertTupleEqual((100,), labels.shape)
+        self.assertEqual(np.uint8, labels.dtype)
+        np.testing.assert_array_equal([7, 2, 1, 0, 4], labels[:5])
+
+    def _gzip_images(self):
+        filepath = os.path.join(self.tmp_dir, 'images.idx3-ubyte.gz')
+        with open(self.images_filepath, 'rb') as source:
+            with gzip.open(filepath, 'wb') as target:
+                shutil.copyfileobj(source, target)
+        return filepath
+
+    def test_gzip(self):
+        expected = read_idx(self.images_filepath)
+        actual = read_idx(self._gzip_images())
+        np.testing.assert_array_equal(expected, actual)
+        self.assertFalse(actual.flags.writeable)
+
+    def test_gzip_truncated(self):
+        filepath = os.path.join(self.tmp_dir, 'short.idx.gz')
+        with gzip.open(filepath, 'wb') as file:
+            file.write(b'\x00\x00\x08\x01\x00\x00\x00\x0a' + b'\x01' * 5)
+        with self.assertRaisesRegex(Exception, "Truncated idx file"):
+            read_idx(filepath)
+
+    def test_gzip_cache(self):
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        filepath = self._gzip_images()
+        expected = read_idx(self.images_filepath)
+        np.testing.assert_array_equal(
+            expected, read_idx(filepath, cache_dir=cache_dir)
+        )
+        cache_path = idx_cache_path(filepath, cache_dir)
+        self.assertListEqual(
+            [os.path.basename(cache_path)], os.listdir(cache_dir)
+        )
+        cached = read_idx(filepath, cache_dir=cache_dir)
+        self.assertIsInstance(cached.base, np.memmap)
+        np.testing.assert_array_equal(expected, cached)
+
+    def test_gzip_cache_key_changes_with_source(self):
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        filepath = self._gzip_images()
+        cache_path = idx_cache_path(filepath, cache_dir)
+        stat = os.stat(filepath)
+        os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertNotEqual(cache_path, idx_cache_path(filepath, cache_dir))
+
+    def test_gzip_not_writable(self):
+        with self.assertRaisesRegex(Exception, "only be opened read-only"):
+            read_idx(self._gzip_images(), mode='r+')
+
+    def test_read_only(self):
+        images = read_idx(self.images_filepath)
+        with self.assertRaises(ValueError):
+            images[0, 0, 0] = 1
+
+    def test_pixels_match_file_bytes(self):
+        with open(self.images_filepath, 'rb') as file:
+            raw = file.read()
+        expected = np.frombuffer(raw[16:], dtype=np.uint8)
+        np.testing.assert_array_equal(expected, read_idx(
+            self.images_filepath
+        ).ravel())
+
+    def test_multi_byte_dtype(self):
+        values = np.array([[1, -2], [300, 4]], dtype='>i2')
+        filepath = self._write_file(
+            'short.idx',
+            b'\x00\x00\x0b\x02' + b'\x00\x00\x00\x02' * 2 + values.tobytes()
+        )
+        np.testing.assert_array_equal(values, read_idx(filepath))
+
+    def test_bad_magic_number(self):
+        filepath = self._write_file('bad.idx', b'\x01\x00\x08\x01')
+        with self.assertRaisesRegex(Exception, "Bad magic number"):
+            read_idx(filepath)
+
+    def test_unsupported_dtype(self):
+        filepath = self._write_file('bad.idx', b'\x00\x00\x07\x01')
+        with self.assertRaisesRegex(Exception, "Unsupported idx data type"):
+            read_idx(filepath)
+
+    def test_truncated_data(self):
+        filepath = self._write_file(
+            'short.idx', b'\x00\x00\x08\x01\x00\x00\x00\x0a' + b'\x01' * 5
+        )
+        with self.assertRaisesRegex(Exception, "Truncated idx file"):
+            read_idx(filepath)
+
+
+if __name__ == '__main__':
+    unittest.main()
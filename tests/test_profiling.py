@@ -0,0 +1,83 @@
+import pickle
+import unittest
+import threading
+
+from augmentation.profiling import (
+    NullProfiler, StageProfiler, format_stats, merge_stats
+)
+
+
+class TestStageProfiler(unittest.TestCase):
+    def test_stage(self):
+        profiler = StageProfiler()
+        for i in range(3):
+            with profiler.stage('spacing'):
+                pass
+        profiler.count('images', 2)
+        profiler.count('images')
+        stats = profiler.stats()
+        self.assertEqual(3, stats['stages']['spacing']['calls'])
+        self.assertGreaterEqual(stats['stages']['spacing']['seconds'], 0)
+        self.assertDictEqual({'images': 3}, stats['counters'])
+
+    def test_stage_records_on_error(self):
+        profiler = StageProfiler()
+        with self.assertRaises(ValueError):
+            with profiler.stage('select'):
+                raise ValueError
+        self.assertEqual(1, profiler.stats()['stages']['select']['calls'])
+
+    def test_callback(self):
+        calls = []
+        profiler = StageProfiler(lambda *args: calls.append(args))
+        profiler.add_time('write', 0.5)
+        self.assertListEqual([('write', 0.5)], calls)
+
+    def test_threaded_counts(self):
+        profiler = StageProfiler()
+
+        def record():
+            for i in range(10000):
+                profiler.count('images')
+                profiler.add_time('assembly', 0)
+
+        threads = [threading.Thread(target=record) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = pickle.loads(pickle.dumps(profiler)).stats()
+        self.assertEqual(40000, stats['counters']['images'])
+        self.assertEqual(40000, stats['stages']['assembly']['calls'])
+
+    def test_null_profiler(self):
+        profiler = NullProfiler()
+        with profiler.stage('select'):
+            profiler.count('images')
+        self.assertDictEqual(
+            {'stages': {}, 'counters': {}}, profiler.stats()
+        )
+
+    def test_merge_and_format(self):
+        profilers = [StageProfiler(), StageProfiler()]
+        for (i, profiler) in enumerate(profilers):
+            profiler.add_time('assembly', 1.0 + i)
+            profiler.count('images', 10)
+        merged = merge_stats([x.stats() for x in profilers])
+        self.assertDictEqual(
+            {
+                'stages': {'assembly': {'calls': 2, 'seconds': 3.0}},
+                'counters': {'images': 20},
+            },
+            merged
+        )
+        lines = format_stats(merged).split('\n')
+        self.assertListEqual(
+            ['assembly', '2', '3.0000', '100.0', '1500.0000'],
+            lines[1].split()
+        )
+        self.assertListEqual(['images', '20'], lines[2].split())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,24 @@
+import io
+import os
+import math
+import gzip
+import time
 import pickle
+import shutil
+import tempfile
 import unittest
+import threading
+import contextlib
+import unittest.mock
+import tracemalloc
 import numpy as np
+from scipy.special import comb
 from scipy.stats import chisquare
 
-from augmentation.sequence_generators import NumberSequenceGenerator
+from augmentation.idx import create_idx
+from augmentation.sequence_generators import (
+    NumberSequenceGenerator, _binomial, _shard_ranges, _shard_sizes, main
+)
 
 
 class TestNumberSequenceGeneration(unittest.TestCase):
@@ -43,6 +58,28 @@ class TestNumberSequenceGeneration(unittest.TestCase):
         actual = self.nsg_eq._load_idx_data(self.MNIST_filepath)[2:5]
         self.assertTupleEqual(expected, actual)
 
+    def test_load_idx_data_gzip(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filespec = {}
+            for (key, filepath) in self.MNIST_filepath.items():
+                filespec[key] = os.path.join(
+                    tmp_dir, os.path.basename(filepath) + '.gz'
+                )
+                with open(filepath, 'rb') as source:
+                    with gzip.open(filespec[key], 'wb') as target:
+                        shutil.copyfileobj(source, target)
+            nsg = NumberSequenceGenerator(
+                filespec, 'equidistant',
+                cache_dir=os.path.join(tmp_dir, 'cache')
+            )
+            np.testing.assert_array_equal(self.nsg_eq._images, nsg._images)
+            np.testing.assert_array_equal(self.nsg_eq._labels, nsg._labels)
+            cache_files = os.listdir(os.path.join(tmp_dir, 'cache'))
+            self.assertEqual(2, len(cache_files))
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_load_idx_data_wrong_input(self):
         bad_filename = 245
         with self.assertRaisesRegex(Exception, "filename input"):
@@ -56,6 +93,20 @@ class TestNumberSequenceGeneration(unittest.TestCase):
         with self.assertRaisesRegex(Exception, "n_labels: 20"):
             self.nsg_eq._load_idx_data(bad_filename)
 
+    def test_load_idx_data_labels_dimensions(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            # e.g. the labels of the CLI idx output: one sequence per row
+            labels_path = os.path.join(tmp_dir, 'labels.idx2-ubyte')
+            create_idx(labels_path, np.uint8, (100, 3))
+            with self.assertRaisesRegex(Exception, "1 dimensional labels"):
+                self.nsg_eq._load_idx_data({
+                    'images': self.MNIST_filepath['images'],
+                    'labels': labels_path
+                })
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_digits_empty_list(self):
         with self.assertRaisesRegex(Exception, "Expected a number sequence"):
             self.nsg_eq._select_image_representations([])
@@ -76,6 +127,78 @@ class TestNumberSequenceGeneration(unittest.TestCase):
         )
         np.testing.assert_array_equal(expected, actual)
 
+    def test_label_index(self):
+        labels = self.nsg_eq._labels
+        for digit in range(10):
+            expected = np.where(labels == digit)[0]
+            actual = self.nsg_eq._label_ixs[
+                self.nsg_eq._label_offsets[digit]:
+                self.nsg_eq._label_offsets[digit + 1]
+            ]
+            np.testing.assert_array_equal(expected, actual)
+
+    def test_epoch_sampling_covers_every_image(self):
+        nsg = NumberSequenceGenerator(
+            self.MNIST_filepath, digit_sampling='epoch', profile=True
+        )
+        label_counts = np.diff(nsg._label_offsets)[:10]
+        random_state = np.random.RandomState(self.seed)
+        digits = np.repeat(np.arange(10), 2 * label_counts)
+        random_state.shuffle(digits)
+        image_ixs = np.concatenate([
+            nsg._sample_digit_indexes(chunk, random_state)
+            for chunk in np.array_split(digits, 7)
+        ])
+        np.testing.assert_array_equal(digits, nsg._labels[image_ixs])
+        # two epochs per digit: every image drawn exactly twice
+        np.testing.assert_array_equal(
+            2, np.bincount(image_ixs, minlength=nsg.n_imgs)
+        )
+        self.assertEqual(20, nsg.stats()['counters']['epochs'])
+
+    def test_epoch_sampling_reproducible(self):
+        image_ixs = [
+            NumberSequenceGenerator(
+                self.MNIST_filepath, digit_sampling='epoch'
+            )._sample_digit_indexes(
+                [[3, 7, 8, 6]] * 30, np.random.RandomState(self.seed)
+            )
+            for i in range(2)
+        ]
+        np.testing.assert_array_equal(image_ixs[0], image_ixs[1])
+        self.assertTupleEqual((30, 4), image_ixs[0].shape)
+
+    def test_epoch_sampling_pickle(self):
+        nsg = NumberSequenceGenerator(
+            self.MNIST_filepath, digit_sampling='epoch'
+        )
+        nsg._sample_digit_indexes([[3, 7]] * 5, np.random.RandomState(0))
+        unpickled = pickle.loads(pickle.dumps(nsg))
+        # epochs carry on from where the pickled generator stood
+        np.testing.assert_array_equal(
+            nsg._sample_digit_indexes([[3, 7]] * 9, np.random.RandomState(1)),
+            unpickled._sample_digit_indexes(
+                [[3, 7]] * 9, np.random.RandomState(1)
+            )
+        )
+
+    def test_invalid_digit_sampling(self):
+        with self.assertRaisesRegex(Exception, "<digit_sampling>"):
+            NumberSequenceGenerator(
+                self.MNIST_filepath, digit_sampling='sequential'
+            )
+        with self.assertRaisesRegex(Exception, "<crop_glyphs>"):
+            NumberSequenceGenerator(
+                self.MNIST_filepath, crop_glyphs=True, digit_sampling='epoch'
+            )
+
+    def test_digits_not_in_labels(self):
+        nsg = NumberSequenceGenerator(self.MNIST_filepath, 'equidistant')
+        nsg._labels = np.where(nsg._labels == 5, 6, nsg._labels)
+        (nsg._label_offsets, nsg._label_ixs) = nsg._index_labels(nsg._labels)
+        with self.assertRaisesRegex(Exception, r"Digits \[5\] are not"):
+            nsg._select_image_representations([1, 5, 5])
+
     def test_width_not_number(self):
         wrong_input = (34, 506)
         n_digits = len(self.number_sequence)
@@ -148,6 +271,166 @@ class TestNumberSequenceGeneration(unittest.TestCase):
         for i in range(len(expected)):
             np.testing.assert_array_equal(expected[i], actual[i])
 
+    def test_count_compositions(self):
+        n_spaces, free_space, spacing_range = 4, 10, (1, 5)
+        expected = len(list(self.nsg_rs._permutations_w_constraints(
+            n_spaces, free_space, spacing_range[0], spacing_range[1]
+        )))
+        actual = self.nsg_rs._count_compositions(
+            n_spaces, free_space, spacing_range[0], spacing_range[1]
+        )[-1, -1]
+        self.assertEqual(expected, actual)
+
+    def test_unrank_compositions_matches_enumeration(self):
+        n_spaces, free_space, spacing_range = 4, 10, (1, 5)
+        expected = np.array(list(self.nsg_rs._permutations_w_constraints(
+            n_spaces, free_space, spacing_range[0], spacing_range[1]
+        )))
+        composition_counts = self.nsg_rs._count_compositions(
+            n_spaces, free_space, spacing_range[0], spacing_range[1]
+        )
+        actual = self.nsg_rs._unrank_compositions(
+            composition_counts, np.arange(len(expected)),
+            spacing_range[0], spacing_range[1]
+        )
+        np.testing.assert_array_equal(expected, actual)
+
+    def test_digit_spacing_random_selection_large(self):
+        np.random.seed(self.seed)
+        n_digits, free_space, spacing_range = 41, 800, (0, 40)
+        actual = self.nsg_rs._sample_spacing(
+            n_digits, free_space, spacing_range, 5
+        )
+        self.assertTrue((actual.sum(axis=1) == free_space).all())
+        self.assertTrue(
+            ((actual >= spacing_range[0]) & (actual <= spacing_range[1])).all()
+        )
+
+    def test_digit_spacing_random_selection_infeasible(self):
+        with self.assertRaisesRegex(Exception, "no spacing combination"):
+            self.nsg_rs._count_compositions(3, 20, 1, 4)
+
+    def test_digit_spacing_dirichlet_infeasible(self):
+        with self.assertRaisesRegex(Exception, "no spacing combination"):
+            self.nsg_dir._sample_spacing(4, 20, self.spacing_range, 1)
+        self.assertEqual(0, self.nsg_dir.dirichlet_stats()['candidates'])
+
+    def test_spacing_plan_cache(self):
+        for method in ('equidistant', 'random_selection', 'dirichlet'):
+            nsg = NumberSequenceGenerator(self.MNIST_filepath, method)
+            for i in range(3):
+                nsg._sample_spacing(4, 9, self.spacing_range, 2)
+            nsg._sample_spacing(3, 6, self.spacing_range, 2)
+            self.assertDictEqual(
+                {'hits': 2, 'misses': 2, 'size': 2, 'maxsize': 128},
+                nsg.spacing_plan_cache_info()
+            )
+        composition_counts = nsg._build_spacing_plan(
+            'random_selection', 3, 9, 1, 4
+        )
+        self.assertFalse(composition_counts.flags.writeable)
+
+    def test_spacing_plan_cache_size(self):
+        nsg = NumberSequenceGenerator(
+            self.MNIST_filepath, 'random_selection', spacing_plan_cache_size=1
+        )
+        for free_space in (9, 6, 9):
+            nsg._sample_spacing(4, free_space, self.spacing_range, 1)
+        self.assertDictEqual(
+            {'hits': 0, 'misses': 3, 'size': 1, 'maxsize': 1},
+            nsg.spacing_plan_cache_info()
+        )
+
+    def test_spacing_plan_cache_disabled(self):
+        nsg = NumberSequenceGenerator(
+            self.MNIST_filepath, 'random_selection', spacing_plan_cache_size=0
+        )
+        np.random.seed(self.seed)
+        expected = self.nsg_rs._sample_spacing(5, 20, (2, 8), 50)
+        np.random.seed(self.seed)
+        actual = nsg._sample_spacing(5, 20, (2, 8), 50)
+        np.testing.assert_array_equal(expected, actual)
+        self.assertEqual(0, nsg.spacing_plan_cache_info()['size'])
+
+    def test_pickle(self):
+        nsg = NumberSequenceGenerator(
+            self.MNIST_filepath, 'random_selection', spacing_plan_cache_size=7
+        )
+        nsg._sample_spacing(4, 9, self.spacing_range, 1)
+        unpickled = pickle.loads(pickle.dumps(nsg))
+        self.assertDictEqual(
+            {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 7},
+            unpickled.spacing_plan_cache_info()
+        )
+        np.testing.assert_array_equal(
+            nsg.generate_numbers_sequence_batch(
+                [self.number_sequence] * 2, self.spacing_range,
+                self.image_width, np.random.RandomState(self.seed)
+            ),
+            unpickled.generate_numbers_sequence_batch(
+                [self.number_sequence] * 2, self.spacing_range,
+                self.image_width, np.random.RandomState(self.seed)
+            )
+        )
+        self.assertEqual(1, unpickled.spacing_plan_cache_info()['misses'])
+
+    def test_count_bounded_compositions(self):
+        for (n_spaces, free_space, min_value, max_value) in (
+            (3, 9, 1, 4), (1, 5, 0, 9), (9, 54, 2, 10), (19, 400, 0, 40)
+        ):
+            self.assertEqual(
+                self.nsg_rs._count_compositions(
+                    n_spaces, free_space, min_value, max_value
+                )[-1, -1],
+                self.nsg_rs._count_bounded_compositions(
+                    n_spaces, free_space, min_value, max_value
+                )
+            )
+
+    def test_binomial(self):
+        for (n, k) in ((0, 0), (5, 2), (5, 7), (5, -1), (420, 19), (99, 98)):
+            self.assertEqual(comb(n, k, exact=True), _binomial(n, k))
+
+    def test_digit_spacing_auto_python37(self):
+        # math.comb only exists from python 3.8
+        with unittest.mock.patch.object(math, 'comb', None, create=True):
+            nsg = NumberSequenceGenerator(self.MNIST_filepath, 'auto')
+            nsg._sample_spacing(10, 54, (2, 10), 2)
+
+    def test_digit_spacing_auto(self):
+        nsg = NumberSequenceGenerator(self.MNIST_filepath, 'auto')
+        for (n_digits, free_space, spacing_range, expected) in (
+            (4, 12, (1, 4), 'equidistant'),  # only [4, 4, 4]
+            (10, 54, (2, 10), 'random_selection'),  # rare dirichlet accepts
+            (10, 500, (0, 200), 'dirichlet'),  # wide range: most accepted
+        ):
+            with self.assertLogs(
+                'augmentation.sequence_generators', 'INFO'
+            ) as logs:
+                actual = nsg._sample_spacing(
+                    n_digits, free_space, spacing_range, 200
+                )
+            self.assertIn('auto spacing: ' + expected, logs.output[0])
+            self.assertTrue((actual.sum(axis=1) == free_space).all())
+            self.assertTrue((
+                (actual >= spacing_range[0]) & (actual <= spacing_range[1])
+            ).all())
+
+    def test_digit_spacing_auto_avoids_dirichlet_budget(self):
+        nsg = NumberSequenceGenerator(
+            self.MNIST_filepath, 'auto', dirichlet_max_draws=5
+        )
+        self.assertEqual(
+            'random_selection', nsg._choose_spacing_method(9, 500, 0, 200)
+        )
+
+    def test_image_generation_auto(self):
+        nsg = NumberSequenceGenerator(self.MNIST_filepath, 'auto')
+        actual = nsg.generate_numbers_sequence_batch(
+            [self.number_sequence] * 3, self.spacing_range, self.image_width
+        )
+        self.assertTupleEqual((3, 28, self.image_width), actual.shape)
+
     def test_digit_spacing_equidistant_selection(self):
         n_digits = len(self.number_sequence)
         with open(
@@ -191,6 +474,301 @@ class TestNumberSequenceGeneration(unittest.TestCase):
         )
         np.testing.assert_array_equal(expected, actual)
 
+    def test_image_generation_out(self):
+        np.random.seed(self.seed)
+        expected = np.load('tests/test_data/stacked_digits_equidistant.npy')
+        out = np.full((28, self.image_width), 7, dtype=np.float32)
+        actual = self.nsg_eq.generate_numbers_sequence(
+            self.number_sequence, self.spacing_range, self.image_width,
+            out=out
+        )
+        self.assertIs(out, actual)
+        np.testing.assert_array_equal(expected, out)
+
+    def test_image_generation_wrong_out(self):
+        with self.assertRaisesRegex(Exception, "Wrong <out> input"):
+            self.nsg_eq.generate_numbers_sequence(
+                self.number_sequence, self.spacing_range, self.image_width,
+                out=np.zeros((28, self.image_width), dtype=np.float64)
+            )
+
+    def test_image_generation_float32_atlas(self):
+        nsg = NumberSequenceGenerator(
+            self.MNIST_filepath, 'random_selection', float32_atlas=True
+        )
+        np.random.seed(self.seed)
+        expected = np.load(
+            'tests/test_data/stacked_digits_random_selection.npy'
+        )
+        actual = nsg.generate_numbers_sequence(
+            self.number_sequence, self.spacing_range, self.image_width
+        )
+        np.testing.assert_array_equal(expected, actual)
+        np.random.seed(self.seed)
+        actual = nsg.generate_numbers_sequence_batch(
+            [self.number_sequence], self.spacing_range, self.image_width
+        )
+        np.testing.assert_array_equal(expected, actual[0])
+
+    def test_crop_glyphs_extents(self):
+        nsg = NumberSequenceGenerator(self.MNIST_filepath, crop_glyphs=True)
+        images = nsg._images
+        for i in range(nsg.n_imgs):
+            (top, bottom, left, right) = nsg._glyph_extents[i]
+            (rows, columns) = np.nonzero(images[i])
+            self.assertEqual((rows.min(), rows.max() + 1), (top, bottom))
+            self.assertEqual((columns.min(), columns.max() + 1), (left, right))
+            glyph = nsg._glyph_pixels[
+                nsg._glyph_offsets[i]:nsg._glyph_offsets[i + 1]
+            ]
+            np.testing.assert_array_equal(
+                images[i, top:bottom, left:right].ravel(), glyph
+            )
+        self.assertLess(nsg._glyph_pixels.nbytes, images.nbytes // 2)
+
+    def test_crop_glyphs_blank_image(self):
+        nsg = NumberSequenceGenerator(self.MNIST_filepath, crop_glyphs=True)
+        images = np.zeros((2, 28, 28), dtype=np.uint8)
+        images[1, 3:5, 7] = 9
+        (extents, offsets, pixels) = nsg._crop_glyphs(images, chunk_size=1)
+        np.testing.assert_array_equal([[0, 28, 0, 28], [3, 5, 7, 8]], extents)
+        np.testing.assert_array_equal([0, 784, 786], offsets)
+        np.testing.assert_array_equal([9, 9], pixels[784:])
+
+    def test_crop_glyphs_ink_spacing(self):
+        for method in ('equidistant', 'random_selection', 'dirichlet'):
+            nsg = NumberSequenceGenerator(
+                self.MNIST_filepath, method, crop_glyphs=True
+            )
+            digit_sequences = np.array([[3, 7, 8, 6], [0, 2, 5, 9]] * 50)
+            (glyph_ixs, glyph_offsets) = nsg._sample_glyph_layout(
+                digit_sequences, (2, 8), 70, np.random.RandomState(self.seed)
+            )
+            np.testing.assert_array_equal(
+                nsg._labels[glyph_ixs], digit_sequences
+            )
+            glyph_widths = nsg._glyph_widths[glyph_ixs]
+            gaps = np.diff(glyph_offsets, axis=1) - glyph_widths[:, :-1]
+            self.assertTrue(((gaps >= 2) & (gaps <= 8)).all())
+            np.testing.assert_array_equal(
+                70, glyph_offsets[:, -1] + glyph_widths[:, -1]
+            )
+
+    def test_crop_glyphs_image_generation(self):
+        for float32_atlas in (False, True):
+            nsg = NumberSequenceGenerator(
+                self.MNIST_filepath, crop_glyphs=True,
+                float32_atlas=float32_atlas
+            )
+            out = np.full((28, 70), -1, dtype=np.float32)
+            image = nsg.generate_numbers_sequence(
+                self.number_sequence, (2, 8), 70,
+                np.random.RandomState(self.seed), out=out
+            )
+            self.assertIs(out, image)
+            ink_columns = np.flatnonzero(image.any(axis=0))
+            self.assertEqual((0, 69), (ink_columns[0], ink_columns[-1]))
+            self.assertTrue(((image >= 0) & (image <= 1)).all())
+
+    def test_crop_glyphs_width_out_of_reach(self):
+        nsg = NumberSequenceGenerator(self.MNIST_filepath, crop_glyphs=True)
+        # the widest glyphs of 1 are 11 columns: 4 of them never span 60
+        with self.assertRaisesRegex(Exception, "limits"):
+            nsg.generate_numbers_sequence([1, 1, 1, 1], (2, 4), 60)
+        with self.assertRaisesRegex(Exception, "limits"):
+            nsg.stream(2, 4, (0, 0), 200)
+
+    def test_image_generation_out_allocates_no_image(self):
+        (spacing_range, image_width) = ((1, 400), 1000)
+        out = np.empty((28, image_width), dtype=np.float32)
+        for nsg in (self.nsg_eq, self.nsg_dir):
+            for i in range(3):  # warm up
+                nsg.generate_numbers_sequence(
+                    self.number_sequence, spacing_range, image_width, out=out
+                )
+            tracemalloc.start()
+            nsg.generate_numbers_sequence(
+                self.number_sequence, spacing_range, image_width, out=out
+            )
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            # only small index and spacing arrays, no image size temporaries
+            self.assertLess(peak, out.nbytes // 4)
+
+    def test_image_generation_batch_shape(self):
+        digit_sequences = [self.number_sequence, [1, 2, 3, 4], [0, 0, 0, 9]]
+        actual = self.nsg_dir.generate_numbers_sequence_batch(
+            digit_sequences, self.spacing_range, self.image_width
+        )
+        self.assertTupleEqual((3, 28, self.image_width), actual.shape)
+        self.assertEqual(np.float32, actual.dtype)
+        self.assertTrue(((actual >= 0) & (actual <= 1)).all())
+
+    def test_image_generation_batch_matches_single(self):
+        np.random.seed(self.seed)
+        expected = [
+            self.nsg_eq.generate_numbers_sequence(
+                self.number_sequence, self.spacing_range, self.image_width
+            )
+            for i in range(3)
+        ]
+        np.random.seed(self.seed)
+        actual = self.nsg_eq.generate_numbers_sequence_batch(
+            [self.number_sequence] * 3, self.spacing_range, self.image_width
+        )
+        np.testing.assert_array_equal(np.stack(expected), actual)
+
+    def test_image_generation_batch_one_matches_single(self):
+        for nsg in (self.nsg_eq, self.nsg_rs):
+            np.random.seed(self.seed)
+            expected = nsg.generate_numbers_sequence(
+                self.number_sequence, self.spacing_range, self.image_width
+            )
+            np.random.seed(self.seed)
+            actual = nsg.generate_numbers_sequence_batch(
+                [self.number_sequence], self.spacing_range, self.image_width
+            )
+            np.testing.assert_array_equal(expected, actual[0])
+
+    def test_digit_sequences_ragged(self):
+        with self.assertRaisesRegex(Exception, "equal length"):
+            self.nsg_eq.generate_numbers_sequence_batch(
+                [[1, 2, 3], [4, 5]], self.spacing_range, self.image_width
+            )
+
+    def test_digit_sequences_outside_range(self):
+        with self.assertRaisesRegex(Exception, "must be within"):
+            self.nsg_eq.generate_numbers_sequence_batch(
+                [[1, 2, 3], [4, 5, 10]], self.spacing_range, self.image_width
+            )
+
+    def test_padded_batch(self):
+        digit_sequences = [[3, 7, 8, 6], [1, 2], [5], [0, 9], [4, 4, 4, 4]]
+        image_widths = [118, 60, 28, 58, 118]
+        (images, labels, widths, lengths) = (
+            self.nsg_dir.generate_padded_sequence_batch(
+                digit_sequences, self.spacing_range, image_widths,
+                np.random.RandomState(self.seed)
+            )
+        )
+        self.assertTupleEqual((5, 28, 118), images.shape)
+        self.assertEqual(np.float32, images.dtype)
+        np.testing.assert_array_equal(
+            [[3, 7, 8, 6], [1, 2, 10, 10], [5, 10, 10, 10], [0, 9, 10, 10],
+             [4, 4, 4, 4]],
+            labels
+        )
+        np.testing.assert_array_equal(image_widths, widths)
+        np.testing.assert_array_equal([4, 2, 1, 2, 4], lengths)
+        for (image, width) in zip(images, widths):
+            self.assertTrue(image[:, :28].any())
+            self.assertFalse(image[:, width:].any())
+
+    def test_padded_batch_matches_grouped_batches(self):
+        # items of one (n_digits, width) shape are generated in one batch
+        (images, labels, widths, lengths) = (
+            self.nsg_eq.generate_padded_sequence_batch(
+                [[1, 2], [3, 4, 5], [6, 7]], self.spacing_range, [60, 90, 60],
+                np.random.RandomState(self.seed)
+            )
+        )
+        random_state = np.random.RandomState(self.seed)
+        expected_pairs = self.nsg_eq.generate_numbers_sequence_batch(
+            [[1, 2], [6, 7]], self.spacing_range, 60, random_state
+        )
+        expected_triple = self.nsg_eq.generate_numbers_sequence_batch(
+            [[3, 4, 5]], self.spacing_range, 90, random_state
+        )
+        np.testing.assert_array_equal(expected_pairs, images[[0, 2], :, :60])
+        np.testing.assert_array_equal(expected_triple[0], images[1])
+
+    def test_padded_batch_cropped_glyphs(self):
+        nsg = NumberSequenceGenerator(self.MNIST_filepath, crop_glyphs=True)
+        (images, labels, widths, lengths) = (
+            nsg.generate_padded_sequence_batch(
+                [[1, 2, 3], [4, 5]], self.spacing_range, [50, 40],
+                np.random.RandomState(self.seed), blank=-1
+            )
+        )
+        self.assertTupleEqual((2, 28, 50), images.shape)
+        np.testing.assert_array_equal([[1, 2, 3], [4, 5, -1]], labels)
+        self.assertTrue(images[1, :, :40].any(axis=0)[[0, 39]].all())
+        self.assertFalse(images[1, :, 40:].any())
+
+    def test_padded_batch_wrong_input(self):
+        generate = self.nsg_eq.generate_padded_sequence_batch
+        with self.assertRaisesRegex(Exception, "non empty"):
+            generate([[1, 2], []], self.spacing_range, 60)
+        with self.assertRaisesRegex(Exception, "must be within"):
+            generate([[1, 2], [11]], self.spacing_range, 60)
+        with self.assertRaisesRegex(Exception, "<blank>"):
+            generate([[1, 2]], self.spacing_range, 60, blank=0)
+        with self.assertRaisesRegex(Exception, "<image_widths>"):
+            generate([[1, 2], [3]], self.spacing_range, [60])
+        with self.assertRaisesRegex(Exception, "<image_width>"):
+            generate([[1, 2], [3]], self.spacing_range, [60, 1000])
+
+    def test_stream_n_steps(self):
+        batches = list(self.nsg_dir.stream(
+            5, len(self.number_sequence), self.spacing_range,
+            self.image_width, n_steps=3, n_workers=2
+        ))
+        self.assertEqual(3, len(batches))
+        for (images, labels) in batches:
+            self.assertTupleEqual((5, 28, self.image_width), images.shape)
+            self.assertTupleEqual((5, len(self.number_sequence)), labels.shape)
+            self.assertTrue(((labels >= 0) & (labels <= 9)).all())
+
+    def test_stream_close_stops_producers(self):
+        n_threads = threading.active_count()
+        batches = self.nsg_eq.stream(
+            2, len(self.number_sequence), self.spacing_range, self.image_width
+        )
+        next(batches)
+        batches.close()
+        self.assertEqual(n_threads, threading.active_count())
+
+    def test_stream_prefetches_first_batch(self):
+        nsg = NumberSequenceGenerator(self.MNIST_filepath, profile=True)
+        batches = nsg.stream(
+            2, len(self.number_sequence), self.spacing_range,
+            self.image_width, prefetch=1
+        )
+        deadline = time.time() + 10
+        while not nsg.stats()['counters'] and time.time() < deadline:
+            time.sleep(0.01)
+        # generated before the first batch is requested
+        self.assertGreaterEqual(nsg.stats()['counters']['images'], 2)
+        batches.close()
+
+    def test_stream_counts_all_workers(self):
+        nsg = NumberSequenceGenerator(self.MNIST_filepath, profile=True)
+        list(nsg.stream(
+            4, len(self.number_sequence), self.spacing_range,
+            self.image_width, n_steps=50, n_workers=4
+        ))
+        stats = nsg.stats()
+        self.assertEqual(50, stats['stages']['assembly']['calls'])
+        self.assertEqual(
+            nsg.dirichlet_stats()['candidates'],
+            stats['counters']['dirichlet_candidates']
+        )
+
+    def test_stream_wrong_input(self):
+        with self.assertRaisesRegex(Exception, "expected a positive <int>"):
+            self.nsg_eq.stream(
+                0, len(self.number_sequence), self.spacing_range,
+                self.image_width
+            )
+
+    def test_stream_raises_producer_errors(self):
+        nsg = NumberSequenceGenerator(
+            self.MNIST_filepath, 'dirichlet', dirichlet_max_draws=5
+        )
+        batches = nsg.stream(2, 4, self.spacing_range, 124, n_steps=2)
+        with self.assertRaisesRegex(Exception, "dirichlet spacing sampler"):
+            next(batches)
+
     def test_pixels_within_range(self):
         number_sequence_output = self.equidistant_number_sequence_output
         outside_range_check_list = [
@@ -223,6 +801,96 @@ class TestNumberSequenceGeneration(unittest.TestCase):
         for i in range(len(expected)):
             np.testing.assert_array_equal(expected[i], actual[i])
 
+    def test_digit_spacing_dirichlet_batch(self):
+        np.random.seed(self.seed)
+        spacing_range = (1, 4)
+        actual = self.nsg_dir._sample_spacing(4, 9, spacing_range, 500)
+        self.assertTupleEqual((500, 3), actual.shape)
+        self.assertTrue((actual.sum(axis=1) == 9).all())
+        self.assertTrue(
+            ((actual >= spacing_range[0]) & (actual <= spacing_range[1])).all()
+        )
+
+    def test_dirichlet_stats(self):
+        np.random.seed(self.seed)
+        self.nsg_dir._sample_spacing(4, 9, self.spacing_range, 100)
+        stats = self.nsg_dir.dirichlet_stats()
+        self.assertGreaterEqual(stats['accepted'], 100)
+        self.assertGreaterEqual(stats['candidates'], stats['accepted'])
+        self.assertAlmostEqual(
+            stats['accepted'] / stats['candidates'], stats['acceptance_rate']
+        )
+
+    def test_digit_spacing_dirichlet_budget(self):
+        nsg = NumberSequenceGenerator(
+            self.MNIST_filepath, 'dirichlet', dirichlet_max_draws=50
+        )
+        with self.assertRaisesRegex(Exception, "drew 50 candidates"):
+            nsg._calculate_digit_spacing(4, 12, self.spacing_range)
+        for max_draws in (0, -1, 2.5, None):
+            with self.assertRaisesRegex(Exception, "<dirichlet_max_draws>"):
+                NumberSequenceGenerator(
+                    self.MNIST_filepath, 'dirichlet',
+                    dirichlet_max_draws=max_draws
+                )
+
+    def test_stats_disabled(self):
+        self.nsg_dir.generate_numbers_sequence(
+            self.number_sequence, self.spacing_range, self.image_width
+        )
+        self.assertDictEqual(
+            {'stages': {}, 'counters': {}}, self.nsg_dir.stats()
+        )
+
+    def test_stats(self):
+        nsg = NumberSequenceGenerator(self.MNIST_filepath, profile=True)
+        nsg.generate_numbers_sequence(
+            self.number_sequence, self.spacing_range, self.image_width
+        )
+        nsg.generate_numbers_sequence_batch(
+            [self.number_sequence] * 3, self.spacing_range, self.image_width
+        )
+        stats = nsg.stats()
+        self.assertSetEqual(
+            {'load', 'select', 'spacing', 'assembly'}, set(stats['stages'])
+        )
+        self.assertEqual(1, stats['stages']['load']['calls'])
+        self.assertEqual(2, stats['stages']['assembly']['calls'])
+        self.assertEqual(4, stats['counters']['images'])
+        self.assertEqual(
+            nsg.dirichlet_stats()['candidates'],
+            stats['counters']['dirichlet_candidates']
+        )
+        self.assertEqual(
+            stats['counters']['dirichlet_candidates']
+            - nsg.dirichlet_stats()['accepted'],
+            stats['counters']['dirichlet_rejected']
+        )
+        nsg.reset_stats()
+        self.assertDictEqual({'stages': {}, 'counters': {}}, nsg.stats())
+        self.assertEqual(0, nsg.dirichlet_stats()['candidates'])
+
+    def test_stats_random_selection_options(self):
+        nsg = NumberSequenceGenerator(
+            self.MNIST_filepath, 'random_selection', profile=True
+        )
+        nsg._sample_spacing(4, 9, self.spacing_range, 10)
+        self.assertEqual(
+            len(list(nsg._permutations_w_constraints(3, 9, 1, 4))),
+            nsg.stats()['counters']['random_selection_options']
+        )
+
+    def test_stats_callback(self):
+        calls = []
+        nsg = NumberSequenceGenerator(
+            self.MNIST_filepath,
+            profile_callback=lambda stage, seconds: calls.append(stage)
+        )
+        nsg.generate_numbers_sequence(
+            self.number_sequence, self.spacing_range, self.image_width
+        )
+        self.assertListEqual(['load', 'select', 'spacing', 'assembly'], calls)
+
     def test_digit_spacing_uniformity_dirichlet(self):
         """test uniformity in a categorical variable"""
         p_val_thresh = 0.95
@@ -251,5 +919,144 @@ class TestNumberSequenceGeneration(unittest.TestCase):
         self.assertTrue(test[1] > p_val_thresh)
 
 
+class TestCommandLine(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.base_args = [
+            '3,7,8,6', '1', '4', '118', '-m', 'dirichlet', '-n', '5',
+            '--images',
+            os.path.abspath('tests/test_data/test-images.idx3-ubyte_A'),
+            '--labels',
+            os.path.abspath('tests/test_data/test-labels.idx3-ubyte_A'),
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _run(self, name, args):
+        output_dir = os.path.join(self.tmp_dir, name)
+        os.makedirs(output_dir, exist_ok=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            main(self.base_args + args + ['-o', output_dir])
+        files = {}
+        for filename in sorted(os.listdir(output_dir)):
+            with open(os.path.join(output_dir, filename), 'rb') as file:
+                files[filename] = file.read()
+        return files
+
+    def test_shard_sizes(self):
+        self.assertListEqual([3, 2, 2], _shard_sizes(7, 3))
+        self.assertListEqual([1, 1, 0], _shard_sizes(2, 3))
+
+    def test_shard_ranges(self):
+        self.assertListEqual(
+            [(0, 3), (3, 5), (5, 7)], _shard_ranges(7, 3)
+        )
+        self.assertListEqual(
+            [(0, 4), (4, 6), (6, 7)], _shard_ranges(7, 3, alignment=2)
+        )
+
+    def test_profile(self):
+        output_dir = os.path.join(self.tmp_dir, 'profile')
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main(self.base_args + ['-o', output_dir, '--profile'])
+        for stage in ('load', 'select', 'spacing', 'assembly', 'write'):
+            self.assertRegex(output.getvalue(), '\\n' + stage + ' +[0-9]+ ')
+        self.assertRegex(output.getvalue(), 'images +5\\n')
+
+    def test_epoch_digit_sampling(self):
+        files = self._run('epoch', [
+            '-f', 'npy', '-n', '22', '--digit-sampling', 'epoch', '-j', '2'
+        ])
+        images = np.load(io.BytesIO(files['images.npy']))
+        self.assertTupleEqual((22, 28, 118), images.shape)
+        self.assertTrue(images.any(axis=(1, 2)).all())
+
+    def test_npy_output(self):
+        self._run('npy', ['-j', '2', '-f', 'npy'])
+        images = np.load(os.path.join(self.tmp_dir, 'npy', 'images.npy'))
+        labels = np.load(os.path.join(self.tmp_dir, 'npy', 'labels.npy'))
+        self.assertTupleEqual((5, 28, 118), images.shape)
+        self.assertTrue(images[:, :, :28].any(axis=(1, 2)).all())
+        np.testing.assert_array_equal([[3, 7, 8, 6]] * 5, labels)
+
+    def test_npz_output_matches_npy(self):
+        npy = self._run('npy', ['-j', '2', '-f', 'npy', '--seed', '3'])
+        npz = self._run(
+            'npz', ['-j', '2', '-f', 'npz', '--seed', '3', '--shard-size', '3']
+        )
+        self.assertListEqual(['shard-00000.npz', 'shard-00001.npz'], list(npz))
+        images = np.concatenate([
+            np.load(io.BytesIO(npz[filename]))['images'] for filename in npz
+        ])
+        np.testing.assert_array_equal(
+            np.load(io.BytesIO(npy['images.npy'])), images
+        )
+
+    def test_workers_output_count(self):
+        files = self._run('parallel', ['-j', '2'])
+        self.assertEqual(5, len(files))
+
+    def test_seeded_output_reproducible(self):
+        first = self._run('first', ['-j', '2', '--seed', '3'])
+        second = self._run('second', ['-j', '2', '--seed', '3'])
+        self.assertDictEqual(first, second)
+        other = self._run('other', ['-j', '2', '--seed', '4'])
+        self.assertFalse(set(first) & set(other))
+
+    def test_build_resume(self):
+        build_args = ['--build', '--seed', '3', '--shard-size', '2']
+        first = self._run('build', build_args)
+        self.assertListEqual(
+            ['manifest.json', 'shard-00000.npz', 'shard-00001.npz',
+             'shard-00002.npz'],
+            list(first)
+        )
+        shard_path = os.path.join(self.tmp_dir, 'build', 'shard-00001.npz')
+        os.remove(shard_path)
+        mtime = os.path.getmtime(
+            os.path.join(self.tmp_dir, 'build', 'shard-00000.npz')
+        )
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main(self.base_args + build_args + [
+                '-o', os.path.join(self.tmp_dir, 'build')
+            ])
+        self.assertIn('Reused 2 of 3', output.getvalue())
+        # only the missing shard is regenerated, bit-identically
+        self.assertEqual(mtime, os.path.getmtime(
+            os.path.join(self.tmp_dir, 'build', 'shard-00000.npz')
+        ))
+        self.assertDictEqual(first, self._run('build', build_args))
+
+    def test_build_independent_of_workers(self):
+        build_args = ['--build', '--seed', '3', '--shard-size', '2']
+        self.assertDictEqual(
+            self._run('serial', build_args),
+            self._run('parallel', build_args + ['-j', '2'])
+        )
+
+    def test_build_verify(self):
+        build_args = ['--build', '--shard-size', '2']  # recorded seed
+        first = self._run('build', build_args)
+        shard_path = os.path.join(self.tmp_dir, 'build', 'shard-00002.npz')
+        with open(shard_path, 'r+b') as shard_file:
+            shard_file.seek(-1, os.SEEK_END)
+            shard_file.write(b'\x01')  # same size, different content
+        self.assertNotEqual(first, self._run('build', build_args))
+        self.assertDictEqual(
+            first, self._run('build', build_args + ['--verify'])
+        )
+
+    def test_build_wrong_input(self):
+        self._run('build', ['--build', '--seed', '3'])
+        with self.assertRaisesRegex(Exception, "'shard_size'"):
+            self._run('build', ['--build', '--seed', '3', '--shard-size', '3'])
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                self._run('png', ['--build', '-f', 'png'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,108 @@
+import os
+import json
+import shutil
+import struct
+import asyncio
+import tempfile
+import unittest
+import threading
+import numpy as np
+
+from augmentation.sequence_generators import NumberSequenceGenerator
+from augmentation.service import GenerationClient, GenerationServer
+
+
+class TestGenerationService(unittest.TestCase):
+    def setUp(self):
+        self.MNIST_filepath = {
+            'images': 'tests/test_data/test-images.idx3-ubyte_A',
+            'labels': 'tests/test_data/test-labels.idx3-ubyte_A'
+        }
+        self.tmp_dir = tempfile.mkdtemp()
+        self.generator = NumberSequenceGenerator(self.MNIST_filepath)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _serve(self, address, **kwargs):
+        """Runs a server on its own event loop thread until cleanup."""
+        server = GenerationServer(self.generator, address, **kwargs)
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(server.start())
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+        self.addCleanup(stop)
+        return server
+
+    def test_unix_socket(self):
+        server = self._serve(os.path.join(self.tmp_dir, 'service.sock'))
+        with GenerationClient(server.address) as client:
+            for n_sequences in (1, 3):  # one connection, several requests
+                images = client.generate(
+                    [[3, 7, 8, 6]] * n_sequences, (1, 4), 118
+                )
+                self.assertTupleEqual((n_sequences, 28, 118), images.shape)
+                self.assertEqual(np.float32, images.dtype)
+                self.assertTrue(images[:, :, :28].any(axis=(1, 2)).all())
+        self.assertEqual(2, server.stats()['requests'])
+
+    def test_tcp(self):
+        server = self._serve(('127.0.0.1', 0))
+        with GenerationClient(server.address) as client:
+            images = client.generate([[1, 2]], (0, 10), 60)
+        self.assertTupleEqual((1, 28, 60), images.shape)
+
+    def test_micro_batching(self):
+        server = self._serve(
+            os.path.join(self.tmp_dir, 'service.sock'), max_delay=0.2,
+            max_batch_size=8, seed=0
+        )
+        results = []
+
+        def request():
+            with GenerationClient(server.address) as client:
+                results.append(client.generate([[1, 2, 3]] * 2, (1, 4), 90))
+
+        threads = [threading.Thread(target=request) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4, len(results))
+        self.assertDictEqual(
+            {'requests': 4, 'batches': 1, 'sequences': 8}, server.stats()
+        )
+
+    def test_errors(self):
+        server = self._serve(os.path.join(self.tmp_dir, 'service.sock'))
+        with GenerationClient(server.address) as client:
+            with self.assertRaisesRegex(Exception, "<image_width>"):
+                client.generate([[1, 2]], (0, 10), 1000)
+            with self.assertRaisesRegex(Exception, "equal length"):
+                client.generate([[1, 2], [3]], (0, 10), 60)
+            # errors leave the connection usable
+            self.assertTupleEqual(
+                (1, 28, 60), client.generate([[1, 2]], (0, 10), 60).shape
+            )
+
+    def test_malformed_message(self):
+        server = self._serve(os.path.join(self.tmp_dir, 'service.sock'))
+        client = GenerationClient(server.address)
+        client._connect()
+        client._socket.sendall(struct.pack('>I', 9) + b'{not json')
+        (length,) = struct.unpack('>I', client._receive(4))
+        self.assertIn('error', json.loads(client._receive(length)))
+        # the server closes connections it cannot resynchronize
+        self.assertEqual(b'', client._socket.recv(1))
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
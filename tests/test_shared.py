@@ -0,0 +1,94 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+import numpy as np
+
+from augmentation.datasets import SequenceDataset
+from augmentation.sequence_generators import NumberSequenceGenerator
+
+
+def _ignore_stage(stage, seconds):
+    pass
+
+
+def _generate(generator, image_width=90):
+    return generator.generate_numbers_sequence_batch(
+        [[1, 2, 3]] * 4, (1, 4), image_width, np.random.RandomState(0)
+    )
+
+
+class TestSharedGeneratorData(unittest.TestCase):
+    def setUp(self):
+        self.MNIST_filepath = {
+            'images': 'tests/test_data/test-images.idx3-ubyte_A',
+            'labels': 'tests/test_data/test-labels.idx3-ubyte_A'
+        }
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_attached_generator(self):
+        nsg = NumberSequenceGenerator(self.MNIST_filepath)
+        with nsg.share(self.tmp_dir) as shared_data:
+            attached = NumberSequenceGenerator(shared_data=shared_data)
+            self.assertEqual(nsg.n_imgs, attached.n_imgs)
+            # arrays are mapped from the shared files, not copied
+            self.assertIsInstance(attached._images.base, np.memmap)
+            self.assertFalse(attached._images.flags.writeable)
+            np.testing.assert_array_equal(_generate(nsg), _generate(attached))
+        self.assertFalse(os.path.exists(shared_data.path))
+
+    def test_shared_options(self):
+        for (options, image_width) in (({'float32_atlas': True}, 90),
+                                       ({'crop_glyphs': True}, 50)):
+            nsg = NumberSequenceGenerator(self.MNIST_filepath, **options)
+            with nsg.share(self.tmp_dir) as shared_data:
+                attached = NumberSequenceGenerator(shared_data=shared_data)
+                self.assertEqual(nsg.float32_atlas, attached.float32_atlas)
+                self.assertEqual(nsg.crop_glyphs, attached.crop_glyphs)
+                np.testing.assert_array_equal(
+                    _generate(nsg, image_width),
+                    _generate(attached, image_width)
+                )
+
+    def test_pickle(self):
+        nsg = NumberSequenceGenerator(self.MNIST_filepath)
+        with nsg.share(self.tmp_dir) as shared_data:
+            attached = NumberSequenceGenerator(
+                shared_data=shared_data, spacing_method='equidistant',
+                profile_callback=_ignore_stage
+            )
+            data = pickle.dumps(attached)
+            # only the handle and options are pickled, not the arrays
+            self.assertLess(len(data), nsg._images.nbytes)
+            unpickled = pickle.loads(data)
+            self.assertEqual('equidistant', unpickled.method)
+            self.assertIs(_ignore_stage, unpickled.profiler.callback)
+            np.testing.assert_array_equal(
+                _generate(attached), _generate(unpickled)
+            )
+
+    def test_worker_processes(self):
+        nsg = NumberSequenceGenerator(self.MNIST_filepath)
+        with nsg.share(self.tmp_dir) as shared_data:
+            dataset = SequenceDataset(
+                NumberSequenceGenerator(shared_data=shared_data), 4, 3,
+                (1, 4), 90, seed=0
+            )
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(2) as pool:
+                images = pool.map(_first_image, [dataset] * 2)
+        np.testing.assert_array_equal(images[0], images[1])
+        np.testing.assert_array_equal(images[0], dataset[0][0])
+
+
+def _first_image(dataset):
+    return dataset[0][0]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import pickle
+import unittest
+import numpy as np
+
+from augmentation.datasets import SequenceDataset
+from augmentation.sequence_generators import NumberSequenceGenerator
+from augmentation.transforms import (
+    AffineJitter, Compose, ElasticDistortion, GaussianNoise, StrokeThickness,
+    Transform, bilinear_sample, coordinate_grid
+)
+
+
+class RecordSpans(Transform):
+    def __init__(self):
+        super().__init__()
+        self.spans = []
+
+    def apply(self, images, digit_spans, random_state):
+        self.spans.append(digit_spans)
+        return images
+
+
+class TestTransforms(unittest.TestCase):
+    def setUp(self):
+        self.images = np.zeros((4, 28, 60), dtype=np.float32)
+        self.images[:, 8:20, 6:20] = 1
+        self.images[:, 4:24, 38:44] = 0.5
+        self.digit_spans = np.tile([[[0, 28], [32, 60]]], (4, 1, 1))
+
+    def test_coordinate_grid(self):
+        (rows, columns) = coordinate_grid(3, 5)
+        self.assertIs(rows, coordinate_grid(3, 5)[0])
+        self.assertFalse(columns.flags.writeable)
+        np.testing.assert_array_equal([0, 1, 2, 3, 4], columns[2])
+        np.testing.assert_array_equal([0, 1, 2], rows[:, 4])
+
+    def test_bilinear_sample(self):
+        (rows, columns) = coordinate_grid(28, 60)
+        np.testing.assert_array_equal(
+            self.images, bilinear_sample(self.images, rows, columns)
+        )
+        shifted = bilinear_sample(self.images, rows - 0.5, columns)
+        np.testing.assert_array_equal([0, 0.5, 1], shifted[0, 7:10, 6])
+        # coordinates outside the images read black
+        self.assertFalse(
+            bilinear_sample(self.images, rows, columns - 100).any()
+        )
+
+    def test_identity(self):
+        stages = [
+            AffineJitter(0, (1, 1), 0, (0, 0)),
+            AffineJitter(0, (1, 1), 0, (0, 0), per_digit=True),
+            ElasticDistortion(alpha=0),
+            StrokeThickness(max_radius=0),
+            GaussianNoise(std=(0, 0)),
+        ]
+        for stage in stages:
+            np.testing.assert_allclose(
+                self.images,
+                stage(self.images.copy(), self.digit_spans),
+                atol=1e-6
+            )
+
+    def test_seeded_stage(self):
+        for stage_class in (AffineJitter, ElasticDistortion, GaussianNoise):
+            outputs = [
+                stage_class(seed=3)(
+                    self.images.copy(), random_state=np.random.RandomState(i)
+                )
+                for i in range(2)
+            ]
+            np.testing.assert_array_equal(outputs[0], outputs[1])
+            unseeded = stage_class()(
+                self.images.copy(), random_state=np.random.RandomState(0)
+            )
+            self.assertFalse(np.array_equal(outputs[0], unseeded))
+
+    def test_probability(self):
+        transformed = GaussianNoise(std=(0.5, 0.5), probability=0)(
+            self.images.copy()
+        )
+        np.testing.assert_array_equal(self.images, transformed)
+        transformed = GaussianNoise(std=(0.5, 0.5), probability=0.5, seed=1)(
+            self.images.copy()
+        )
+        changed = (transformed != self.images).any(axis=(1, 2))
+        self.assertTrue(changed.any() and not changed.all())
+        with self.assertRaisesRegex(Exception, "<probability>"):
+            GaussianNoise(probability=2)
+        with self.assertRaisesRegex(Exception, "<std>"):
+            GaussianNoise(std=(0.2, 0.1))
+
+    def test_per_digit_affine(self):
+        images = self.images.copy()
+        images[:, :, 32:] = 0  # only the first digit has ink
+        transformed = AffineJitter(rotation=45, per_digit=True, seed=0)(
+            images, self.digit_spans
+        )
+        self.assertTrue(transformed[:, :, :30].any(axis=(1, 2)).all())
+        # digits are transformed within their own column band
+        self.assertFalse(transformed[:, :, 30:].any())
+        with self.assertRaisesRegex(Exception, "<digit_spans>"):
+            AffineJitter(per_digit=True)(self.images.copy())
+
+    def test_elastic_field_bank(self):
+        stage = ElasticDistortion(n_fields=4)
+        fields = stage.field_bank(28, 60)
+        self.assertTupleEqual((4, 2, 28, 60), fields.shape)
+        self.assertIs(fields, stage.field_bank(28, 60))
+        # banks are drawn alike in every process
+        np.testing.assert_array_equal(
+            fields, ElasticDistortion(n_fields=4).field_bank(28, 60)
+        )
+        unpickled = pickle.loads(pickle.dumps(stage))
+        self.assertDictEqual({}, unpickled._field_banks)
+        transformed = stage(self.images.copy())
+        self.assertTrue(((transformed >= 0) & (transformed <= 1)).all())
+        self.assertFalse(np.array_equal(self.images, transformed))
+
+    def test_stroke_thickness(self):
+        ink = self.images.sum()
+        thicker = StrokeThickness(seed=0)
+        thicker.apply = lambda images, spans, random_state: thicker._morph(
+            images, 1, np.maximum
+        )
+        self.assertGreater(thicker(self.images.copy()).sum(), ink)
+        thinner = StrokeThickness()._morph(self.images.copy(), 1, np.minimum)
+        self.assertLess(thinner.sum(), ink)
+
+    def test_gaussian_noise(self):
+        transformed = GaussianNoise(std=(0.3, 0.3), seed=0)(self.images.copy())
+        self.assertTrue(((transformed >= 0) & (transformed <= 1)).all())
+        # mid grey pixels are rarely clipped
+        noise = (transformed - self.images)[:, 4:24, 38:44]
+        self.assertAlmostEqual(0.3, np.std(noise), 1)
+
+
+class TestGeneratorTransform(unittest.TestCase):
+    def setUp(self):
+        self.MNIST_filepath = {
+            'images': 'tests/test_data/test-images.idx3-ubyte_A',
+            'labels': 'tests/test_data/test-labels.idx3-ubyte_A'
+        }
+        self.transform = Compose([
+            AffineJitter(per_digit=True), ElasticDistortion(alpha=8),
+            StrokeThickness(probability=0.5), GaussianNoise()
+        ])
+
+    def test_digit_spans(self):
+        for crop_glyphs in (False, True):
+            record = RecordSpans()
+            nsg = NumberSequenceGenerator(
+                self.MNIST_filepath, crop_glyphs=crop_glyphs, transform=record
+            )
+            nsg.generate_numbers_sequence_batch(
+                [[1, 2, 3]] * 2, (1, 4), 50 if crop_glyphs else 90
+            )
+            nsg.generate_numbers_sequence(
+                [1, 2], (1, 4), 30 if crop_glyphs else 60
+            )
+            (spans, single_spans) = record.spans
+            self.assertTupleEqual((2, 3, 2), spans.shape)
+            self.assertTupleEqual((1, 2, 2), single_spans.shape)
+            self.assertTrue((spans[:, 1:, 0] > spans[:, :-1, 1]).all())
+            if not crop_glyphs:
+                np.testing.assert_array_equal(28, np.diff(spans, axis=-1))
+
+    def test_image_generation(self):
+        nsg = NumberSequenceGenerator(
+            self.MNIST_filepath, transform=self.transform, profile=True
+        )
+        plain = NumberSequenceGenerator(self.MNIST_filepath)
+        images = [
+            generator.generate_numbers_sequence_batch(
+                [[3, 7, 8, 6]] * 3, (1, 4), 118, np.random.RandomState(0)
+            )
+            for generator in (nsg, nsg, plain)
+        ]
+        np.testing.assert_array_equal(images[0], images[1])
+        self.assertFalse(np.array_equal(images[0], images[2]))
+        self.assertEqual(np.float32, images[0].dtype)
+        self.assertTrue(((images[0] >= 0) & (images[0] <= 1)).all())
+        self.assertEqual(2, nsg.stats()['stages']['transform']['calls'])
+
+    def test_dataset_items_reproducible(self):
+        nsg = NumberSequenceGenerator(
+            self.MNIST_filepath, transform=self.transform
+        )
+        dataset = SequenceDataset(nsg, 10, 3, (1, 4), 90, seed=0)
+        (image, labels) = dataset[4]
+        dataset[2]
+        np.testing.assert_array_equal(image, dataset[4][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
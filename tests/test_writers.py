@@ -0,0 +1,137 @@
+import os
+import zlib
+import struct
+import pickle
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from augmentation.idx import read_idx
+from augmentation.writers import PNG_SIGNATURE, encode_png, get_writer
+
+
+class TestDatasetWriters(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.n_images = 5
+        self.image_shape = (4, 6)
+        self.images = (
+            np.arange(5 * 4 * 6).reshape(5, 4, 6) % 256 / 255
+        ).astype(np.float32)
+        self.labels = np.arange(15).reshape(5, 3) % 10
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, output_format, ranges, **kwargs):
+        writer = get_writer(
+            output_format, self.tmp_dir, self.n_images, self.image_shape,
+            self.labels.shape[1], **kwargs
+        )
+        writer.create()
+        for (start, stop) in ranges:
+            # writers travel to worker processes by pickle
+            worker_writer = pickle.loads(pickle.dumps(writer))
+            worker_writer.write(
+                start, self.images[start:stop], self.labels[start:stop]
+            )
+            worker_writer.close()
+        return writer
+
+    def test_invalid_format(self):
+        with self.assertRaisesRegex(Exception, "Invalid <output_format>"):
+            get_writer('tiff', self.tmp_dir, 1, (28, 28), 1)
+
+    def test_npy_writer(self):
+        self._write('npy', [(0, 2), (2, 5)])
+        np.testing.assert_array_equal(
+            self.images, np.load(os.path.join(self.tmp_dir, 'images.npy'))
+        )
+        np.testing.assert_array_equal(
+            self.labels, np.load(os.path.join(self.tmp_dir, 'labels.npy'))
+        )
+
+    def test_idx_writer(self):
+        self._write('idx', [(3, 5), (0, 3)])
+        images = read_idx(os.path.join(self.tmp_dir, 'images.idx3-ubyte'))
+        labels = read_idx(os.path.join(self.tmp_dir, 'labels.idx2-ubyte'))
+        self.assertEqual(np.uint8, images.dtype)
+        np.testing.assert_array_equal(
+            np.rint(self.images * 255), images
+        )
+        np.testing.assert_array_equal(self.labels, labels)
+
+    def test_npz_writer(self):
+        self._write('npz', [(0, 2), (2, 4), (4, 5)], shard_size=2)
+        shard_files = sorted(os.listdir(self.tmp_dir))
+        self.assertListEqual(
+            ['shard-00000.npz', 'shard-00001.npz', 'shard-00002.npz'],
+            shard_files
+        )
+        shards = [
+            np.load(os.path.join(self.tmp_dir, filename))
+            for filename in shard_files
+        ]
+        np.testing.assert_array_equal(
+            self.images, np.concatenate([x['images'] for x in shards])
+        )
+        np.testing.assert_array_equal(
+            self.labels, np.concatenate([x['labels'] for x in shards])
+        )
+
+    def test_npz_writer_unaligned(self):
+        with self.assertRaisesRegex(Exception, "one whole shard"):
+            self._write('npz', [(1, 3)], shard_size=2)
+
+    def test_png_writer(self):
+        self._write('png', [(0, 5)])
+        self.assertEqual(5, len(os.listdir(self.tmp_dir)))
+
+
+class TestPngEncoder(unittest.TestCase):
+    def _decode(self, png_bytes):
+        """Minimal decoder for the unfiltered grayscale pngs written."""
+        self.assertEqual(PNG_SIGNATURE, png_bytes[:8])
+        (position, chunks) = (8, {})
+        while position < len(png_bytes):
+            (length,) = struct.unpack('>I', png_bytes[position:position + 4])
+            chunk_type = png_bytes[position + 4:position + 8]
+            data = png_bytes[position + 8:position + 8 + length]
+            (crc,) = struct.unpack(
+                '>I', png_bytes[position + 8 + length:position + 12 + length]
+            )
+            self.assertEqual(zlib.crc32(chunk_type + data) & 0xFFFFFFFF, crc)
+            chunks[chunk_type] = data
+            position += 12 + length
+        (width, height, bit_depth, color_type) = struct.unpack(
+            '>IIBB', chunks[b'IHDR'][:10]
+        )
+        self.assertEqual((8, 0), (bit_depth, color_type))
+        self.assertIn(b'IEND', chunks)
+        scanlines = np.frombuffer(
+            zlib.decompress(chunks[b'IDAT']), dtype=np.uint8
+        ).reshape(height, width + 1)
+        self.assertFalse(scanlines[:, 0].any())
+        return scanlines[:, 1:]
+
+    def test_encode_png(self):
+        image = np.array([[0, 0.5, 1], [1, 0.25, 0]], dtype=np.float32)
+        expected = np.array([[255, 127, 0], [0, 191, 255]], dtype=np.uint8)
+        np.testing.assert_array_equal(
+            expected, self._decode(encode_png(image))
+        )
+
+    def test_encode_png_not_inverted(self):
+        image = np.array([[0, 0.5, 1]], dtype=np.float32)
+        np.testing.assert_array_equal(
+            [[0, 128, 255]], self._decode(encode_png(image, invert=False))
+        )
+
+    def test_encode_png_wrong_shape(self):
+        with self.assertRaisesRegex(Exception, "expected a 2D array"):
+            encode_png(np.zeros((2, 3, 4)))
+
+
+if __name__ == '__main__':
+    unittest.main()